@@ -1,75 +1,268 @@
+"""
+Tokenize filtered text shards into uint16 GPT-2 .bin files for training.
+
+Every first pass output is tokenized once into `<name>.bin`, from its `.docs` store
+when it was written with one and the store is complete, otherwise from the shards
+listed by its manifest. Outputs without either are still being written and are skipped.
+
+Every line of a shard is encoded on its own, as before, but lines are streamed from
+the (possibly compressed) shard and encoded BATCH_LINES at a time with the fast
+tokenizer's batch API. Each batch is converted to uint16 and appended to the output
+right away, so memory does not depend on the shard size. The output is truncated
+after the last <|endoftext|>, whose position is tracked while writing. Each file
+reports its tokens/sec and the peak RSS of its worker.
+
+With a token cache (`--cache-dir`, see `cs336_data.token_cache`), the ids of every
+document are looked up by the hash of its text first, and only documents that are not
+in the cache are encoded and added to it, so re-tokenizing a slightly changed corpus
+mostly copies ids. The cache keeps a second copy of every id and is never pruned, so
+it is off by default.
+
+With `--encoder cached_bpe`, lines are encoded with `cs336_data.bpe.CachedBPE`,
+which gives the same ids as the Hugging Face tokenizer and caches the ids of
+repeated pretokens.
+
+    python -m cs336_data.batch_tokenize --input-dir cc_filtered --output-dir cc_tokenized
+"""
+
 import os
-import pathlib
-import submitit
-from tqdm import tqdm
 import glob
+import io
+import time
+import resource
+import argparse
+import itertools
+from typing import Iterator, Optional
 
 import multiprocessing
 import numpy as np
 from tqdm import tqdm
-from transformers import AutoTokenizer
+from cs336_data.shards import EOT, is_docstore, iter_documents, list_shards, open_shard, output_stem
+from cs336_data.docstore import docstore_complete
+from cs336_data.token_shards import get_tokenizer
+from cs336_data.token_cache import TokenCache, document_hash
+from cs336_data.bpe import get_cached_bpe
+
+INPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_filtered"
+OUTPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_tokenized"
+
+# lines encoded with one call to the tokenizer
+BATCH_LINES = 1024
+
+# "huggingface" for the fast tokenizer, or "cached_bpe" for the encoder with a pretoken cache
+ENCODER = "huggingface"
+ENCODERS = ["huggingface", "cached_bpe"]
+
+# token ids of previously tokenized documents, e.g. /data/c-cye/assignment4-data/token_cache,
+# None to always encode
+TOKEN_CACHE_DIRECTORY = None
+
+_TOKEN_CACHES = {}
+
+
+def list_input_files(input_dir: str) -> list[str]:
+    """one input per finished first pass output, so documents are not tokenized twice: its .docs store if it
+    is complete, otherwise its shard manifest. Shards are renamed into place before their output is
+    finished, only the manifest marks it as complete, so shards are never listed on their own."""
+    outputs = {}
+    for path in glob.glob(os.path.join(input_dir, '*.docs')):
+        if docstore_complete(path):
+            outputs[output_stem(path)] = path
+    for path in glob.glob(os.path.join(input_dir, '*.shards.json')):
+        outputs.setdefault(output_stem(path), path)
+    input_paths = list(outputs.values())
+    # sort in order of creation time
+    input_paths.sort(key=lambda x: os.path.getctime(x))
+    return input_paths
 
-input_paths = glob.glob('/data/c-cye/assignment4-data/cc_filtered/*.txt')
-# sort in order of creation time
-input_paths.sort(key=lambda x: os.path.getctime(x))
+def iter_lines(input_path: str) -> Iterator[str]:
+    """stream the lines of a shard or of every shard of a manifest, shards may be compressed, decompress transparently"""
+    if is_docstore(input_path):
+        # same lines as in a text shard
+        for doc in iter_documents(input_path):
+            yield from f"{doc}{EOT}\n".splitlines(keepends=True)
+        return
+    for shard_path in list_shards(input_path):
+        with io.TextIOWrapper(open_shard(shard_path), encoding='utf-8') as f:
+            yield from f
 
-output_dir = "/data/c-cye/assignment4-data/cc_tokenized"
-os.makedirs(output_dir, exist_ok=True)
+def iter_document_batches(input_path: str, batch_lines: int = BATCH_LINES) -> Iterator[list[list[str]]]:
+    """group the lines of a shard into documents, each ending with the line holding its <|endoftext|>,
+    and the documents into batches of at least batch_lines lines"""
+    batch, doc, n_lines = [], [], 0
+    for line in iter_lines(input_path):
+        doc.append(line)
+        n_lines += 1
+        if EOT in line:
+            batch.append(doc)
+            doc = []
+            if n_lines >= batch_lines:
+                yield batch
+                batch, n_lines = [], 0
+    if doc:
+        batch.append(doc)
+    if batch:
+        yield batch
 
-tokenizer = AutoTokenizer.from_pretrained("gpt2")
-print("Tokenizer loaded")
+def encode_documents(tokenizer, docs: list[list[str]]) -> list[np.ndarray]:
+    """encode every line with one batch call, and join the ids of the lines of each document"""
+    lines = [line for doc in docs for line in doc]
+    batch_ids = tokenizer(lines, verbose=False)["input_ids"] if lines else []
+    doc_ids, start = [], 0
+    for doc in docs:
+        line_ids = batch_ids[start:start + len(doc)]
+        start += len(doc)
+        doc_ids.append(np.fromiter(itertools.chain.from_iterable(line_ids), dtype=np.uint16,
+                                   count=sum(len(ids) for ids in line_ids)))
+    return doc_ids
 
+def get_encoder(encoder: str = ENCODER):
+    """tokenizer used to encode lines, loaded once per process"""
+    if encoder == "huggingface":
+        return get_tokenizer()
+    if encoder == "cached_bpe":
+        return get_cached_bpe()
+    raise ValueError(f"Unknown encoder {encoder}, expected one of {ENCODERS}")
 
-def tokenize_file(input_path: str):
-    """Process a single file and save the tokenized output"""
+def get_token_cache(cache_dir: str) -> TokenCache:
+    """open the cache once per process"""
+    if cache_dir not in _TOKEN_CACHES:
+        _TOKEN_CACHES[cache_dir] = TokenCache(cache_dir, get_tokenizer().name_or_path)
+    return _TOKEN_CACHES[cache_dir]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def tokenize_file(input_path: str, output_dir: str = OUTPUT_DIRECTORY, batch_lines: int = BATCH_LINES,
+                  cache_dir: Optional[str] = None, encoder: str = ENCODER) -> dict:
+    """Process a single file and save the tokenized output, returns the number of tokens and throughput"""
     # create output path
-    filename = os.path.basename(input_path)
-    output_path = os.path.join(output_dir, filename.replace('.txt', '.bin'))
+    filename = os.path.basename(input_path.rstrip("/"))
+    output_path = os.path.join(output_dir, f"{output_stem(filename)}.bin")
+    result = {"path": input_path, "pid": os.getpid(), "tokens": 0, "seconds": 0.0, "cached_docs": 0, "encoded_docs": 0}
 
     if os.path.exists(output_path):
         print(f"Skipping {input_path} because it already exists")
-        return 0
+        return result
 
     print(f"Tokenizing {input_path}...")
-    
-    with open(input_path) as f:
-        lines = f.readlines()
-    
-    # tokenize all lines in this file
-    results = []
-    for line in lines:
-        results.append(tokenizer.encode(line))
-    
-    # flatten all token IDs into a single array
-    all_ids = [token_id for sublist in results for token_id in sublist]
-    # truncate up to last <|endoftext|>
-    last_eos = len(all_ids) - 1 - all_ids[::-1].index(tokenizer.eos_token_id)
-    all_ids = all_ids[:last_eos + 1] # include the <|endoftext|>
-
-    print(f"Tokenized {input_path} into {len(all_ids)} tokens")
-    
-    # save as binary file
-    ids_array = np.array(all_ids, dtype=np.uint16)
-    # overwrite existing file
+    tokenizer = get_encoder(encoder)
+    cache = get_token_cache(cache_dir) if cache_dir else None
+    segment = cache.new_segment(output_stem(filename)) if cache is not None else None
+    start_time = time.time()
 
-    if os.path.exists(output_path):
-        os.remove(output_path)
-    ids_array.tofile(output_path)
-    
-    return len(all_ids)
+    # encode batches of lines and append them to a temporary file
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    n_tokens = 0
+    # end of the last <|endoftext|> written so far
+    end = 0
+    with open(tmp_path, "wb") as f:
+        for docs in iter_document_batches(input_path, batch_lines):
+            if cache is not None:
+                # only encode the documents that are not cached yet
+                hashes = [document_hash("".join(doc)) for doc in docs]
+                keys = np.array([key for key, _ in hashes], dtype=np.uint64)
+                checks = np.array([check for _, check in hashes], dtype=np.uint64)
+                doc_ids = cache.lookup(keys, checks)
+                missing = [i for i, ids in enumerate(doc_ids) if ids is None]
+                for i, ids in zip(missing, encode_documents(tokenizer, [docs[i] for i in missing])):
+                    doc_ids[i] = ids
+                    segment.add(hashes[i][0], hashes[i][1], ids)
+                result["cached_docs"] += len(docs) - len(missing)
+                result["encoded_docs"] += len(missing)
+            else:
+                doc_ids = encode_documents(tokenizer, docs)
+                result["encoded_docs"] += len(docs)
+            ids = np.concatenate(doc_ids)
+            eos = np.flatnonzero(ids == tokenizer.eos_token_id)
+            if len(eos) > 0:
+                end = n_tokens + int(eos[-1]) + 1
+            f.write(ids.tobytes())
+            n_tokens += len(ids)
+
+        # truncate up to last <|endoftext|>, including it
+        f.truncate(end * 2)
+    if end == 0:
+        print(f"Warning: no {EOT} in {input_path}, output is empty")
+    if segment is not None:
+        # the cache is committed before the output, so a finished output never has missing cache entries
+        index_path = segment.close()
+        if index_path:
+            cache.add_segment(index_path)
+    os.replace(tmp_path, output_path)
 
-def process_files_parallel():
+    result["tokens"] = end
+    result["seconds"] = time.time() - start_time
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(f"Tokenized {input_path} into {end} tokens in {result['seconds']:.1f}s "
+          f"({end / max(result['seconds'], 1e-9):.0f} tokens/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+          f"{result['cached_docs']} cached and {result['encoded_docs']} encoded documents)")
+    return result
+
+def _tokenize_file_job(args: tuple) -> dict:
+    return tokenize_file(*args)
+
+def process_files_parallel(input_paths: list[str], output_dir: str = OUTPUT_DIRECTORY,
+                           n_procs: int = None, batch_lines: int = BATCH_LINES,
+                           cache_dir: Optional[str] = TOKEN_CACHE_DIRECTORY, encoder: str = ENCODER) -> int:
     """process all files using multiprocessing"""
-    with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
+    os.makedirs(output_dir, exist_ok=True)
+    n_procs = n_procs or multiprocessing.cpu_count()
+
+    # load the tokenizer and the cache index before forking so that workers share them
+    get_encoder(encoder)
+    print("Tokenizer loaded")
+    if cache_dir in _TOKEN_CACHES:
+        # pick up segments written since the cache was opened
+        _TOKEN_CACHES[cache_dir].load()
+    elif cache_dir:
+        get_token_cache(cache_dir)
+
+    jobs = [(input_path, output_dir, batch_lines, cache_dir, encoder) for input_path in input_paths]
+    with multiprocessing.Pool(n_procs) as pool:
         # process files in parallel
         results = list(tqdm(
-            pool.imap(tokenize_file, input_paths),
+            pool.imap(_tokenize_file_job, jobs),
             total=len(input_paths),
             desc="Processing files"
         ))
-    
-    total_tokens = sum(results)
+
+    # throughput and memory of each worker
+    workers = {}
+    for result in results:
+        worker = workers.setdefault(result["pid"], {"files": 0, "tokens": 0, "seconds": 0.0, "peak_rss_mb": 0.0})
+        worker["files"] += 1
+        worker["tokens"] += result["tokens"]
+        worker["seconds"] += result["seconds"]
+        worker["peak_rss_mb"] = max(worker["peak_rss_mb"], result.get("peak_rss_mb", 0.0))
+    for pid, worker in sorted(workers.items()):
+        print(f"Worker {pid}: {worker['files']} files, {worker['tokens']} tokens, "
+              f"{worker['tokens'] / max(worker['seconds'], 1e-9):.0f} tokens/s, peak RSS {worker['peak_rss_mb']:.0f} MB")
+
+    total_tokens = sum(result["tokens"] for result in results)
     print(f"Total tokens processed: {total_tokens}")
+    if cache_dir:
+        cached = sum(result["cached_docs"] for result in results)
+        encoded = sum(result["encoded_docs"] for result in results)
+        print(f"Token cache: {cached} cached and {encoded} encoded documents")
+    return total_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize filtered shards into uint16 .bin files")
+    parser.add_argument("--input-dir", default=INPUT_DIRECTORY, help="directory of the filtered shards")
+    parser.add_argument("--output-dir", default=OUTPUT_DIRECTORY, help="directory for the .bin files")
+    parser.add_argument("--n-procs", type=int, default=None, help="number of processes (default: all cores)")
+    parser.add_argument("--batch-lines", type=int, default=BATCH_LINES, help=f"lines per batch (default: {BATCH_LINES})")
+    parser.add_argument("--cache-dir", default=TOKEN_CACHE_DIRECTORY,
+                        help="token cache shared across runs, it holds a second copy of every id (default: no cache)")
+    parser.add_argument("--encoder", choices=ENCODERS, default=ENCODER, help=f"how lines are encoded (default: {ENCODER})")
+    args = parser.parse_args()
+
+    process_files_parallel(list_input_files(args.input_dir), args.output_dir, n_procs=args.n_procs,
+                           batch_lines=args.batch_lines, cache_dir=args.cache_dir,
+                           encoder=args.encoder)
+
 
 if __name__ == "__main__":
-    process_files_parallel()
\ No newline at end of file
+    main()
@@ -0,0 +1,162 @@
+"""
+GPT-2 byte-level BPE encoder with a pretoken cache.
+
+Web text is made of a small set of pretokens ("the", " and", "\\n\\n", navigation
+words) repeated billions of times. This encoder splits text into pretokens with the
+GPT-2 regex like the Hugging Face tokenizer does, and caches the ids of each pretoken
+in a bounded LRU cache, so the merges of common pretokens are only computed once per
+worker. It reads the vocabulary and merges of a Hugging Face byte-level BPE
+tokenizer, and has the same batch interface (`encoder(lines)["input_ids"]`), so it
+can replace the tokenizer in `cs336_data.batch_tokenize` and the output is identical.
+
+    python -m cs336_data.bpe --benchmark cc_filtered/X_00000.txt.gz
+"""
+
+import argparse
+import functools
+import io
+import itertools
+import json
+import time
+from typing import Optional
+
+import regex
+
+from cs336_data.shards import EOT, open_shard
+from cs336_data.token_shards import get_tokenizer
+
+# GPT-2 pretokenization, same as the ByteLevel pre-tokenizer of the Hugging Face tokenizer
+PRETOKEN_PATTERN = regex.compile(r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""")
+CACHE_SIZE = 2 ** 20
+
+_ENCODER = None
+
+
+@functools.lru_cache(maxsize=None)
+def bytes_to_unicode() -> dict[int, str]:
+    """GPT-2 mapping of bytes to printable characters, the vocabulary is written in these"""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    mapping = {b: chr(b) for b in printable}
+    n = 0
+    for b in range(256):
+        if b not in mapping:
+            mapping[b] = chr(256 + n)
+            n += 1
+    return mapping
+
+
+class CachedBPE():
+    def __init__(self, vocab: dict[str, int], merges: list[tuple[str, str]], special_tokens: dict[str, int],
+                 eos_token: str = EOT, cache_size: int = CACHE_SIZE, name_or_path: str = ""):
+        """
+        Args:
+            vocab: byte-level token -> id
+            merges: merges in order of priority
+            special_tokens: tokens that are never split, e.g. <|endoftext|>
+            eos_token: end of text token, must be one of special_tokens
+            cache_size: number of pretokens whose ids are cached
+            name_or_path: name of the tokenizer the vocabulary comes from
+        """
+        self.vocab = vocab
+        self.ranks = {merge: i for i, merge in enumerate(merges)}
+        self.special_tokens = special_tokens
+        self.eos_token_id = special_tokens[eos_token]
+        self.name_or_path = name_or_path
+        self.byte_encoder = bytes_to_unicode()
+        # special tokens are matched before pretokenizing, longest first
+        self.special_pattern = regex.compile("(" + "|".join(
+            regex.escape(token) for token in sorted(special_tokens, key=len, reverse=True)) + ")")
+        self.encode_pretoken = functools.lru_cache(maxsize=cache_size)(self._encode_pretoken)
+
+    @classmethod
+    def from_pretrained(cls, tokenizer=None, cache_size: int = CACHE_SIZE) -> "CachedBPE":
+        """build the encoder from a Hugging Face byte-level BPE tokenizer, defaults to GPT-2"""
+        tokenizer = tokenizer or get_tokenizer()
+        model = json.loads(tokenizer.backend_tokenizer.to_str())["model"]
+        merges = [tuple(merge.split(" ")) if isinstance(merge, str) else tuple(merge) for merge in model["merges"]]
+        special_tokens = {token.content: token_id for token_id, token in tokenizer.added_tokens_decoder.items()
+                          if token.special}
+        return cls(model["vocab"], merges, special_tokens, eos_token=tokenizer.eos_token,
+                   cache_size=cache_size, name_or_path=tokenizer.name_or_path)
+
+    def _encode_pretoken(self, pretoken: str) -> tuple[int, ...]:
+        """apply the merges to one pretoken"""
+        parts = [self.byte_encoder[b] for b in pretoken.encode("utf-8")]
+        while len(parts) > 1:
+            # merge the pair with the lowest rank everywhere it occurs
+            pairs = set(zip(parts, parts[1:]))
+            best = min(pairs, key=lambda pair: self.ranks.get(pair, float("inf")))
+            if best not in self.ranks:
+                break
+            merged, i = [], 0
+            while i < len(parts):
+                if i < len(parts) - 1 and (parts[i], parts[i + 1]) == best:
+                    merged.append(parts[i] + parts[i + 1])
+                    i += 2
+                else:
+                    merged.append(parts[i])
+                    i += 1
+            parts = merged
+        return tuple(self.vocab[part] for part in parts)
+
+    def encode(self, text: str) -> list[int]:
+        ids = []
+        for i, piece in enumerate(self.special_pattern.split(text)):
+            # split with a group alternates text and special tokens
+            if i % 2 == 1:
+                ids.append(self.special_tokens[piece])
+                continue
+            for pretoken in PRETOKEN_PATTERN.findall(piece):
+                ids.extend(self.encode_pretoken(pretoken))
+        return ids
+
+    def __call__(self, texts: list[str], verbose: bool = False) -> dict:
+        """same output as the batch call of a Hugging Face tokenizer"""
+        return {"input_ids": [self.encode(text) for text in texts]}
+
+    def cache_info(self):
+        return self.encode_pretoken.cache_info()
+
+
+def get_cached_bpe(cache_size: int = CACHE_SIZE) -> CachedBPE:
+    """build the encoder once per process, forked workers share it and each fill their own cache"""
+    global _ENCODER
+    if _ENCODER is None:
+        _ENCODER = CachedBPE.from_pretrained(cache_size=cache_size)
+    return _ENCODER
+
+def benchmark(input_path: str, max_lines: Optional[int] = None, batch_lines: int = 1024) -> dict:
+    """tokens/sec of the Hugging Face tokenizer and of the cached encoder on the lines of a shard"""
+    with io.TextIOWrapper(open_shard(input_path), encoding="utf-8") as f:
+        lines = list(itertools.islice(f, max_lines))
+    batches = [lines[i:i + batch_lines] for i in range(0, len(lines), batch_lines)]
+
+    results = {}
+    tokenizer = get_tokenizer()
+    encoder = CachedBPE.from_pretrained(tokenizer)
+    for name, encode in [("huggingface", tokenizer), ("cached_bpe", encoder)]:
+        start = time.time()
+        ids = [line_ids for batch in batches for line_ids in encode(batch, verbose=False)["input_ids"]]
+        seconds = time.time() - start
+        n_tokens = sum(len(line_ids) for line_ids in ids)
+        results[name] = {"tokens": n_tokens, "seconds": seconds, "tokens_per_second": n_tokens / max(seconds, 1e-9)}
+        results[name]["ids"] = ids
+        print(f"{name}: {n_tokens} tokens in {seconds:.2f}s ({results[name]['tokens_per_second']:.0f} tokens/s)")
+
+    matches = results["huggingface"].pop("ids") == results["cached_bpe"].pop("ids")
+    info = encoder.cache_info()
+    results["identical"] = matches
+    results["cache_hit_rate"] = info.hits / max(info.hits + info.misses, 1)
+    print(f"Identical ids: {matches}, pretoken cache hit rate {results['cache_hit_rate']:.3f} ({info.currsize} pretokens)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="GPT-2 BPE encoder with a pretoken cache")
+    parser.add_argument("--benchmark", required=True, help="shard to benchmark the encoders on")
+    parser.add_argument("--max-lines", type=int, default=None, help="only use the first N lines")
+    args = parser.parse_args()
+    benchmark(args.benchmark, max_lines=args.max_lines)
+
+
+if __name__ == "__main__":
+    main()
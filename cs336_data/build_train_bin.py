@@ -0,0 +1,140 @@
+"""
+Concatenate tokenized .bin shards into the single training file read by train.py.
+
+The first pass collects the token and document count of every shard (from its
+`.bin.idx` sidecar if it has one, otherwise by counting <|endoftext|> ids), which
+fixes the offset of every shard in the output. The output is then preallocated and
+a process pool copies every shard to its offset in parallel, with copy_file_range
+where the filesystem supports it, so the build is limited by disk bandwidth. The
+output is written to a temporary file and renamed into place, and a manifest of the
+shard boundaries and document counts (`<output>.json`) is written last.
+
+    python -m cs336_data.build_train_bin --input-dir cc_tokenized --output train_filtered.bin
+"""
+
+import argparse
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+from tqdm import tqdm
+
+from cs336_data.checkpoint import atomic_write_json
+
+INPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_tokenized"
+OUTPUT_PATH = "/data/c-cye/assignment4-data/train_filtered.bin"
+
+EOS_ID = 50256
+TOKEN_BYTES = np.dtype(np.uint16).itemsize
+# bytes copied at a time, and tokens scanned at a time when counting documents
+COPY_CHUNK = 64 * 1024 * 1024
+SCAN_CHUNK = 64 * 1024 * 1024
+
+
+def manifest_path(output_path: str) -> str:
+    return f"{output_path}.json"
+
+def count_shard(path: str, eos_id: int = EOS_ID) -> dict:
+    """number of tokens and documents of a .bin shard"""
+    tokens = os.path.getsize(path) // TOKEN_BYTES
+    if os.path.exists(f"{path}.idx"):
+        # written by TokenShardWriter: document offsets plus the end offset
+        docs = os.path.getsize(f"{path}.idx") // 8 - 1
+    elif tokens == 0:
+        docs = 0
+    else:
+        ids = np.memmap(path, dtype=np.uint16, mode="r")
+        docs = sum(int(np.count_nonzero(ids[i:i + SCAN_CHUNK] == eos_id)) for i in range(0, tokens, SCAN_CHUNK))
+    return {"path": path, "tokens": tokens, "docs": docs}
+
+def copy_shard(job: tuple) -> int:
+    """copy a shard into the output at the given token offset, returns the number of bytes copied"""
+    path, output_path, start = job
+    size = os.path.getsize(path)
+    with open(path, "rb") as src, open(output_path, "r+b") as dst:
+        copied = 0
+        try:
+            # copied inside the kernel, without going through user space
+            while copied < size:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), min(COPY_CHUNK, size - copied),
+                                       copied, start * TOKEN_BYTES + copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            pass
+        if copied < size:
+            src.seek(copied)
+            dst.seek(start * TOKEN_BYTES + copied)
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+        dst.flush()
+        os.fsync(dst.fileno())
+    return size
+
+def build_train_bin(bin_paths: list[str], output_path: str = OUTPUT_PATH, n_procs: int = None,
+                    eos_id: int = EOS_ID) -> dict:
+    """
+    Concatenate shards into one uint16 training file
+
+    Args:
+        bin_paths: tokenized shards, concatenated in this order
+        output_path: training file, only created once it is complete
+        n_procs: number of processes counting and copying shards, defaults to all cores
+        eos_id: id counted as the end of a document in shards without an index
+
+    Returns:
+        the manifest, also written to <output_path>.json
+    """
+    if os.path.exists(manifest_path(output_path)):
+        print(f"Skipping {output_path} because it already exists")
+        with open(manifest_path(output_path), "r") as f:
+            return json.load(f)
+
+    n_procs = n_procs or multiprocessing.cpu_count()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    with multiprocessing.Pool(n_procs) as pool:
+        # first pass: sizes of every shard, which fix their offsets in the output
+        shards = list(tqdm(pool.imap(functools.partial(count_shard, eos_id=eos_id), bin_paths), total=len(bin_paths), desc="Counting shards"))
+        start = 0
+        for shard in shards:
+            shard["start"] = start
+            start += shard["tokens"]
+        total_tokens = start
+        print(f"Found {len(shards)} shards with {total_tokens} tokens")
+
+        # second pass: preallocate the output and copy every shard to its offset
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.truncate(total_tokens * TOKEN_BYTES)
+        jobs = [(shard["path"], tmp_path, shard["start"]) for shard in shards]
+        list(tqdm(pool.imap_unordered(copy_shard, jobs), total=len(jobs), desc="Copying shards"))
+
+    os.replace(tmp_path, output_path)
+    manifest = {
+        "dtype": "uint16",
+        "tokens": total_tokens,
+        "docs": sum(shard["docs"] for shard in shards),
+        "shards": shards,
+    }
+    atomic_write_json(manifest, manifest_path(output_path))
+    print(f"Wrote {total_tokens} tokens and {manifest['docs']} documents to {output_path}")
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Concatenate tokenized shards into one training .bin")
+    parser.add_argument("--input-dir", default=INPUT_DIRECTORY, help="directory of the .bin shards")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="path of the training file")
+    parser.add_argument("--n-procs", type=int, default=None, help="number of processes (default: all cores)")
+    args = parser.parse_args()
+
+    bin_paths = sorted(glob.glob(os.path.join(args.input_dir, "*.bin")))
+    build_train_bin(bin_paths, args.output, n_procs=args.n_procs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Atomic output commits and record-level checkpoints for filtering tasks.
+
+Outputs are written to temporary files next to the final path and only renamed
+into place once the task finishes (see `cs336_data.shards.ShardWriter`), so an
+existing output always means a complete file. While the task runs, the number of
+processed input records and the committed state of the output writer are
+periodically saved, so a task that gets killed (e.g. at the SLURM time limit) can
+pick up from the last checkpoint.
+"""
+
+import json
+import os
+
+
+def atomic_write_json(obj, path: str) -> None:
+    """write json to path via a temporary file and rename"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class RecordCheckpoint():
+    def __init__(self, output_path: str, every: int = 1000, tag: str = ""):
+        """
+        track progress of a single output
+
+        Args:
+            output_path: final path of the output, only created on commit
+            every: number of input records between checkpoints
+            tag: optional name for the checkpoint file, so that several copies of
+                the same task (e.g. speculative re-runs) don't write to the same file
+        """
+        suffix = f".{tag}" if tag else ""
+        self.output_path = output_path
+        self.checkpoint_path = f"{output_path}{suffix}.ckpt"
+        self.every = every
+        self.state = {"next_record": 0}
+
+    def writer_state(self, name: str):
+        """resumable state of a named output writer, None when starting fresh"""
+        return self.state.get("writers", {}).get(name)
+
+    def load(self) -> dict:
+        """load the last checkpoint, or start fresh if there is none"""
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                self.state = json.load(f)
+            print(f"Resuming {self.output_path} from record {self.state['next_record']}")
+        else:
+            self.state = {"next_record": 0}
+        return self.state
+
+    @property
+    def next_record(self) -> int:
+        return self.state["next_record"]
+
+    def should_save(self, record_idx: int) -> bool:
+        return record_idx > self.next_record and record_idx % self.every == 0
+
+    def save(self, writers: dict, next_record: int, **extra) -> None:
+        """
+        make the outputs durable and record that all input records before next_record are done
+
+        Args:
+            writers: output writers by name, each with a checkpoint() method returning its resumable state
+            next_record: index of the first input record not yet processed
+            extra: any other json-serializable state needed to resume (e.g. stats)
+        """
+        writer_states = {name: writer.checkpoint() for name, writer in writers.items()}
+        self.state = {"next_record": next_record, "writers": writer_states, **extra}
+        atomic_write_json(self.state, self.checkpoint_path)
+
+    def finish(self) -> None:
+        """remove the checkpoint once the output has been committed"""
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
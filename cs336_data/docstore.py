@@ -0,0 +1,178 @@
+"""
+Columnar document store for intermediate corpora.
+
+A store is a directory `<name>.docs/` holding:
+
+- `text.bin`: the utf-8 text of all documents, back to back
+- `offsets.i8`: int64 byte offset of every document in text.bin, plus the end offset
+- `<column>.bin`: one fixed-width column of per-document metadata (e.g. record index, length, scores)
+- `<column>.bin` and `<column>.offsets.i8`: one variable-length string column (e.g. source file, URL)
+- `meta.json`: number of documents and the dtype of every column, written last
+
+Every file is a flat array, so the whole store can be memory-mapped: document i or a
+slice of a column is read without touching the rest. The writer fills a temporary
+directory that is renamed into place once meta.json is written, so an existing store
+is always complete, and it has the same checkpoint()/close() interface as
+`cs336_data.shards.ShardWriter`.
+
+    store = DocStore("cc_filtered/X.docs")
+    store[10], store.column("record")[:100], store.string("url", 10)
+"""
+
+import json
+import os
+import shutil
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+from cs336_data.checkpoint import atomic_write_json
+
+DOCSTORE_SUFFIX = ".docs"
+STRING = "str"
+
+
+def docstore_complete(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+class DocStoreWriter():
+    def __init__(self, path: str, columns: Optional[dict[str, Union[str, np.dtype]]] = None,
+                 tag: str = "", resume_state: Optional[dict] = None):
+        """
+        write documents and their metadata to a store
+
+        Args:
+            path: directory of the store, only created on close
+            columns: name -> numpy dtype of a fixed-width column, or STRING for a variable-length string column
+            tag: name for the temporary directory, so concurrent copies of a task don't collide
+            resume_state: state returned by checkpoint() of a previous writer
+        """
+        self.path = path
+        self.columns = {name: dtype if dtype == STRING else np.dtype(dtype) for name, dtype in (columns or {}).items()}
+        suffix = f".{tag}" if tag else ""
+        self._tmp_dir = f"{path}{suffix}.tmp"
+
+        # sizes of every file in the temporary directory at the last checkpoint
+        state = resume_state or {"docs": 0, "sizes": {}}
+        self.docs = state["docs"]
+        resume = self.docs > 0
+        if not resume:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+        self._files = {}
+        self._sizes = {}
+        names = ["text.bin", "offsets.i8"]
+        for name, dtype in self.columns.items():
+            names.append(f"{name}.bin")
+            if dtype == STRING:
+                names.append(f"{name}.offsets.i8")
+        for name in names:
+            file_path = os.path.join(self._tmp_dir, name)
+            if resume:
+                # drop anything written after the last checkpoint
+                f = open(file_path, "r+b")
+                f.truncate(state["sizes"][name])
+                f.seek(state["sizes"][name])
+            else:
+                f = open(file_path, "wb")
+            self._files[name] = f
+            self._sizes[name] = state["sizes"].get(name, 0)
+
+    def _append(self, name: str, data: bytes):
+        self._files[name].write(data)
+        self._sizes[name] += len(data)
+
+    def write(self, text: str, **metadata) -> None:
+        """append a document, with one value for each column (missing ones are zero or empty)"""
+        self._append("offsets.i8", np.int64(self._sizes["text.bin"]).tobytes())
+        self._append("text.bin", text.encode("utf-8"))
+        for name, dtype in self.columns.items():
+            value = metadata.get(name)
+            if dtype == STRING:
+                self._append(f"{name}.offsets.i8", np.int64(self._sizes[f"{name}.bin"]).tobytes())
+                self._append(f"{name}.bin", (value or "").encode("utf-8"))
+            else:
+                self._append(f"{name}.bin", np.array(0 if value is None else value, dtype=dtype).tobytes())
+        self.docs += 1
+
+    def checkpoint(self) -> dict:
+        """make everything written so far durable and return the state needed to resume"""
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        return {"docs": self.docs, "sizes": dict(self._sizes)}
+
+    def close(self) -> str:
+        """write the end offsets and meta.json, and move the store into place"""
+        self._append("offsets.i8", np.int64(self._sizes["text.bin"]).tobytes())
+        for name, dtype in self.columns.items():
+            if dtype == STRING:
+                self._append(f"{name}.offsets.i8", np.int64(self._sizes[f"{name}.bin"]).tobytes())
+        self.checkpoint()
+        for f in self._files.values():
+            f.close()
+
+        meta = {
+            "docs": self.docs,
+            "bytes": self._sizes["text.bin"],
+            "columns": {name: STRING if dtype == STRING else dtype.str for name, dtype in self.columns.items()},
+        }
+        atomic_write_json(meta, os.path.join(self._tmp_dir, "meta.json"))
+
+        # a leftover store without meta.json is incomplete, replace it
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self._tmp_dir, self.path)
+        return self.path
+
+
+def _memmap(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class DocStore():
+    def __init__(self, path: str):
+        """memory-map a store written by DocStoreWriter"""
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.offsets = _memmap(os.path.join(path, "offsets.i8"), np.int64)
+        self.text = _memmap(os.path.join(path, "text.bin"), np.uint8)
+        self.columns = self.meta["columns"]
+
+    def __len__(self) -> int:
+        return self.meta["docs"]
+
+    def __getitem__(self, i: int) -> str:
+        """text of document i"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Document {i} out of range for {self.path} with {len(self)} documents")
+        return self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8", errors="replace")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name: str) -> np.ndarray:
+        """memory-mapped fixed-width column, slicing it only reads the slice"""
+        if self.columns[name] == STRING:
+            raise ValueError(f"{name} is a string column, use string()")
+        return _memmap(os.path.join(self.path, f"{name}.bin"), np.dtype(self.columns[name]))
+
+    def string(self, name: str, i: int) -> str:
+        """value of a string column for document i"""
+        if self.columns[name] != STRING:
+            raise ValueError(f"{name} is not a string column, use column()")
+        offsets = _memmap(os.path.join(self.path, f"{name}.offsets.i8"), np.int64)
+        data = _memmap(os.path.join(self.path, f"{name}.bin"), np.uint8)
+        return data[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8", errors="replace")
+
+    def lengths(self) -> np.ndarray:
+        """utf-8 byte length of every document"""
+        return np.diff(self.offsets)
@@ -1,4 +1,6 @@
-from cs336_data.url import sample_urls, split_urls_into_batches, run_with_submitit, run_with_local_multiprocessing
+from cs336_data.url import sample_urls, split_urls_into_batches, group_urls_into_batches, run_with_submitit, run_with_local_multiprocessing, FETCHER, FETCHERS
+from cs336_data.process import STREAM_BATCHES, stream_urls_to_fasttext
+from cs336_data.url_filter import get_url_filter
 import argparse
 import random
 from pathlib import Path
@@ -34,6 +36,34 @@ def main():
                        help="Number of SLURM jobs to launch (default: 4)")
     parser.add_argument("--local-workers", type=int, default=4,
                        help="Number of local workers per SLURM job (default: 4)")
+    parser.add_argument("--no-group-by-domain", action="store_true",
+                       help="Split URLs into batches in sample order, without normalizing, deduplicating and grouping them by domain")
+    parser.add_argument("--url-filter", action="store_true",
+                       help="Drop sampled URLs on the blocklist or matching a URL pattern before downloading (default: download every URL)")
+    parser.add_argument("--url-blocklist", default=None,
+                       help="With --url-filter, domains whose URLs are never downloaded, one per line")
+    parser.add_argument("--url-allowlist", default=None,
+                       help="With --url-filter, domains whose URLs are downloaded even if a parent domain is blocked")
+    parser.add_argument("--url-patterns", default=None,
+                       help="With --url-filter, regexes of URLs that are never downloaded, one per line (default: non-page files and login pages)")
+    parser.add_argument("--sample-procs", type=int, default=1,
+                       help="Processes sampling chunks of an uncompressed input file (default: 1)")
+    parser.add_argument("--fetcher", choices=FETCHERS, default=FETCHER,
+                       help=f"How batches are downloaded (default: {FETCHER})")
+    parser.add_argument("--stream-to", default=None,
+                       help="Extract training lines into this file while downloading, and stop at --max-lines")
+    parser.add_argument("--labels", nargs="+", default=["high-quality"],
+                       help="FastText labels of the streamed lines (default: high-quality)")
+    parser.add_argument("--max-lines", type=int, default=15000,
+                       help="Streamed lines to collect before downloads stop (default: 15000)")
+    parser.add_argument("--extract-workers", type=int, default=8,
+                       help="Processes extracting and filtering streamed pages (default: 8)")
+    parser.add_argument("--stream-batches", type=int, default=STREAM_BATCHES,
+                       help=f"Batches downloaded at once while streaming (default: {STREAM_BATCHES})")
+    parser.add_argument("--no-filter", action="store_true",
+                       help="Keep streamed pages without the language, nsfw, toxic and gopher filters")
+    parser.add_argument("--clean-content", action="store_true",
+                       help="Drop bullet point lines from streamed pages")
     parser.add_argument("--seed", type=int, default=None,
                        help="Random seed for sampling (default: None)")
     
@@ -55,9 +85,13 @@ def main():
         print(f"Sampled URLs file {sampled_urls_file} already exists. Skipping sampling.")
     else:
         print(f"Sampled URLs file {sampled_urls_file} does not exist. Sampling URLs.")
-        sample_urls(args.input_file, args.n_samples, sampled_urls_file)
+        sample_urls(args.input_file, args.n_samples, sampled_urls_file, n_procs=args.sample_procs)
     
-    batch_files = split_urls_into_batches(sampled_urls_file, args.batch_size, batch_dir)
+    url_filter = get_url_filter(args.url_blocklist, args.url_allowlist, args.url_patterns) if args.url_filter else None
+    if args.no_group_by_domain:
+        batch_files = split_urls_into_batches(sampled_urls_file, args.batch_size, batch_dir, url_filter)
+    else:
+        batch_files = group_urls_into_batches(sampled_urls_file, args.batch_size, batch_dir, url_filter)
     
     # count number of batch files
     print(f"Number of batches: {len(batch_files)}")
@@ -65,15 +99,24 @@ def main():
     # download in parallel
     download_dir = output_path / "scraped_data"
     
-    if args.use_slurm:
+    if args.stream_to:
+        if args.fetcher != "async":
+            print("ERROR: --stream-to needs the async fetcher")
+            sys.exit(1)
+        stream_urls_to_fasttext(batch_files, download_dir, args.stream_to, args.labels, args.max_lines,
+                                n_workers=args.extract_workers, filter_content=not args.no_filter,
+                                clean_content=args.clean_content, n_batches=args.stream_batches)
+        print(f"\nStreamed training lines to {args.stream_to}, WARC files are in {download_dir}.")
+        return
+    elif args.use_slurm:
         if not SUBMITIT_AVAILABLE:
             print("ERROR: submitit not available but --use-slurm specified")
             sys.exit(1)
         run_with_submitit(batch_files, download_dir, 
                          args.slurm_partition, args.slurm_time, args.slurm_mem,
-                         args.slurm_qos, args.n_slurm_jobs, args.local_workers)
+                         args.slurm_qos, args.n_slurm_jobs, args.local_workers, args.fetcher)
     else:
-        run_with_local_multiprocessing(batch_files, download_dir, args.local_workers)
+        run_with_local_multiprocessing(batch_files, download_dir, args.local_workers, args.fetcher)
     
     print(f"\nAll downloads complete! Check {download_dir} for WARC files.")
     print(f"Logs available in {download_dir}/*.log")
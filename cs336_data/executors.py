@@ -0,0 +1,106 @@
+"""
+Executor backends for running pipeline jobs.
+
+All backends share the submit(fn, *args) interface and return futures with a
+result() method, so the pipeline code is the same on the cluster and on a laptop:
+
+- "submitit": SLURM jobs via submitit
+- "local": a local process pool
+- "inprocess": run each job immediately in the current process (for debugging,
+  tests and benchmarks)
+"""
+
+import concurrent.futures
+from typing import Iterator, Optional
+
+from tqdm import tqdm
+
+try:
+    import submitit
+    SUBMITIT_AVAILABLE = True
+except ImportError:
+    SUBMITIT_AVAILABLE = False
+
+BACKENDS = ["submitit", "local", "inprocess"]
+
+SLURM_DEFAULTS = {
+    "timeout_min": 30,
+    "mem_gb": 4,
+    "slurm_account": "student",
+    "slurm_partition": "a4-cpu",
+    "slurm_qos": "a4-cpu-qos",
+}
+
+
+class InProcessExecutor():
+    """runs every submitted job right away and returns an already finished future"""
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+def get_executor(backend: str, n_workers: int, cpus_per_task: int = 1,
+                 log_folder: str = "slurm_logs", **slurm_params):
+    """
+    create an executor
+
+    Args:
+        backend: one of "submitit", "local" or "inprocess"
+        n_workers: number of jobs running at the same time
+        cpus_per_task: cores per job (SLURM only, local jobs share the machine)
+        log_folder: submitit log folder
+        slurm_params: overrides for SLURM_DEFAULTS
+    """
+    if backend == "submitit":
+        if not SUBMITIT_AVAILABLE:
+            raise ImportError("submitit is required for the submitit backend")
+        executor = submitit.AutoExecutor(folder=log_folder)
+        executor.update_parameters(
+            slurm_array_parallelism=n_workers,
+            cpus_per_task=cpus_per_task,
+            **{**SLURM_DEFAULTS, **slurm_params},
+        )
+        return executor
+    if backend == "local":
+        return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+    if backend == "inprocess":
+        return InProcessExecutor()
+    raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+
+def as_completed(futures: list) -> Iterator:
+    """yield futures of any backend as they finish"""
+    if all(isinstance(future, concurrent.futures.Future) for future in futures):
+        return concurrent.futures.as_completed(futures)
+    return submitit.helpers.as_completed(futures)
+
+
+def run_jobs(executor, fn, jobs: list[tuple], desc: Optional[str] = None) -> list:
+    """
+    submit fn(*args) for every args tuple in jobs and wait for all of them
+
+    Failed jobs are reported and left out of the results.
+    """
+    futures = [executor.submit(fn, *args) for args in jobs]
+    print(f"Submitted {len(futures)} jobs")
+
+    results = []
+    for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+        try:
+            results.append(future.result())
+            print(f"Job completed ({len(results)}/{len(futures)})")
+        except Exception as e:
+            print(f"Job failed with error: {str(e)}")
+
+    print(f"All jobs completed! {len(results)}/{len(futures)} jobs finished successfully.")
+    if isinstance(executor, concurrent.futures.Executor):
+        executor.shutdown()
+    return results
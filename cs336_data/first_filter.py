@@ -1,16 +1,50 @@
+"""
+First filtering pass over Common Crawl WET files.
+
+Records whose WARC-Target-URI is rejected by the URL prefilter (domain blocklist and
+URL patterns, see `cs336_data.url_filter`) are dropped before any classifier runs
+when URL_FILTER is set. Every other record goes through language identification, the Gopher quality rules, the
+NSFW and toxicity classifiers and the quality classifier, and surviving documents
+are written to text and/or token shards. With a cheap model for the NSFW, toxicity or quality
+classifier (e.g. a quantized .ftz), it decides first and the full classifier only runs when the
+cheap confidence is in CASCADE_BAND, and `--evaluate-cascade` reports the escalation rate and the
+agreement with the full classifiers on a held-out WET file. With WRITE_SCORES, every classifier output
+and the Gopher statistics of each record are also saved to a `<name>.scores`
+sidecar (see FILTER_SCORE_DTYPE), and `cs336_data.reselect` can apply new thresholds from
+the sidecars without running the classifiers again. With WRITE_DOCSTORE, documents
+are also written to a `<name>.docs` columnar store (see `cs336_data.docstore`) with
+their source file, record index, URL and length. Files are handed to workers
+through a task queue, and workers run on SLURM, a local process pool or in-process.
+An output is redone when it is missing or was made with other thresholds or classifiers:
+
+    python -m cs336_data.first_filter --file-list wetlist.json --backend local --n-workers 4 --limit 8
+"""
+
+import argparse
 import os
 import pathlib
-import submitit
-from tqdm import tqdm
+from dataclasses import dataclass, asdict
+from typing import Optional
 import glob
 from fastwarc.warc import WarcRecordType, ArchiveIterator
 from fastwarc.stream_io import GZipStream, FileStream
-from cs336_data.utils import html_to_txt, LanguageDetector, QualityFilter, NSFWDetector, ToxicDetector, PIIFilter
+from cs336_data.utils import html_to_txt, LanguageDetector, QualityFilter, NSFWDetector, ToxicDetector, PIIFilter, CascadeClassifier, classifier_meta
 from cs336_data.gopher import GopherFilter
 from cs336_data.dedup import MinHashDedup
+from cs336_data.checkpoint import RecordCheckpoint, atomic_write_json
+from cs336_data.task_queue import SQLiteTaskQueue, run_queue_worker
+from cs336_data.shards import ShardWriter, settings_current, shards_complete, output_stem, write_settings
+from cs336_data.token_shards import TokenShardWriter
+from cs336_data.scores import ScoreWriter
+from cs336_data.docstore import DocStoreWriter, STRING, docstore_complete
+from cs336_data.parallel import ordered_pool_map
+from cs336_data.executors import BACKENDS, get_executor, run_jobs
+from cs336_data.url_filter import get_url_filter
+import functools
 import json
+import time
 import nltk
-import math
+import numpy as np
 
 VERBOSE = False
 DEDUP = False
@@ -20,25 +54,375 @@ NSFW_THRESHOLD = 0.5
 TOXIC_THRESHOLD = 0.5
 QUALITY_THRESHOLD = 0.6
 
+# drop records whose URL is blocklisted or matches a URL pattern before running the classifiers,
+# lists are paths (None for no list), None patterns uses cs336_data.url_filter.DEFAULT_PATTERNS
+URL_FILTER = False
+URL_BLOCKLIST = None
+URL_ALLOWLIST = None
+URL_PATTERNS = None
+
+# number of WET records between checkpoints of the temporary output
+CHECKPOINT_EVERY = 500
+
+# output shards: None, "gzip" or "zstd", and uncompressed bytes / documents per shard
+OUTPUT_COMPRESSION = "gzip"
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+SHARD_MAX_DOCS = None
+
+# outputs: filtered text shards, and/or GPT-2 tokenized .bin shards next to them
+WRITE_TEXT = True
+WRITE_TOKENS = False
+
+# also write surviving documents and their metadata to a columnar store
+WRITE_DOCSTORE = False
+DOCSTORE_COLUMNS = {"source": STRING, "record": "<i8", "url": STRING, "n_chars": "<i8"}
+
+# save the scores of every record, runs all filters on every record instead of stopping at the first failure
+WRITE_SCORES = False
+
+# one record per scored WET record: record index, index of the document in the text output
+# (-1 if it was dropped or with dedup), classifier labels and confidences, and Gopher statistics
+FILTER_SCORE_DTYPE = np.dtype([
+    ("record", "<i8"),
+    ("doc", "<i8"),
+    ("language", "S8"),
+    ("language_conf", "<f4"),
+    ("nsfw", "?"),
+    ("nsfw_conf", "<f4"),
+    ("toxic", "?"),
+    ("toxic_conf", "<f4"),
+    ("high_quality", "?"),
+    ("quality_conf", "<f4"),
+    ("gopher", "?"),
+    ("n_words", "<i4"),
+    ("mean_word_length", "<f4"),
+    ("ellipsis_frac", "<f4"),
+    ("alpha_count", "<i4"),
+    ("alpha_frac", "<f4"),
+    ("bullet_point_frac", "<f4"),
+    ("stop_word_count", "<i4"),
+])
+
 NSFW_FILTER = "/data/classifiers/dolma_fasttext_nsfw_jigsaw_model.bin"
 TOXIC_FILTER = "/data/classifiers/dolma_fasttext_hatespeech_jigsaw_model.bin"
 LANGUAGE_FILTER = "/data/classifiers/lid.176.bin"
 QUALITY_FILTER = "/home/c-cye/assignment4-data/cs336_data/quality_classifier.bin"
 
-def process_single_wet_file(input_path: str, output_path: str, work_dir: str):
-    # load filters
-    language_detector = LanguageDetector(LANGUAGE_FILTER)
-    quality_filter = QualityFilter(QUALITY_FILTER)
-    nsfw_detector = NSFWDetector(NSFW_FILTER)
-    toxic_detector = ToxicDetector(TOXIC_FILTER)
-    gopher_filter = GopherFilter(verbose=VERBOSE)
-    dedup = MinHashDedup()
+# cheap (e.g. quantized) models tried before the full NSFW, toxic and quality classifiers, None to only
+# run the full one, which then only sees records whose cheap confidence is in CASCADE_BAND
+NSFW_CHEAP_FILTER = None
+TOXIC_CHEAP_FILTER = None
+QUALITY_CHEAP_FILTER = None
+CASCADE_BAND = (0.0, 0.9)
+# records of a held-out WET file compared between the cascade and the full models
+CASCADE_EVAL_RECORDS = 1000
+
+# number of jobs, and cores per job: with CPUS_PER_TASK > 1 each job filters with a process pool
+# that shares one copy of the models, e.g. N_WORKERS = 4 and CPUS_PER_TASK = 32 for whole nodes
+N_WORKERS = 128
+CPUS_PER_TASK = 1
+
+OUTPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_filtered"
+WORK_DIRECTORY = "/data/c-cye/assignment4-data/cc_filtered_work"
+
+
+@dataclass
+class FilterConfig:
+    """thresholds, classifiers and outputs of the first filtering pass, defaults are the constants above"""
+    language_threshold: float = LANGUAGE_THRESHOLD
+    nsfw_threshold: float = NSFW_THRESHOLD
+    toxic_threshold: float = TOXIC_THRESHOLD
+    quality_threshold: float = QUALITY_THRESHOLD
+    url_filter: bool = URL_FILTER
+    url_blocklist: Optional[str] = URL_BLOCKLIST
+    url_allowlist: Optional[str] = URL_ALLOWLIST
+    url_patterns: Optional[str] = URL_PATTERNS
+    language_filter: str = LANGUAGE_FILTER
+    nsfw_filter: str = NSFW_FILTER
+    toxic_filter: str = TOXIC_FILTER
+    quality_filter: str = QUALITY_FILTER
+    nsfw_cheap_filter: Optional[str] = NSFW_CHEAP_FILTER
+    toxic_cheap_filter: Optional[str] = TOXIC_CHEAP_FILTER
+    quality_cheap_filter: Optional[str] = QUALITY_CHEAP_FILTER
+    cascade_band: tuple = CASCADE_BAND
+    output_compression: Optional[str] = OUTPUT_COMPRESSION
+    shard_max_bytes: Optional[int] = SHARD_MAX_BYTES
+    shard_max_docs: Optional[int] = SHARD_MAX_DOCS
+    write_text: bool = WRITE_TEXT
+    write_tokens: bool = WRITE_TOKENS
+    write_scores: bool = WRITE_SCORES
+    write_docstore: bool = WRITE_DOCSTORE
+    checkpoint_every: int = CHECKPOINT_EVERY
+    dedup: bool = DEDUP
+    verbose: bool = VERBOSE
+
+# filters are loaded once per process and shared with forked pool workers
+_FILTERS = {}
+
+def get_filters(config: FilterConfig) -> dict:
+    key = (config.language_filter, config.quality_filter, config.nsfw_filter, config.toxic_filter, config.verbose,
+           config.quality_cheap_filter, config.nsfw_cheap_filter, config.toxic_cheap_filter, tuple(config.cascade_band))
+    if key not in _FILTERS:
+        _FILTERS[key] = {
+            'language': LanguageDetector(config.language_filter),
+            'quality': QualityFilter(config.quality_filter, config.quality_cheap_filter, config.cascade_band),
+            'nsfw': NSFWDetector(config.nsfw_filter, config.nsfw_cheap_filter, config.cascade_band),
+            'toxic': ToxicDetector(config.toxic_filter, config.toxic_cheap_filter, config.cascade_band),
+            'gopher': GopherFilter(verbose=config.verbose),
+        }
+        print('Loaded filters successfully')
+    return _FILTERS[key]
+
+def iter_wet_records(input_path: str, start: int = 0, with_url: bool = False):
+    """
+    Yield (record index, text) for every record from start on, text is None for non-text records.
+    With with_url, yield (record index, (text, target URI)) instead.
+    """
+    stream = GZipStream(FileStream(input_path, 'rb'))
+    for i, record in enumerate(ArchiveIterator(stream)):
+        if i < start:
+            continue
+        url = record.headers.get('WARC-Target-URI', '') if with_url else None
+
+        # check record type
+        if record.record_type not in [WarcRecordType.conversion, WarcRecordType.response]:
+            text = None
+        else:
+            # always decode as utf-8
+            try:
+                text = record.reader.read().decode('utf-8')
+            except Exception as e:
+                print(f"Error decoding record {i}: {e}")
+                text = ""
+        yield i, ((text, url) if with_url else text)
+
+def clean_text(text: str) -> str:
+    """delete empty or short lines from text"""
+    return "\n".join([line for line in text.split("\n") if line.strip() and len(nltk.tokenize.word_tokenize(line.strip())) > 4])
+
+def score_record(text: str, config: FilterConfig) -> np.ndarray:
+    """Run every filter on a record and return a 0-d FILTER_SCORE_DTYPE array"""
+    filters = get_filters(config)
+    # a 0-d array rather than a np.void, which is read-only after being sent back by a pool worker
+    scores = np.zeros((), dtype=FILTER_SCORE_DTYPE)
+    scores["doc"] = -1
+
+    language, scores["language_conf"] = filters['language'].detect_language(text)
+    scores["language"] = language.encode("utf-8")[:FILTER_SCORE_DTYPE["language"].itemsize]
+    nsfw, scores["nsfw_conf"] = filters['nsfw'].filter_nsfw(text)
+    scores["nsfw"] = nsfw != "non-nsfw"
+    toxic, scores["toxic_conf"] = filters['toxic'].filter_toxic(text)
+    scores["toxic"] = toxic != "non-toxic"
+    quality, scores["quality_conf"] = filters['quality'].filter_quality(text)
+    scores["high_quality"] = quality == "high-quality"
+
+    gopher_stats = filters['gopher'].stats(text)
+    for key, value in gopher_stats.items():
+        scores[key] = value
+    scores["gopher"] = filters['gopher'].passes(gopher_stats)
+    return scores
+
+def select_records(scores, config: FilterConfig) -> dict:
+    """
+    Apply the thresholds of config to a FILTER_SCORE_DTYPE record or array of records
+
+    Returns:
+        for every stats key of the filter chain, whether the records made it past that filter
+    """
+    language = (scores["language"] == b"en") & (scores["language_conf"] >= config.language_threshold)
+    gopher = language & scores["gopher"]
+    nsfw = gopher & ~scores["nsfw"] & (scores["nsfw_conf"] >= config.nsfw_threshold)
+    toxic = nsfw & ~scores["toxic"] & (scores["toxic_conf"] >= config.toxic_threshold)
+    # allow both high-quality and low-quality with low-confidence
+    quality = toxic & (scores["high_quality"] | (scores["quality_conf"] < config.quality_threshold))
+    return {
+        'after_language_filter': language,
+        'after_gopher_filter': gopher,
+        'after_nsfw_filter': nsfw,
+        'after_toxic_filter': toxic,
+        'after_quality_filter': quality,
+    }
+
+def filter_record(text, config: FilterConfig):
+    """
+    Run the filter chain on a record
+
+    Returns:
+        (cleaned text or None, stats keys the record passed, FILTER_SCORE_DTYPE record or None).
+        Scores are only computed with config.write_scores, otherwise the chain stops at the first failure.
+    """
+    if text is None:
+        return None, [], None
+    passed = ['total_records']
+    if not text:
+        return None, passed, None
+
+    if config.write_scores:
+        scores = score_record(text, config)
+        selected = select_records(scores, config)
+        passed += [key for key, value in selected.items() if value]
+        if not selected['after_quality_filter']:
+            return None, passed, scores
+        return clean_text(text), passed, scores
+
+    filters = get_filters(config)
+    verbose = config.verbose
+    if verbose:
+        print(f"FULL TEXT\n{text}\n")
+
+    # filter on language
+    language, langconf = filters['language'].detect_language(text)
+    if verbose: print(f"Language: {language} with confidence {langconf}")
+    if language != "en" or langconf < config.language_threshold: return None, passed, None
+    passed.append('after_language_filter')
+
+    # filter with gopher
+    gopher = filters['gopher'].filter(text)
+    if verbose: print(f"Gopher: {gopher}")
+    if gopher != True: return None, passed, None
+    passed.append('after_gopher_filter')
+
+    # filter on nsfw
+    nsfw, nsfw_conf = filters['nsfw'].filter_nsfw(text)
+    if verbose: print(f"NSFW: {nsfw} with confidence {nsfw_conf}")
+    if nsfw != "non-nsfw" or nsfw_conf < config.nsfw_threshold: return None, passed, None
+    passed.append('after_nsfw_filter')
+
+    # filter on toxic
+    toxic, toxic_conf = filters['toxic'].filter_toxic(text)
+    if verbose: print(f"Toxic: {toxic} with confidence {toxic_conf}")
+    if toxic != "non-toxic" or toxic_conf < config.toxic_threshold: return None, passed, None
+    passed.append('after_toxic_filter')
+
+    # filter on quality
+    quality, quality_conf = filters['quality'].filter_quality(text)
+    if verbose: print(f"Quality: {quality} with confidence {quality_conf}")
+    if quality == "high-quality" or quality_conf < config.quality_threshold:
+        # allow both high-quality and low-quality with low-confidence
+        passed.append('after_quality_filter')
+    else:
+        return None, passed, None
+
+    # delete empty or short lines from text
+    text = clean_text(text)
+    if verbose: print(f"AFTER FILTERING\n{text}\n")
+    return text, passed, None
 
-    print('Loaded filters successfully')
+def evaluate_cascade(input_path: str, config: FilterConfig, n_records: int = CASCADE_EVAL_RECORDS) -> dict:
+    """
+    Score the first n_records text records of a held-out WET file with the cascades of config and with
+    the full models only, and compare them
+
+    Returns:
+        report: escalation rate of every cascade, agreement of the labels of every cascaded classifier and
+            of the decisions after every filter with the full models, and the seconds spent scoring
+    """
+    filters = get_filters(config)
+    cascades = {name: filters[name].classifier for name in ['nsfw', 'toxic', 'quality']
+                if isinstance(filters[name].classifier, CascadeClassifier)}
+    if not cascades:
+        raise ValueError("No cheap classifier in config, nothing to evaluate")
+    for cascade in cascades.values():
+        cascade.predictions = cascade.escalations = 0
+
+    label_fields = {'nsfw': 'nsfw', 'toxic': 'toxic', 'quality': 'high_quality'}
+    agree = {f'{name}_label': 0 for name in cascades}
+    seconds = {'full': 0.0, 'cascade': 0.0}
+    n = 0
+    for _, text in iter_wet_records(input_path):
+        if not text:
+            continue
+        results = {}
+        for mode in ['full', 'cascade']:
+            for cascade in cascades.values():
+                cascade.full_only = mode == 'full'
+            start = time.time()
+            scores = score_record(text, config)
+            seconds[mode] += time.time() - start
+            results[mode] = (scores, select_records(scores, config))
+        for name in cascades:
+            agree[f'{name}_label'] += bool(results['full'][0][label_fields[name]] == results['cascade'][0][label_fields[name]])
+        for key, value in results['full'][1].items():
+            agree[key] = agree.get(key, 0) + bool(value == results['cascade'][1][key])
+        n += 1
+        if n >= n_records:
+            break
+    for cascade in cascades.values():
+        cascade.full_only = False
+
+    report = {
+        'records': n,
+        'band': list(config.cascade_band),
+        'escalation_rate': {name: cascade.escalation_rate for name, cascade in cascades.items()},
+        'agreement': {key: count / max(n, 1) for key, count in agree.items()},
+        'seconds': seconds,
+    }
+    print(f"Cascade on {n} records of {input_path} with band {config.cascade_band}")
+    for name, rate in report['escalation_rate'].items():
+        print(f"  {name}: {rate:.1%} escalated, labels agree on {report['agreement'][f'{name}_label']:.2%}")
+    print(f"  kept records agree on {report['agreement']['after_quality_filter']:.2%}, "
+          f"scoring took {seconds['cascade']:.1f}s instead of {seconds['full']:.1f}s")
+    return report
+
+def filter_wet_item(item: tuple, config: FilterConfig):
+    """filter_record on a (text, url) item of iter_wet_records, the url is passed through.
+    With config.url_filter, records with a rejected url are dropped without running the filters."""
+    text, url = item
+    if text and config.url_filter:
+        url_filter = get_url_filter(config.url_blocklist, config.url_allowlist, config.url_patterns)
+        if not url_filter.allowed(url):
+            return None, ['total_records', 'url_blocked'], None, url
+    return (*filter_record(text, config), url)
+
+def token_output_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.bin"
+
+def score_output_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.scores"
+
+def docstore_output_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.docs"
+
+def output_complete(output_path: str, config: FilterConfig) -> bool:
+    """outputs are renamed into place last, so they only exist once the file is finished"""
+    if config.write_text and not shards_complete(output_path):
+        return False
+    if config.write_tokens and not os.path.exists(token_output_path(output_path)):
+        return False
+    if config.write_scores and not os.path.exists(score_output_path(output_path)):
+        return False
+    if config.write_docstore and not docstore_complete(docstore_output_path(output_path)):
+        return False
+    return True
+
+def output_settings(config: FilterConfig) -> dict:
+    """the settings of config that change the outputs, and the classifiers they were made with"""
+    settings = asdict(config)
+    for key in ["checkpoint_every", "verbose"]:
+        del settings[key]
+    settings["classifiers"] = [classifier_meta(classifier_id) for classifier_id in [
+        config.language_filter, config.nsfw_filter, config.toxic_filter, config.quality_filter,
+        config.nsfw_cheap_filter, config.toxic_cheap_filter, config.quality_cheap_filter] if classifier_id]
+    return settings
+
+def output_current(output_path: str, config: FilterConfig) -> bool:
+    """whether the outputs of config are complete and were made with its settings"""
+    return output_complete(output_path, config) and settings_current(output_path, output_settings(config))
+
+def process_single_wet_file(input_path: str, output_path: str, work_dir: str, config: Optional[FilterConfig] = None,
+                            checkpoint_tag: str = "", n_procs: int = 1):
+    config = config or FilterConfig()
+
+    # load filters, before forking so that pool workers share them
+    get_filters(config)
+    if config.url_filter:
+        get_url_filter(config.url_blocklist, config.url_allowlist, config.url_patterns)
+    dedup = MinHashDedup()
 
     # set up stats
     stats = {
         'total_records': 0,
+        'url_blocked': 0,
         'after_language_filter': 0,
         'after_gopher_filter': 0,
         'after_nsfw_filter': 0,
@@ -47,87 +431,74 @@ def process_single_wet_file(input_path: str, output_path: str, work_dir: str):
         'after_dedup': 0
     }
     os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # outputs of other settings are overwritten in place, they are not current until the new ones are done
+    write_settings(output_path, None)
+
+    # resume from the last checkpoint if a previous run was killed
+    checkpoint = RecordCheckpoint(output_path, every=config.checkpoint_every, tag=checkpoint_tag)
+    state = checkpoint.load()
+    stats.update(state.get('stats', {}))
+    filelist = state.get('filelist', [])
+    writers = {}
+    if config.write_text:
+        writers['text'] = ShardWriter(output_path, compression=config.output_compression,
+                                      max_bytes=config.shard_max_bytes, max_docs=config.shard_max_docs, tag=checkpoint_tag,
+                                      resume_state=checkpoint.writer_state('text'))
+    if config.write_tokens:
+        writers['tokens'] = TokenShardWriter(token_output_path(output_path), tag=checkpoint_tag,
+                                             resume_state=checkpoint.writer_state('tokens'))
+    doc_writers = dict(writers)
+    if config.write_docstore:
+        writers['docstore'] = DocStoreWriter(docstore_output_path(output_path), columns=DOCSTORE_COLUMNS,
+                                             tag=checkpoint_tag, resume_state=checkpoint.writer_state('docstore'))
+    if config.write_scores:
+        writers['scores'] = ScoreWriter(score_output_path(output_path), FILTER_SCORE_DTYPE, tag=checkpoint_tag,
+                                        resume_state=checkpoint.writer_state('scores'))
 
-    # load WET file stream
-    warc_file = input_path
-    stream = GZipStream(FileStream(warc_file, 'rb'))
-    wet_iterable = ArchiveIterator(stream)
+    # filter records, in this process or with a reader process feeding a pool of workers
+    start = checkpoint.next_record
+    filter_fn = functools.partial(filter_wet_item, config=config)
+    if n_procs > 1:
+        results = ordered_pool_map(lambda: iter_wet_records(input_path, start, with_url=True), filter_fn, n_procs, start=start)
+    else:
+        results = ((i, filter_fn(item)) for i, item in iter_wet_records(input_path, start, with_url=True))
+    source = os.path.basename(input_path)
+
+    # iterate over records in order
+    for i, (text, passed, scores, url) in results:
+        if checkpoint.should_save(i):
+            checkpoint.save(writers, i, stats=stats, filelist=filelist)
 
-    # iterate over records
-    filelist = []
-    output_file = open(output_path, "w")
-    for i, record in enumerate(wet_iterable):
         if i % 100 == 0:
             print(f"Processing record {i}")
             print(f"Stats: {stats}")
-        
-        # check record type
-        if record.record_type not in [WarcRecordType.conversion, WarcRecordType.response]:
-            continue
-        
-        stats['total_records'] += 1
 
-        # always decode as utf-8
-        try:
-            text = record.reader.read().decode('utf-8')
-        except Exception as e:
-            print(f"Error decoding record {i}: {e}")
-            continue
-            
-        if VERBOSE:
-            print(f"FULL TEXT\n{text}\n")
-
-        # filter on language
-        language, langconf = language_detector.detect_language(text)
-        if VERBOSE: print(f"Language: {language} with confidence {langconf}")
-        if language != "en" or langconf < LANGUAGE_THRESHOLD: continue
-        stats['after_language_filter'] += 1
-
-        # filter with gopher
-        gopher = gopher_filter.filter(text)
-        if VERBOSE: print(f"Gopher: {gopher}")
-        if gopher != True: continue
-        stats['after_gopher_filter'] += 1
-
-        # filter on nsfw
-        nsfw, nsfw_conf = nsfw_detector.filter_nsfw(text)
-        if VERBOSE: print(f"NSFW: {nsfw} with confidence {nsfw_conf}")
-        if nsfw != "non-nsfw" or nsfw_conf < NSFW_THRESHOLD: continue
-        stats['after_nsfw_filter'] += 1
-
-        # filter on toxic
-        toxic, toxic_conf = toxic_detector.filter_toxic(text)
-        if VERBOSE: print(f"Toxic: {toxic} with confidence {toxic_conf}")
-        if toxic != "non-toxic" or toxic_conf < TOXIC_THRESHOLD: continue
-        stats['after_toxic_filter'] += 1
-
-        # filter on quality
-        quality, quality_conf = quality_filter.filter_quality(text)
-        if VERBOSE: print(f"Quality: {quality} with confidence {quality_conf}")
-        if quality == "high-quality" or quality_conf < QUALITY_THRESHOLD:
-            # allow both high-quality and low-quality with low-confidence
-            stats['after_quality_filter'] += 1
-        else:
+        for key in passed:
+            stats[key] += 1
+        if scores is not None:
+            scores["record"] = i
+            if text is not None and not config.dedup:
+                scores["doc"] = stats['after_dedup']
+            writers['scores'].write(scores)
+        if text is None:
             continue
 
-        # delete empty or short lines from text
-        text = "\n".join([line for line in text.split("\n") if line.strip() and len(nltk.tokenize.word_tokenize(line.strip())) > 4])
-        if VERBOSE: print(f"AFTER FILTERING\n{text}\n")
-
         # save text to file in working directory
-        if DEDUP:
+        if config.dedup:
             print(f"Saving text to file {i}")
             with open(os.path.join(work_dir, f"{i}.txt"), "w") as f:
                 f.write(text)
                 # full path to file
                 filelist.append(os.path.join(work_dir, f"{i}.txt"))
         else:
-            output_file.write(text)
-            output_file.write("<|endoftext|>")
-            output_file.write("\n") 
+            for writer in doc_writers.values():
+                writer.write(text)
+            if config.write_docstore:
+                writers['docstore'].write(text, source=source, record=i, url=url, n_chars=len(text))
             stats['after_dedup'] += 1
     
-    if DEDUP:
+    if config.dedup:
         # deduplicate in working directory
         dedup_dir = os.path.join(work_dir, "dedup")
         os.makedirs(dedup_dir, exist_ok=True)
@@ -138,102 +509,164 @@ def process_single_wet_file(input_path: str, output_path: str, work_dir: str):
         stats['after_dedup'] = len(dedup_files)
     
         # write to output file
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
         for file in dedup_files:
             with open(os.path.join(dedup_dir, file), "r") as in_f:
-                output_file.write(in_f.read())
-                output_file.write("<|endoftext|>")
+                text = in_f.read()
+            for writer in doc_writers.values():
+                writer.write(text)
+            if config.write_docstore:
+                # record indices and urls are not kept through deduplication
+                writers['docstore'].write(text, source=source, record=-1, n_chars=len(text))
 
+    # write stats before committing the outputs, so a complete output always has its stats
     stats_path = output_path.replace(".txt", "_stats.json")
-    with open(stats_path, "w") as f:
-        json.dump(stats, f)
+    atomic_write_json(stats, stats_path)
     
     print(stats)
-    output_file.close()
+    for writer in writers.values():
+        writer.close()
+    write_settings(output_path, output_settings(config))
+    checkpoint.finish()
     return output_path
 
-def process_batch_of_wet_files(wet_filepaths_batch: list, output_directory_path: str, work_dir_base: str, batch_id: int):
-    """Process a batch of WET files in a single job"""
-    print(f"Starting batch {batch_id} with {len(wet_filepaths_batch)} files")
-    
-    results = []
-    for wet_filepath in wet_filepaths_batch:
-        try:
-            wet_filename = str(pathlib.Path(wet_filepath).name)
-            wet_filename = wet_filename.split('.')[0]
-            
-            output_path = os.path.join(output_directory_path, f"{wet_filename}.txt")
-            work_dir = os.path.join(work_dir_base, f"batch_{batch_id}", f"{wet_filename}_work")
-            
-            # check if output file already exists
-            if os.path.exists(output_path):
-                print(f"Skipping {wet_filename} because it already exists")
-                continue
-            
-            result = process_single_wet_file(wet_filepath, output_path, work_dir)
-            results.append(result)
-            print(f"Batch {batch_id}: Completed {wet_filename}")
-            
-        except Exception as e:
-            print(f"Batch {batch_id}: Error processing {wet_filepath}: {str(e)}")
-            continue
-    
-    print(f"Batch {batch_id} completed with {len(results)} successful files")
+def process_wet_task(task: dict, speculative: bool = False, config: Optional[FilterConfig] = None, n_procs: int = 1):
+    """Process a single WET file pulled from the task queue"""
+    config = config or FilterConfig()
+    output_path = task["output_path"]
+    work_dir = task["work_dir"]
+
+    if output_current(output_path, config):
+        print(f"Skipping {task['input_path']} because it already exists")
+        return output_path
+
+    # speculative copies start from scratch in their own temporary files
+    checkpoint_tag = ""
+    if speculative:
+        checkpoint_tag = f"spec{os.getpid()}"
+        work_dir = f"{work_dir}_{checkpoint_tag}"
+
+    return process_single_wet_file(task["input_path"], output_path, work_dir, config=config,
+                                   checkpoint_tag=checkpoint_tag, n_procs=n_procs)
+
+def process_wet_queue(queue_path: str, worker_id: int, config: Optional[FilterConfig] = None, n_procs: int = 1):
+    """Pull WET files from the task queue until it is drained, filtering each with n_procs processes"""
+    print(f"Starting worker {worker_id}")
+    results = run_queue_worker(queue_path, functools.partial(process_wet_task, config=config, n_procs=n_procs))
+    print(f"Worker {worker_id} completed with {len(results)} successful files")
     return results
 
-def partition_list(lst, n):
-    """Partition a list into n roughly equal chunks"""
-    chunk_size = math.ceil(len(lst) / n)
-    return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
+def run_first_filter(wet_filepaths: list[str], output_directory: str = OUTPUT_DIRECTORY,
+                     work_directory: str = WORK_DIRECTORY, config: Optional[FilterConfig] = None,
+                     backend: str = "submitit", n_workers: int = N_WORKERS,
+                     cpus_per_task: int = CPUS_PER_TASK, **slurm_params) -> list:
+    """
+    Filter a list of WET files
 
-N_WORKERS = 128
-wet_filepaths = json.loads(open("wetlist.json", "r").read())
-N_FILES = len(wet_filepaths)
-print(f"Found {N_FILES} files")
-N_FILES_PER_WORKER = math.ceil(N_FILES / N_WORKERS)
-print(f"Will process {N_FILES_PER_WORKER} files per worker")
-
-file_batches = partition_list(wet_filepaths, N_WORKERS)
-
-output_directory_path = "/data/c-cye/assignment4-data/cc_filtered"
-work_dir = "/data/c-cye/assignment4-data/cc_filtered_work"
-
-# set up the submitit executor
-executor = submitit.AutoExecutor(folder="slurm_logs")
-executor.update_parameters(
-    slurm_array_parallelism=N_WORKERS,  
-    timeout_min = 30,           
-    mem_gb = 4,             
-    cpus_per_task = 1,
-    slurm_account="student",
-    slurm_partition="a4-cpu", 
-    slurm_qos="a4-cpu-qos",
-)
-
-# submit jobs   
-print(f"Submitting {len(file_batches)} batch jobs...")
-futures = []
-
-for batch_id, file_batch in enumerate(file_batches):
-    print(f"Submitting batch {batch_id} with {len(file_batch)} files")
-    future = executor.submit(
-        process_batch_of_wet_files,
-        file_batch,
-        output_directory_path,
-        work_dir,
-        batch_id
+    Args:
+        wet_filepaths: WET files to process
+        output_directory: directory for the filtered shards
+        work_directory: directory for the task queue and per-file working data
+        config: thresholds, classifiers and outputs, defaults to FilterConfig()
+        backend: "submitit", "local" or "inprocess", see cs336_data.executors
+        n_workers: number of workers pulling from the task queue
+        cpus_per_task: processes per worker filtering a single file
+        slurm_params: overrides of the SLURM parameters
+
+    Returns:
+        output paths of the files processed by each worker
+    """
+    config = config or FilterConfig()
+    print(f"Found {len(wet_filepaths)} files")
+
+    # fill the task queue, workers pull files from it until it is drained
+    os.makedirs(work_directory, exist_ok=True)
+    queue_path = os.path.join(work_directory, "tasks.sqlite")
+    # tasks hold the settings, so new thresholds or classifiers queue every file again
+    settings = output_settings(config)
+    tasks = []
+    for wet_filepath in wet_filepaths:
+        wet_filename = str(pathlib.Path(wet_filepath).name).split('.')[0]
+        tasks.append({
+            "input_path": wet_filepath,
+            "output_path": os.path.join(output_directory, f"{wet_filename}.txt"),
+            "work_dir": os.path.join(work_directory, f"{wet_filename}_work"),
+            "settings": settings,
+        })
+    queue = SQLiteTaskQueue(queue_path)
+    added = queue.add_tasks(tasks, is_complete=lambda task: output_current(task["output_path"], config))
+    print(f"Added {added} new tasks to {queue_path}: {queue.counts()}")
+    queue.close()
+
+    executor = get_executor(backend, n_workers, cpus_per_task=cpus_per_task, **slurm_params)
+    print(f"Submitting {n_workers} {backend} workers...")
+    jobs = [(queue_path, worker_id, config, cpus_per_task) for worker_id in range(n_workers)]
+    return run_jobs(executor, process_wet_queue, jobs, desc="Workers")
+
+def main():
+    parser = argparse.ArgumentParser(description="First filtering pass over WET files")
+    parser.add_argument("--file-list", default="wetlist.json", help="json list of WET files (default: wetlist.json)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIRECTORY, help="directory for the filtered shards")
+    parser.add_argument("--work-dir", default=WORK_DIRECTORY, help="directory for the task queue and working data")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N files")
+    parser.add_argument("--backend", choices=BACKENDS, default="submitit", help="where to run workers (default: submitit)")
+    parser.add_argument("--n-workers", type=int, default=N_WORKERS, help=f"number of workers (default: {N_WORKERS})")
+    parser.add_argument("--cpus-per-task", type=int, default=CPUS_PER_TASK,
+                        help=f"processes per worker (default: {CPUS_PER_TASK})")
+    parser.add_argument("--language-threshold", type=float, default=LANGUAGE_THRESHOLD)
+    parser.add_argument("--nsfw-threshold", type=float, default=NSFW_THRESHOLD)
+    parser.add_argument("--toxic-threshold", type=float, default=TOXIC_THRESHOLD)
+    parser.add_argument("--quality-threshold", type=float, default=QUALITY_THRESHOLD)
+    parser.add_argument("--quality-filter", default=QUALITY_FILTER, help="path of the quality classifier")
+    parser.add_argument("--nsfw-cheap-filter", default=NSFW_CHEAP_FILTER, help="cheap NSFW classifier tried first")
+    parser.add_argument("--toxic-cheap-filter", default=TOXIC_CHEAP_FILTER, help="cheap toxicity classifier tried first")
+    parser.add_argument("--quality-cheap-filter", default=QUALITY_CHEAP_FILTER, help="cheap quality classifier tried first")
+    parser.add_argument("--cascade-band", type=float, nargs=2, default=CASCADE_BAND, metavar=("LOW", "HIGH"),
+                        help="cheap confidences in [LOW, HIGH) are escalated to the full classifier (default: %(default)s)")
+    parser.add_argument("--evaluate-cascade", default=None, metavar="WET_FILE",
+                        help="compare the cascade with the full classifiers on a held-out WET file and exit")
+    parser.add_argument("--evaluate-records", type=int, default=CASCADE_EVAL_RECORDS,
+                        help="records of the held-out file to compare (default: %(default)s)")
+    parser.add_argument("--url-filter", action="store_true", help="drop records with a blocklisted url or one matching a url pattern")
+    parser.add_argument("--url-blocklist", default=URL_BLOCKLIST, help="domains whose records are dropped, one per line")
+    parser.add_argument("--url-allowlist", default=URL_ALLOWLIST, help="domains whose records are kept even if a parent domain is blocked")
+    parser.add_argument("--url-patterns", default=URL_PATTERNS, help="regexes of urls whose records are dropped, one per line")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default=OUTPUT_COMPRESSION or "none")
+    parser.add_argument("--write-tokens", action="store_true", help="also write GPT-2 tokenized .bin shards")
+    parser.add_argument("--write-scores", action="store_true", help="also write .scores sidecars for cs336_data.reselect")
+    parser.add_argument("--write-docstore", action="store_true", help="also write a .docs columnar store")
+    args = parser.parse_args()
+
+    config = FilterConfig(
+        language_threshold=args.language_threshold,
+        nsfw_threshold=args.nsfw_threshold,
+        toxic_threshold=args.toxic_threshold,
+        quality_threshold=args.quality_threshold,
+        quality_filter=args.quality_filter,
+        nsfw_cheap_filter=args.nsfw_cheap_filter,
+        toxic_cheap_filter=args.toxic_cheap_filter,
+        quality_cheap_filter=args.quality_cheap_filter,
+        cascade_band=tuple(args.cascade_band),
+        url_filter=args.url_filter or URL_FILTER,
+        url_blocklist=args.url_blocklist,
+        url_allowlist=args.url_allowlist,
+        url_patterns=args.url_patterns,
+        output_compression=None if args.compression == "none" else args.compression,
+        write_tokens=args.write_tokens or WRITE_TOKENS,
+        write_scores=args.write_scores or WRITE_SCORES,
+        write_docstore=args.write_docstore or WRITE_DOCSTORE,
     )
-    futures.append(future)
-
-# monitor progress
-print("Monitoring job progress...")
-completed_batches = 0
-for future in tqdm(submitit.helpers.as_completed(futures), total=len(file_batches)):
-    try:
-        result = future.result()
-        completed_batches += 1
-        print(f"Batch completed ({completed_batches}/{len(file_batches)}). Processed {len(result)} files successfully.")
-    except Exception as e:
-        print(f"Batch failed with error: {str(e)}")
-
-print(f"All jobs completed! {completed_batches}/{len(file_batches)} batches finished successfully.")
\ No newline at end of file
+    print(f"Config: {asdict(config)}")
+    if args.evaluate_cascade:
+        evaluate_cascade(args.evaluate_cascade, config, n_records=args.evaluate_records)
+        return
+
+    with open(args.file_list, "r") as f:
+        wet_filepaths = json.load(f)
+    if args.limit is not None:
+        wet_filepaths = wet_filepaths[:args.limit]
+    run_first_filter(wet_filepaths, args.output_dir, args.work_dir, config=config, backend=args.backend,
+                     n_workers=args.n_workers, cpus_per_task=args.cpus_per_task)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,15 @@ import nltk.tokenize
 class GopherFilter():
     bullet_point_characters = ["*", "-", "•"]
     stop_words = ["the", "be", "to", "of", "and", "that", "have", "with"]
+    # thresholds of the rules, shared by passes() and the single rule methods
+    min_words = 50
+    max_words = 100000
+    min_mean_word_length = 3
+    max_mean_word_length = 10
+    max_ellipsis_frac = 0.3
+    min_alpha_frac = 0.8
+    max_bullet_point_frac = 0.9
+    min_stop_words = 2
 
     def __init__(self, filter_length: bool = True, 
                  filter_mean_length: bool = True, 
@@ -28,6 +37,10 @@ class GopherFilter():
         nltk.download('punkt')
 
     def filter(self, text: str) -> str:
+        return self.passes(self.stats(text))
+
+    def stats(self, text: str) -> dict:
+        """statistics the rules are based on, so they can be stored and the rules re-applied later"""
         # clean whitespace from text
         text = text.strip()
 
@@ -41,40 +54,60 @@ class GopherFilter():
         # strip whitespace from splitlines
         splitlines = [line.strip() for line in splitlines]
 
+        n_words = len(tokenized)
+        alpha_count = sum(1 for word in tokenized if any(c.isalpha() for c in word))
+        bullet_point_count = sum(1 for line in splitlines if line.startswith(tuple(GopherFilter.bullet_point_characters)))
+        return {
+            "n_words": n_words,
+            "mean_word_length": sum(len(word) for word in tokenized) / n_words if n_words else 0.0,
+            "ellipsis_frac": sum(1 for line in splitlines if line.endswith("...")) / len(splitlines),
+            "alpha_count": alpha_count,
+            "alpha_frac": alpha_count / n_words if n_words else 0.0,
+            "bullet_point_frac": bullet_point_count / len(splitlines),
+            "stop_word_count": sum(1 for word in tokenized if word in GopherFilter.stop_words),
+        }
+
+    def passes(self, stats: dict) -> bool:
+        """apply the enabled rules to the output of stats()"""
         if self.filter_mean_length:
-            if not self.mean_length_filter(tokenized):
+            if not GopherFilter.min_mean_word_length <= stats["mean_word_length"] <= GopherFilter.max_mean_word_length:
                 if self.verbose: print("mean length filter failed")
                 return False
 
         if self.filter_ellipsis:
-            if not self.ellipsis_filter(splitlines):
+            if stats["ellipsis_frac"] > GopherFilter.max_ellipsis_frac:
                 if self.verbose: print("ellipsis filter failed")
                 return False
 
         if self.filter_word_alphabet:
-            if not self.word_alphabet_filter(tokenized):
+            # 80% of words must have at least one alphabetic character
+            if not GopherFilter.alpha_passes(stats["alpha_count"], stats["alpha_frac"]):
                 if self.verbose: print("word alphabet filter failed")
                 return False
         
         if self.filter_bullet_point:
-            if not self.bullet_point_filter(splitlines):
+            if stats["bullet_point_frac"] > GopherFilter.max_bullet_point_frac:
                 if self.verbose: print("bullet point filter failed")
                 return False
         
         if self.filter_stop_word:
-            if not self.stop_word_filter(tokenized):
+            if stats["stop_word_count"] < GopherFilter.min_stop_words:
                 if self.verbose: print("stop word filter failed")
                 return False
 
         return True
 
+    @staticmethod
+    def alpha_passes(alpha_count: int, alpha_frac: float) -> bool:
+        return alpha_frac >= GopherFilter.min_alpha_frac and GopherFilter.min_words <= alpha_count <= GopherFilter.max_words
+
     @staticmethod
     def word_alphabet_filter(tokenized: list[str]) -> bool:
         # 80% of words must have at least one alphabetic character
         alpha_count = sum(1 for word in tokenized if any(c.isalpha() for c in word))
         # print(alpha_count, len(tokenized))
         alpha_frac = alpha_count / len(tokenized)
-        return alpha_frac >= 0.8 and alpha_count >= 50 and alpha_count <= 100000
+        return GopherFilter.alpha_passes(alpha_count, alpha_frac)
     
     @staticmethod
     def tokenize(text: str) -> list[str]:
@@ -82,27 +115,27 @@ class GopherFilter():
 
     @staticmethod
     def length_filter(tokenized: list[str]) -> bool:
-        return len(tokenized) >= 50 and len(tokenized) <= 100000
+        return GopherFilter.min_words <= len(tokenized) <= GopherFilter.max_words
 
     @staticmethod
     def mean_length_filter(tokenized: list[str]) -> bool:
         # compute mean word length
         mean_length = sum(len(word) for word in tokenized) / len(tokenized)
-        return mean_length >= 3 and mean_length <= 10
+        return GopherFilter.min_mean_word_length <= mean_length <= GopherFilter.max_mean_word_length
     
     @staticmethod
     def ellipsis_filter(splitlines: list[str]) -> bool:
         ellipsis_count = sum(1 for line in splitlines if line.endswith("..."))
-        return (ellipsis_count / len(splitlines)) <= 0.3
+        return (ellipsis_count / len(splitlines)) <= GopherFilter.max_ellipsis_frac
     
     @staticmethod
     def bullet_point_filter(tokenized: list[str]) -> bool:
         # count number of bullet points
         bullet_point_count = sum(1 for line in tokenized if line.startswith(tuple(GopherFilter.bullet_point_characters)))
-        return (bullet_point_count / len(tokenized)) <= 0.9
+        return (bullet_point_count / len(tokenized)) <= GopherFilter.max_bullet_point_frac
 
     @staticmethod
     def stop_word_filter(tokenized: list[str]) -> bool:
         # count number of stop words
         stop_word_count = sum(1 for word in tokenized if word in GopherFilter.stop_words)
-        return stop_word_count >= 2
\ No newline at end of file
+        return stop_word_count >= GopherFilter.min_stop_words
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+Multi-core processing of a single input with one set of shared models.
+
+A reader process produces numbered items (e.g. decoded WET records) and feeds them
+in batches through a bounded queue to a pool of worker processes, which send their
+results back through a second bounded queue. The parent yields results in input
+order, so it can write outputs and checkpoints exactly as in the single-process
+case. The bounded queues give backpressure: a slow writer stalls the workers, and
+slow workers stall the reader. Results that arrive ahead of a slow batch are held
+back to keep the order, so the reader also needs one of a fixed number of slots per
+batch, which is only freed once the batch has been yielded, and memory stays
+bounded even while one batch is much slower than the others.
+
+Processes are forked, so anything loaded in the parent before calling
+`ordered_pool_map` (such as fastText models) is shared copy-on-write with the
+workers instead of being loaded once per process.
+"""
+
+import heapq
+import multiprocessing
+import queue
+import traceback
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+BATCH_SIZE = 32
+
+
+def _reader_main(produce: Callable[[], Iterable[tuple[int, Any]]], record_queue, result_queue,
+                 n_procs: int, batch_size: int, slots):
+    try:
+        batch = []
+        for item in produce():
+            batch.append(item)
+            if len(batch) >= batch_size:
+                slots.acquire()
+                record_queue.put(batch)
+                batch = []
+        if batch:
+            slots.acquire()
+            record_queue.put(batch)
+    except Exception:
+        result_queue.put(("error", traceback.format_exc()))
+        return
+
+    # one stop signal per worker
+    for _ in range(n_procs):
+        record_queue.put(None)
+
+
+def _worker_main(fn: Callable[[Any], Any], record_queue, result_queue):
+    try:
+        while True:
+            batch = record_queue.get()
+            if batch is None:
+                break
+            result_queue.put(("results", [(i, fn(item)) for i, item in batch]))
+        result_queue.put(("done", None))
+    except Exception:
+        result_queue.put(("error", traceback.format_exc()))
+
+
+def ordered_pool_map(produce: Callable[[], Iterable[tuple[int, Any]]], fn: Callable[[Any], Any],
+                     n_procs: int, start: int = 0, batch_size: int = BATCH_SIZE,
+                     queue_size: Optional[int] = None) -> Iterator[tuple[int, Any]]:
+    """
+    apply fn to every item produced by a reader process, using n_procs worker processes
+
+    Args:
+        produce: called in the reader process, yields (index, item) with consecutive
+            indices beginning at start
+        fn: called in the worker processes on each item
+        n_procs: number of worker processes
+        start: index of the first item
+        batch_size: number of items sent to a worker at once
+        queue_size: number of batches that can wait in each queue, defaults to 4 * n_procs. At most
+            queue_size + n_procs batches are read and not yielded yet, including results held back
+
+    Yields:
+        (index, fn(item)) in index order
+    """
+    ctx = multiprocessing.get_context("fork")
+    queue_size = queue_size or 4 * n_procs
+    record_queue = ctx.Queue(maxsize=queue_size)
+    result_queue = ctx.Queue(maxsize=queue_size)
+    # one per batch in flight, released once all of its results are yielded
+    slots = ctx.Semaphore(queue_size + n_procs)
+
+    reader = ctx.Process(target=_reader_main, args=(produce, record_queue, result_queue, n_procs, batch_size, slots),
+                         daemon=True)
+    workers = [ctx.Process(target=_worker_main, args=(fn, record_queue, result_queue), daemon=True)
+               for _ in range(n_procs)]
+    processes = [reader] + workers
+    for process in processes:
+        process.start()
+
+    # results arrive out of order, hold them until all earlier ones are in
+    pending = {}
+    # last index of every batch received and not fully yielded
+    batch_ends = []
+    next_idx = start
+    n_done = 0
+    try:
+        while n_done < n_procs:
+            try:
+                kind, payload = result_queue.get(timeout=10)
+            except queue.Empty:
+                # make sure nobody died without reporting (e.g. killed for using too much memory)
+                for process in processes:
+                    if process.exitcode not in (None, 0):
+                        raise RuntimeError(f"Pool process {process.pid} exited with code {process.exitcode}")
+                continue
+
+            if kind == "error":
+                raise RuntimeError(f"Pool process failed:\n{payload}")
+            if kind == "done":
+                n_done += 1
+                continue
+
+            for i, result in payload:
+                pending[i] = result
+            heapq.heappush(batch_ends, payload[-1][0])
+            while next_idx in pending:
+                yield next_idx, pending.pop(next_idx)
+                next_idx += 1
+            while batch_ends and batch_ends[0] < next_idx:
+                heapq.heappop(batch_ends)
+                slots.release()
+
+        if pending:
+            raise RuntimeError(f"Missing results before index {min(pending)}")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
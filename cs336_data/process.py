@@ -7,20 +7,37 @@ with configurable labels and optional line limits.
 
 import os
 import glob
+import shutil
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Optional, Union
 from pathlib import Path
 import random
 
-from cs336_data.utils import warc_to_txt, LanguageDetector, NSFWDetector, ToxicDetector
+from cs336_data.utils import warc_payloads, html_to_txt, LanguageDetector, NSFWDetector, ToxicDetector
 from cs336_data.gopher import GopherFilter
+from cs336_data.url import fetch_batch, reservoir_sample
 
 bullet_point_characters = tuple(["*", "-", "•", "•"])
 
+# bytes buffered by the output file before they are written
+WRITE_BUFFER = 1024 * 1024
+
+# batches fetched at once when streaming, batches grouped by domain are often a single large
+# domain that the per-host limit of the fetcher keeps to a few requests at a time
+STREAM_BATCHES = 8
+
+# converter of each worker of stream_urls_to_fasttext (with its own classifiers) or of
+# process_warc_files with n_procs > 1 (forked from the parent, sharing its classifiers)
+_WORKER_CONVERTER = None
+
 
 class WarcToFastTextConverter:
     """Convert WARC files to FastText training format."""
     
-    def __init__(self, output_file: str, labels: List[str], max_lines: Optional[int] = None):
+    def __init__(self, output_file: str, labels: List[str], max_lines: Optional[int] = None, load_filters: bool = True):
         """
         initialize the converter
         
@@ -28,17 +45,32 @@ class WarcToFastTextConverter:
             output_file: Path to output text file
             labels: List of labels to apply to documents (without __label__ prefix)
             max_lines: Optional limit on number of lines to write
+            load_filters: Whether to load the classifiers, only needed to filter content
         """
         self.output_file = output_file
+        # kept open for the lifetime of the converter, close() flushes it
+        self._output = open(output_file, 'a', encoding='utf-8', buffering=WRITE_BUFFER)
         self.labels = [f"__label__{label}" for label in labels]
         self.max_lines = max_lines
         self.lines_written = 0
+        # multiprocessing.Value counting the lines of every worker, when files are processed in parallel
+        self.shared_lines = None
         self.gopherfilter = GopherFilter()
 
-        self.language_detector = LanguageDetector()
-        self.nsfw_detector = NSFWDetector()
-        self.toxic_detector = ToxicDetector()
+        if load_filters:
+            self.language_detector = LanguageDetector()
+            self.nsfw_detector = NSFWDetector()
+            self.toxic_detector = ToxicDetector()
     
+    def close(self) -> None:
+        self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def _filter_text(self, text: str, threshold: float = 0.6) -> str:
         # apply language, gopher, and quality filters
         lang, langconf = self.language_detector.detect_language(text)
@@ -89,8 +121,20 @@ class WarcToFastTextConverter:
         """check for line limit."""
         if self.max_lines is None:
             return True
+        if self.shared_lines is not None:
+            return self.shared_lines.value < self.max_lines
         
         return self.lines_written < self.max_lines
+
+    def _reserve_line(self) -> bool:
+        """claim one of the max_lines lines before writing it, atomically across workers"""
+        if self.shared_lines is None:
+            return self._should_continue()
+        with self.shared_lines.get_lock():
+            if self.max_lines is not None and self.shared_lines.value >= self.max_lines:
+                return False
+            self.shared_lines.value += 1
+            return True
     
     def process_warc_file(self, warc_file: str, n_records: Optional[int] = None, 
                          sample: bool = False, filter_content: bool = True, clean_content: bool = False) -> int:
@@ -100,7 +144,7 @@ class WarcToFastTextConverter:
         Args:
             warc_file: Path to WARC file
             n_records: Optional limit on records to process from this file
-            sample: Whether to randomly sample records from the WARC file
+            sample: Whether to randomly sample n_records * 10 records from the WARC file
             filter_content: Whether to apply filters to the text
             clean_content: Whether to clean the content of the text
             
@@ -109,31 +153,31 @@ class WarcToFastTextConverter:
         """
         lines_from_file = 0
         
-        
         if sample:
-            # count total records
-            total_records = sum(1 for _ in warc_to_txt(warc_file, n_records = 1))
-            indices = random.sample(range(0, total_records), n_records * 10)
+            if n_records is None:
+                raise ValueError("sample needs n_records")
+            # one pass over the raw payloads, only the sampled records are extracted
+            payloads, total_records = reservoir_sample(warc_payloads(warc_file), n_records * 10)
+            print(f"sampled {len(payloads)} of {total_records} records from {warc_file}")
         else:
-            indices = []
+            payloads = warc_payloads(warc_file)
 
-        for i, txt in enumerate(warc_to_txt(warc_file, n_records = float('inf'))):
+        for i, payload in enumerate(payloads):
             if i % 50 == 0:
                 print(f"processing record {i} of {n_records} from {warc_file}")
             
             if not self._should_continue(): break
-
-            if sample and i not in indices: continue
             
             try:
+                txt = html_to_txt(payload)
                 if filter_content and not self._filter_text(txt): continue
                 
                 # format and write the line
                 formatted_line = self._format_line(txt, clean_content)
                 if not formatted_line: continue
+                if not self._reserve_line(): break
                 
-                with open(self.output_file, 'a', encoding='utf-8') as f:
-                    f.write(formatted_line)
+                self._output.write(formatted_line)
                 
                 self.lines_written += 1
                 lines_from_file += 1
@@ -150,7 +194,8 @@ class WarcToFastTextConverter:
                           n_records: Optional[int] = None,
                           sample: bool = False,
                           filter_content: bool = True,
-                          clean_content: bool = False) -> None:
+                          clean_content: bool = False,
+                          n_procs: int = 1) -> None:
         """
         Process WARC files from a path or list of paths.
         
@@ -159,6 +204,7 @@ class WarcToFastTextConverter:
             n_records: Optional limit on records per file
             sample: Whether to randomly sample records from the WARC file
             filter_content: Whether to apply filters to the text
+            n_procs: Number of processes converting files concurrently
         """
         
         # get list of WARC files to process
@@ -187,6 +233,12 @@ class WarcToFastTextConverter:
         if sample:
             print(f"Sampling {n_records} records per file")
         
+        if n_procs > 1:
+            self._process_warc_files_parallel(warc_files, n_procs, n_records=n_records, sample=sample,
+                                              filter_content=filter_content, clean_content=clean_content)
+            print(f"conversion complete! Total lines written: {self.lines_written}")
+            return
+
         # process each file
         for i, warc_file in enumerate(warc_files):
             if not self._should_continue():
@@ -204,6 +256,58 @@ class WarcToFastTextConverter:
         
         print(f"conversion complete! Total lines written: {self.lines_written}")
 
+    def _process_warc_files_parallel(self, warc_files: List[str], n_procs: int, **kwargs) -> None:
+        """
+        process files on a pool of forked workers that share this converter's classifiers.
+        every line is claimed from a shared counter before it is written, so max_lines is exact,
+        and workers stop in the middle of a file once it is reached. each worker writes to its
+        own part file, which are appended to the output at the end.
+        """
+        global _WORKER_CONVERTER
+        # workers inherit the converter, so they have to be forked whatever the platform default is
+        ctx = multiprocessing.get_context("fork")
+        # nothing buffered may be inherited by the workers, it would be written twice
+        self._output.flush()
+        _WORKER_CONVERTER = self
+        shared_lines = ctx.Value('q', self.lines_written)
+        part_prefix = f"{self.output_file}.{os.getpid()}-{os.urandom(4).hex()}"
+        # seeds drawn here, so random.seed() still makes the samples of every file reproducible
+        jobs = [(warc_file, random.getrandbits(64), kwargs) for warc_file in warc_files]
+
+        try:
+            with ctx.Pool(n_procs, initializer=_init_convert_worker, initargs=(part_prefix, shared_lines)) as pool:
+                for warc_file, lines_from_file in pool.imap_unordered(_convert_warc_file, jobs):
+                    print(f"  {os.path.basename(warc_file)} -> {lines_from_file} lines written, {shared_lines.value} in total")
+
+            # merge the part files of the workers
+            for part in sorted(glob.glob(f"{part_prefix}.*.part")):
+                with open(part, 'r', encoding='utf-8') as f:
+                    shutil.copyfileobj(f, self._output)
+                os.remove(part)
+            self.lines_written = shared_lines.value
+        finally:
+            # part files are left behind if a worker raised
+            for part in glob.glob(f"{part_prefix}.*.part"):
+                os.remove(part)
+            _WORKER_CONVERTER = None
+
+
+def _init_convert_worker(part_prefix: str, shared_lines) -> None:
+    """reuse the converter forked from the parent, with a part file of its own"""
+    converter = _WORKER_CONVERTER
+    converter._output = open(f"{part_prefix}.{os.getpid()}.part", 'w', encoding='utf-8', buffering=WRITE_BUFFER)
+    converter.shared_lines = shared_lines
+    converter.lines_written = 0
+
+
+def _convert_warc_file(job: tuple) -> tuple:
+    warc_file, seed, kwargs = job
+    random.seed(seed)
+    lines_from_file = _WORKER_CONVERTER.process_warc_file(warc_file, **kwargs)
+    # pool workers are terminated without closing their file
+    _WORKER_CONVERTER._output.flush()
+    return warc_file, lines_from_file
+
 
 def convert_warc_to_fasttext(warc_path: Union[str, List[str]], 
                            output_file: str,
@@ -212,7 +316,8 @@ def convert_warc_to_fasttext(warc_path: Union[str, List[str]],
                            records_per_file: Optional[int] = None,
                            sample: bool = False,
                            filter_content: bool = True,
-                           clean_content: bool = False) -> None:
+                           clean_content: bool = False,
+                           n_procs: int = 1) -> None:
     """
     convenience function to convert WARC files to FastText format.
     
@@ -223,9 +328,95 @@ def convert_warc_to_fasttext(warc_path: Union[str, List[str]],
         max_lines: Optional limit on total lines to write
         records_per_file: Optional limit on records per WARC file
         sample: Whether to randomly sample records from the WARC file
+        n_procs: Number of processes converting files concurrently
+    """
+    with WarcToFastTextConverter(output_file, labels, max_lines) as converter:
+        converter.process_warc_files(warc_path = warc_path, n_records = records_per_file, sample = sample, filter_content = filter_content, clean_content = clean_content, n_procs = n_procs)
+
+
+def _init_extract_worker(labels: List[str], filter_content: bool) -> None:
+    global _WORKER_CONVERTER
+    # the converter only formats lines here, the worker returns them to the process that writes
+    _WORKER_CONVERTER = WarcToFastTextConverter(os.devnull, labels, load_filters=filter_content)
+
+
+def _extract_line(html: bytes, filter_content: bool, clean_content: bool) -> str:
+    """training line for one fetched page, empty if it doesn't pass the filters"""
+    try:
+        txt = html_to_txt(html)
+        if filter_content and not _WORKER_CONVERTER._filter_text(txt):
+            return ""
+        return _WORKER_CONVERTER._format_line(txt, clean_content)
+    except Exception as e:
+        print(f"Error extracting page: {e}")
+        return ""
+
+
+def stream_urls_to_fasttext(batch_files: List[str],
+                            download_dir: str,
+                            output_file: str,
+                            labels: List[str],
+                            max_lines: int,
+                            n_workers: int = 8,
+                            filter_content: bool = True,
+                            clean_content: bool = False,
+                            n_batches: int = STREAM_BATCHES) -> int:
     """
-    converter = WarcToFastTextConverter(output_file, labels, max_lines)
-    converter.process_warc_files(warc_path = warc_path, n_records = records_per_file, sample = sample, filter_content = filter_content, clean_content = clean_content)
+    download batches of URLs and turn every page into a training line as soon as it arrives,
+    stopping the downloads once max_lines lines are written.
+
+    pages are extracted and filtered on a pool of n_workers processes, each loading the classifiers
+    once, while the fetcher keeps downloading. n_batches batches are fetched at once, each with
+    `cs336_data.url.fetch_batch` in its own thread and event loop, so every response is still written
+    to the batch WARC and manifest, and URLs that were never reached are fetched by a later run.
+    batches grouped by domain don't share hosts, so the per-host limit holds across batches.
+
+    args:
+        batch_files: files of URLs, fetched n_batches at a time in order until there are enough lines
+        download_dir: directory for the WARC, manifest and log of every batch
+        output_file: text file the lines are appended to
+        labels: List of labels to apply (without __label__ prefix)
+        max_lines: number of lines to write
+        n_workers: number of extraction processes
+        filter_content: Whether to apply filters to the text
+        clean_content: Whether to clean the content of the text
+        n_batches: batches fetched at once
+
+    returns:
+        number of lines written
+    """
+    lines_written = 0
+    # the batches write lines from their own threads
+    lock = threading.Lock()
+    with ProcessPoolExecutor(n_workers, initializer=_init_extract_worker, initargs=(labels, filter_content)) as pool, \
+            open(output_file, 'a', encoding='utf-8') as f:
+
+        async def on_response(url: str, status: int, body: bytes) -> bool:
+            nonlocal lines_written
+            if status == 200 and body and lines_written < max_lines:
+                line = await asyncio.get_running_loop().run_in_executor(
+                    pool, _extract_line, body, filter_content, clean_content)
+                with lock:
+                    # pages still being extracted when the budget is reached are dropped
+                    if line and lines_written < max_lines:
+                        f.write(line)
+                        lines_written += 1
+                        if lines_written % 1000 == 0:
+                            print(f"Processed {lines_written} lines...")
+            return lines_written < max_lines
+
+        def fetch(batch_file: str) -> None:
+            # batches that start after the budget is reached are left for a later run
+            if lines_written >= max_lines:
+                return
+            fetch_batch(batch_file, download_dir, on_response=on_response)
+            print(f"  -> {lines_written} lines written after {os.path.basename(batch_file)}")
+
+        with ThreadPoolExecutor(n_batches) as threads:
+            list(threads.map(fetch, batch_files))
+
+    print(f"streaming complete! Total lines written: {lines_written}")
+    return lines_written
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+"""
+Re-apply filter thresholds from score sidecars, without running the classifiers.
+
+The first pass saves the classifier outputs and Gopher statistics of every record
+with `--write-scores`, and the second pass always saves its Paloma scores. This
+tool applies new thresholds to the sidecars in a vectorized pass and writes a new
+filtered corpus: first pass documents are re-read from the WET files by record
+index and cleaned, second pass documents are streamed from its inputs.
+
+    python -m cs336_data.reselect first --file-list wetlist.json --scores-dir cc_filtered --output-dir cc_reselected --quality-threshold 0.7 --dry-run
+    python -m cs336_data.reselect paloma --file-list txtlist.json --scores-dir cc_filtered_paloma --output-dir cc_reselected_paloma --paloma-percentile 25
+"""
+
+import argparse
+import json
+import os
+import pathlib
+from dataclasses import asdict, replace
+from typing import Optional
+
+from cs336_data.checkpoint import atomic_write_json
+from cs336_data.executors import BACKENDS, get_executor, run_jobs
+from cs336_data.first_filter import (FilterConfig, FILTER_SCORE_DTYPE, clean_text, iter_wet_records, output_current,
+                                     output_settings, score_output_path, select_records, token_output_path)
+from cs336_data.scores import load_scores
+from cs336_data.second_filter import (PalomaConfig, PALOMA_SCORE_DTYPE, global_paloma_cutoff, paloma_output_current,
+                                      scores_path, select_documents, sketch_path, write_selected)
+from cs336_data.shards import ShardWriter, write_settings
+from cs336_data.token_shards import TokenShardWriter
+
+N_WORKERS = 16
+
+
+def reselect_wet_file(input_path: str, scores_file: str, output_path: str, config: Optional[FilterConfig] = None,
+                      dry_run: bool = False) -> dict:
+    """
+    Write the records of a WET file that pass the thresholds of config according to its sidecar
+
+    Returns:
+        number of scored records, and of records left after each filter
+    """
+    config = config or FilterConfig()
+    scores = load_scores(scores_file, FILTER_SCORE_DTYPE)
+    selected = select_records(scores, config)
+    stats = {'scored_records': len(scores)}
+    stats.update({key: int(mask.sum()) for key, mask in selected.items()})
+    if dry_run:
+        return stats
+
+    if output_current(output_path, config):
+        print(f"Skipping {input_path} because it already exists")
+        return stats
+
+    write_settings(output_path, None)
+    writers = {}
+    if config.write_text:
+        writers['text'] = ShardWriter(output_path, compression=config.output_compression,
+                                      max_bytes=config.shard_max_bytes, max_docs=config.shard_max_docs,
+                                      tag=str(os.getpid()))
+    if config.write_tokens:
+        writers['tokens'] = TokenShardWriter(token_output_path(output_path), tag=str(os.getpid()))
+
+    # records are scored in order, so the kept ones can be matched while streaming the WET file
+    records = scores["record"][selected['after_quality_filter']]
+    n_kept = 0
+    if len(records) > 0:
+        for i, text in iter_wet_records(input_path):
+            if i > records[-1]:
+                break
+            if i != records[n_kept]:
+                continue
+            text = clean_text(text)
+            for writer in writers.values():
+                writer.write(text)
+            n_kept += 1
+    if n_kept != len(records):
+        raise RuntimeError(f"Only found {n_kept} of {len(records)} selected records in {input_path}")
+
+    atomic_write_json(stats, output_path.replace(".txt", "_stats.json"))
+    for writer in writers.values():
+        writer.close()
+    write_settings(output_path, output_settings(config))
+    return stats
+
+def reselect_txt_file(input_path: str, scores_file: str, output_path: str, config: Optional[PalomaConfig] = None,
+                      dry_run: bool = False) -> dict:
+    """
+    Write the documents of a first pass output that pass the Paloma cutoff of config according to its sidecar
+
+    Returns:
+        number of scored and kept documents
+    """
+    config = config or PalomaConfig()
+    scores = load_scores(scores_file, PALOMA_SCORE_DTYPE)
+    keep = select_documents(scores, config)
+    stats = {'scored_docs': len(scores), 'kept_docs': int(keep.sum())}
+    if dry_run:
+        return stats
+
+    if paloma_output_current(output_path, config):
+        print(f"Skipping {input_path} because it already exists")
+        return stats
+    write_selected(input_path, output_path, keep, config=config)
+    return stats
+
+def summarize(results: list[dict]) -> dict:
+    """add up the stats of every file"""
+    total = {}
+    for stats in results:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+def run_reselect_first(wet_filepaths: list[str], scores_directory: str, output_directory: str,
+                       config: Optional[FilterConfig] = None, backend: str = "local",
+                       n_workers: int = N_WORKERS, dry_run: bool = False, **slurm_params) -> dict:
+    """
+    Re-filter WET files from the sidecars of a first pass run with --write-scores
+
+    Args:
+        wet_filepaths: WET files of the first pass
+        scores_directory: output directory of the first pass, which holds the sidecars
+        output_directory: directory for the new filtered shards
+        config: new thresholds and outputs
+        backend: "submitit", "local" or "inprocess", see cs336_data.executors
+        n_workers: number of files processed at the same time
+        dry_run: only count the records that would be kept
+
+    Returns:
+        stats added up over all files
+    """
+    config = config or FilterConfig()
+    jobs = []
+    for wet_filepath in wet_filepaths:
+        wet_filename = str(pathlib.Path(wet_filepath).name).split('.')[0]
+        scores_file = score_output_path(os.path.join(scores_directory, f"{wet_filename}.txt"))
+        if not os.path.exists(scores_file):
+            print(f"Skipping {wet_filepath} because it has no scores")
+            continue
+        jobs.append((wet_filepath, scores_file, os.path.join(output_directory, f"{wet_filename}.txt"), config, dry_run))
+    print(f"Found scores for {len(jobs)}/{len(wet_filepaths)} files")
+
+    executor = get_executor(backend, n_workers, **slurm_params)
+    stats = summarize(run_jobs(executor, reselect_wet_file, jobs, desc="Files"))
+    print(f"Stats: {stats}")
+    return stats
+
+def run_reselect_paloma(txt_filepaths: list[str], scores_directory: str, output_directory: str,
+                        config: Optional[PalomaConfig] = None, backend: str = "local",
+                        n_workers: int = N_WORKERS, dry_run: bool = False, **slurm_params) -> dict:
+    """
+    Re-filter first pass outputs from the sidecars of a second pass run
+
+    Args:
+        txt_filepaths: inputs of the second pass
+        scores_directory: output directory of the second pass, which holds the sidecars and sketches
+        output_directory: directory for the new filtered shards
+        config: new percentile or cutoff and outputs, with global_cutoff the sketches are merged again
+        backend: "submitit", "local" or "inprocess", see cs336_data.executors
+        n_workers: number of files processed at the same time
+        dry_run: only count the documents that would be kept
+
+    Returns:
+        stats added up over all files
+    """
+    config = config or PalomaConfig()
+    files = []
+    for txt_filepath in txt_filepaths:
+        txt_filename = str(pathlib.Path(txt_filepath).name).split('.')[0]
+        scored_path = os.path.join(scores_directory, f"{txt_filename}_paloma.txt")
+        if not os.path.exists(sketch_path(scored_path)):
+            print(f"Skipping {txt_filepath} because it has no scores")
+            continue
+        files.append((txt_filepath, scored_path, os.path.join(output_directory, f"{txt_filename}_paloma.txt")))
+    print(f"Found scores for {len(files)}/{len(txt_filepaths)} files")
+
+    if config.global_cutoff and config.paloma_cutoff is None and files:
+        sketch_paths = [sketch_path(scored_path) for _, scored_path, _ in files]
+        config = replace(config, paloma_cutoff=global_paloma_cutoff(sketch_paths, config.paloma_percentile))
+
+    jobs = [(txt_filepath, scores_path(scored_path), output_path, config, dry_run)
+            for txt_filepath, scored_path, output_path in files]
+    executor = get_executor(backend, n_workers, **slurm_params)
+    stats = summarize(run_jobs(executor, reselect_txt_file, jobs, desc="Files"))
+    print(f"Stats: {stats}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-apply filter thresholds from score sidecars")
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+    first = subparsers.add_parser("first", help="thresholds of the first pass")
+    paloma = subparsers.add_parser("paloma", help="paloma cutoff of the second pass")
+    for stage_parser in [first, paloma]:
+        stage_parser.add_argument("--file-list", required=True, help="json list of the inputs of the pass")
+        stage_parser.add_argument("--scores-dir", required=True, help="output directory of the pass")
+        stage_parser.add_argument("--output-dir", required=True, help="directory for the new filtered shards")
+        stage_parser.add_argument("--limit", type=int, default=None, help="only process the first N files")
+        stage_parser.add_argument("--backend", choices=BACKENDS, default="local", help="where to run jobs (default: local)")
+        stage_parser.add_argument("--n-workers", type=int, default=N_WORKERS, help=f"number of workers (default: {N_WORKERS})")
+        stage_parser.add_argument("--dry-run", action="store_true", help="only print how many documents would be kept")
+        stage_parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="gzip")
+    first.add_argument("--language-threshold", type=float, default=FilterConfig.language_threshold)
+    first.add_argument("--nsfw-threshold", type=float, default=FilterConfig.nsfw_threshold)
+    first.add_argument("--toxic-threshold", type=float, default=FilterConfig.toxic_threshold)
+    first.add_argument("--quality-threshold", type=float, default=FilterConfig.quality_threshold)
+    first.add_argument("--write-tokens", action="store_true", help="also write GPT-2 tokenized .bin shards")
+    paloma.add_argument("--paloma-percentile", type=float, default=PalomaConfig.paloma_percentile)
+    paloma.add_argument("--per-file-cutoff", action="store_true", help="compute the percentile within each file")
+    paloma.add_argument("--paloma-cutoff", type=float, default=None, help="fixed confidence cutoff")
+    args = parser.parse_args()
+
+    with open(args.file_list, "r") as f:
+        filepaths = json.load(f)
+    if args.limit is not None:
+        filepaths = filepaths[:args.limit]
+    compression = None if args.compression == "none" else args.compression
+
+    if args.stage == "first":
+        config = FilterConfig(
+            language_threshold=args.language_threshold,
+            nsfw_threshold=args.nsfw_threshold,
+            toxic_threshold=args.toxic_threshold,
+            quality_threshold=args.quality_threshold,
+            output_compression=compression,
+            write_tokens=args.write_tokens,
+        )
+        print(f"Config: {asdict(config)}")
+        run_reselect_first(filepaths, args.scores_dir, args.output_dir, config=config, backend=args.backend,
+                           n_workers=args.n_workers, dry_run=args.dry_run)
+    else:
+        config = PalomaConfig(
+            paloma_percentile=args.paloma_percentile,
+            global_cutoff=not args.per_file_cutoff,
+            paloma_cutoff=args.paloma_cutoff,
+            output_compression=compression,
+        )
+        print(f"Config: {asdict(config)}")
+        run_reselect_paloma(filepaths, args.scores_dir, args.output_dir, config=config, backend=args.backend,
+                            n_workers=args.n_workers, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Fixed-width score sidecars.
+
+Filtering passes can save the classifier outputs and statistics of every document
+they look at as a flat file of numpy structured records (`<name>.scores`), so that
+thresholds can be changed later with a vectorized pass over the sidecars (see
+`cs336_data.reselect`) instead of running the classifiers again. The files have no
+header: the record layout is the dtype defined by the pass that wrote them, and
+they are read back with `np.memmap`.
+
+The writer has the same checkpoint()/close() interface as
+`cs336_data.shards.ShardWriter`, so the sidecar is checkpointed and committed
+together with the text shards.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+
+def load_scores(path: str, dtype: np.dtype) -> np.ndarray:
+    """memory-map a score sidecar"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class ScoreWriter():
+    def __init__(self, output_path: str, dtype: np.dtype, tag: str = "", resume_state: Optional[dict] = None):
+        """
+        append fixed-width records to a score sidecar
+
+        Args:
+            output_path: path of the sidecar, only created on close
+            dtype: numpy structured dtype of the records
+            tag: name for the temporary file, so concurrent copies of a task don't collide
+            resume_state: state returned by checkpoint() of a previous writer
+        """
+        self.output_path = output_path
+        self.dtype = np.dtype(dtype)
+        suffix = f".{tag}" if tag else ""
+        self._tmp_path = f"{output_path}{suffix}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+        state = resume_state or {"rows": 0}
+        self.rows = state["rows"]
+        if self.rows > 0:
+            # drop anything written after the last checkpoint
+            self._f = open(self._tmp_path, "r+b")
+            self._f.truncate(self.rows * self.dtype.itemsize)
+            self._f.seek(self.rows * self.dtype.itemsize)
+        else:
+            self._f = open(self._tmp_path, "wb")
+
+    def write(self, records) -> None:
+        """append a record or an array of records"""
+        records = np.atleast_1d(np.asarray(records, dtype=self.dtype))
+        self._f.write(records.tobytes())
+        self.rows += len(records)
+
+    def checkpoint(self) -> dict:
+        """make everything written so far durable and return the state needed to resume"""
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        return {"rows": self.rows}
+
+    def close(self) -> str:
+        """finish the sidecar and move it into place"""
+        self.checkpoint()
+        self._f.close()
+        os.replace(self._tmp_path, self.output_path)
+        return self.output_path
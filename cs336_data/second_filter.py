@@ -1,124 +1,336 @@
+"""
+Second filtering pass: keep documents that look like the Paloma validation data.
+
+Runs the Paloma classifier over the shards written by the first pass and keeps
+every document classified as Paloma, plus non-Paloma documents whose confidence is
+below the PALOMA_PERCENTILE percentile (0-100, as in np.percentile, so 50 is the
+median) of all confidences. By default the percentile is global: a first pass scores every file,
+saving the scores and a quantile sketch per file, the sketches are merged into one
+corpus-wide cutoff, and a second pass applies it using the saved scores. Sketches
+record the path and modification time of the classifier, and the scores of a file
+are only reused when they match the current classifier. Outputs are redone when they
+are missing or were made with another classifier, percentile or cutoff. Documents
+are streamed in chunks of CHUNK_DOCS in both passes, so memory does not depend on
+the size of the input shards. Files are
+handed to workers through a task queue, and workers run on SLURM, a local process
+pool or in-process:
+
+    python -m cs336_data.second_filter --input-dir cc_filtered --backend inprocess --limit 2
+
+Inputs are the shard manifests (`X.shards.json`) of the first pass outputs in a directory,
+or a json list of outputs, where `X.txt` is read from its shards when it was written as shards.
+"""
+
+import argparse
+import glob
 import os
 import pathlib
-import submitit
-from tqdm import tqdm
-from cs336_data.utils import QualityFilter
+from dataclasses import dataclass, asdict
+from typing import Optional
+from cs336_data.utils import QualityFilter, classifier_meta
+import functools
+import itertools
 import json
 import numpy as np
-import math
+from dataclasses import replace
+from typing import Iterator
+from cs336_data.task_queue import SQLiteTaskQueue, run_queue_worker
+from cs336_data.shards import ShardWriter, iter_documents, output_stem, settings_current, shards_complete, write_settings
+from cs336_data.executors import BACKENDS, get_executor, run_jobs
+from cs336_data.sketch import KLLSketch, SKETCH_K, merge_sketches
+from cs336_data.scores import ScoreWriter, load_scores
 
 VERBOSE = False
 DEDUP = False
 
 PALOMA_FILTER = "/home/c-cye/assignment4-data/cs336_data/paloma.bin"
-PALOMA_PERCENTILE = 0.50
-
-def process_single_txt_file(input_path: str, output_path: str):
-    # load paloma filter
-    paloma_filter = QualityFilter(classifier_id=PALOMA_FILTER)
-
-    # load text file
-    text = open(input_path, "r").read()
-    docs = text.split("<|endoftext|>")
-    docs = [doc.strip() for doc in docs if doc.strip()]
-    
-    # apply paloma filter
-    labels, confs = paloma_filter.classifier.predict(docs)
-    
-    # keep all paloma and all non-paloma with confs under 50th percentile
-    paloma_docs = [i for i, label in enumerate(labels) if label[0] == "__label__paloma"]
-    paloma_percentile = np.percentile(confs, PALOMA_PERCENTILE)
-    non_paloma_docs = [i for i, label in enumerate(labels) if label[0] != "__label__paloma" and confs[i][0] < paloma_percentile]
-    filtered_docs = paloma_docs + non_paloma_docs
-    
-    # write to output file
-    output_file = open(output_path, "w")
-
-    for idx in filtered_docs:
-        # write to output file
-        output_file.write(docs[idx])
-        output_file.write("<|endoftext|>")
-    
-    output_file.close()
-
-def process_batch_of_txt_files(txt_filepaths_batch: list, output_directory_path: str, work_dir_base: str, batch_id: int):
-    """Process a batch of txt files in a single job"""
-    print(f"Starting batch {batch_id} with {len(txt_filepaths_batch)} files")
-    
-    results = []
-    for txt_filepath in txt_filepaths_batch:
-        try:
-            txt_filename = str(pathlib.Path(txt_filepath).name)
-            txt_filename = txt_filename.split('.')[0]
-            
-            output_path = os.path.join(output_directory_path, f"{txt_filename}_paloma.txt")
-            
-            # check if output file already exists
-            if os.path.exists(output_path):
-                print(f"Skipping {txt_filename} because it already exists")
-                continue
-            
-            result = process_single_txt_file(txt_filepath, output_path)
-            results.append(result)
-            print(f"Batch {batch_id}: Completed {txt_filename}")
-            
-        except Exception as e:
-            print(f"Batch {batch_id}: Error processing {txt_filepath}: {str(e)}")
-            continue
-    
-    print(f"Batch {batch_id} completed with {len(results)} successful files")
-    return results
+# keep non-paloma documents under the 50th percentile of confidence, 0-100 as in np.percentile
+PALOMA_PERCENTILE = 50.0
+
+# use one percentile cutoff for the whole corpus instead of one per file
+GLOBAL_CUTOFF = True
+
+# documents classified at once, the only documents held in memory
+CHUNK_DOCS = 4096
 
-def partition_list(lst, n):
-    """Partition a list into n roughly equal chunks"""
-    chunk_size = math.ceil(len(lst) / n)
-    return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
+# per-document classifier output, saved next to the output so the filter pass can skip inference
+PALOMA_SCORE_DTYPE = np.dtype([("is_paloma", "?"), ("conf", "<f4")])
+
+# output shards: None, "gzip" or "zstd", and uncompressed bytes / documents per shard
+OUTPUT_COMPRESSION = "gzip"
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+SHARD_MAX_DOCS = None
 
 N_WORKERS = 128
-txt_filepaths = json.loads(open("txtlist.json", "r").read())
-N_FILES = len(txt_filepaths)
-print(f"Found {N_FILES} text files")
-N_FILES_PER_WORKER = math.ceil(N_FILES / N_WORKERS)
-print(f"Will process {N_FILES_PER_WORKER} files per worker")
-
-file_batches = partition_list(txt_filepaths, N_WORKERS)
-output_directory_path = "/data/c-cye/assignment4-data/cc_filtered_paloma"
-
-# set up the submitit executor
-executor = submitit.AutoExecutor(folder="slurm_logs")
-executor.update_parameters(
-    slurm_array_parallelism=N_WORKERS,  
-    timeout_min = 30,           
-    mem_gb = 4,             
-    cpus_per_task = 1,
-    slurm_account="student",
-    slurm_partition="a4-cpu", 
-    slurm_qos="a4-cpu-qos",
-)
-
-# submit jobs   
-print(f"Submitting {len(file_batches)} batch jobs...")
-futures = []
-
-for batch_id, file_batch in enumerate(file_batches):
-    print(f"Submitting batch {batch_id} with {len(file_batch)} files")
-    future = executor.submit(
-        process_batch_of_txt_files,
-        file_batch,
-        output_directory_path,
-        batch_id
+INPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_filtered"
+OUTPUT_DIRECTORY = "/data/c-cye/assignment4-data/cc_filtered_paloma"
+
+
+@dataclass
+class PalomaConfig:
+    """classifier, threshold and outputs of the second filtering pass, defaults are the constants above"""
+    paloma_filter: str = PALOMA_FILTER
+    paloma_percentile: float = PALOMA_PERCENTILE
+    global_cutoff: bool = GLOBAL_CUTOFF
+    # confidence cutoff for non-paloma documents, set by run_second_filter after merging the sketches
+    paloma_cutoff: Optional[float] = None
+    sketch_k: int = SKETCH_K
+    chunk_docs: int = CHUNK_DOCS
+    output_compression: Optional[str] = OUTPUT_COMPRESSION
+    shard_max_bytes: Optional[int] = SHARD_MAX_BYTES
+    shard_max_docs: Optional[int] = SHARD_MAX_DOCS
+
+
+@functools.lru_cache(maxsize=None)
+def get_paloma_filter(classifier_id: str) -> QualityFilter:
+    """load the paloma classifier once per process"""
+    return QualityFilter(classifier_id=classifier_id)
+
+def scores_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.scores"
+
+def sketch_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.sketch.json"
+
+def list_first_pass_outputs(input_dir: str) -> list[str]:
+    """manifests of the finished first pass outputs in a directory"""
+    return sorted(glob.glob(os.path.join(input_dir, "*.shards.json")))
+
+def scores_current(output_path: str, config: PalomaConfig) -> bool:
+    """whether a file was scored, by the classifier of config"""
+    config = config or PalomaConfig()
+    path = sketch_path(output_path)
+    if not os.path.exists(path):
+        return False
+    return KLLSketch.load(path).meta == classifier_meta(config.paloma_filter)
+
+def paloma_settings(config: PalomaConfig) -> dict:
+    """the settings of config that change the output"""
+    return {
+        "classifier": classifier_meta(config.paloma_filter),
+        "paloma_percentile": config.paloma_percentile,
+        "global_cutoff": config.global_cutoff,
+        "paloma_cutoff": config.paloma_cutoff,
+        "output_compression": config.output_compression,
+        "shard_max_bytes": config.shard_max_bytes,
+        "shard_max_docs": config.shard_max_docs,
+    }
+
+def paloma_output_current(output_path: str, config: PalomaConfig) -> bool:
+    """whether an output is complete and was made with the settings of config"""
+    return shards_complete(output_path) and settings_current(output_path, paloma_settings(config))
+
+def global_paloma_cutoff(sketch_paths: list[str], percentile: float) -> float:
+    """corpus-wide confidence cutoff at percentile from the sketches of every file, 0.0 if the files
+    have no documents at all"""
+    sketch = merge_sketches(sketch_paths)
+    if sketch.n == 0:
+        print("No documents were scored, using a paloma cutoff of 0.0")
+        return 0.0
+    cutoff = sketch.percentile(percentile)
+    print(f"Global paloma cutoff at percentile {percentile} of {sketch.n} documents: {cutoff}")
+    return cutoff
+
+def iter_document_chunks(input_path: str, chunk_docs: int = CHUNK_DOCS) -> Iterator[list[str]]:
+    """stream the documents of a text file, compressed shard or shard manifest in lists of chunk_docs"""
+    docs = iter_documents(input_path)
+    while True:
+        chunk = list(itertools.islice(docs, chunk_docs))
+        if not chunk:
+            return
+        yield chunk
+
+def score_documents(docs: list[str], config: PalomaConfig) -> np.ndarray:
+    """paloma classifier predictions as a PALOMA_SCORE_DTYPE array"""
+    paloma_filter = get_paloma_filter(config.paloma_filter)
+
+    # fasttext predicts one line at a time, so strip newlines
+    labels, confs = paloma_filter.classifier.predict([doc.replace("\n", " ") for doc in docs])
+    scores = np.zeros(len(docs), dtype=PALOMA_SCORE_DTYPE)
+    scores["is_paloma"] = [label[0] == "__label__paloma" for label in labels]
+    scores["conf"] = [conf[0] for conf in confs]
+    return scores
+
+def score_single_txt_file(input_path: str, output_path: str, config: Optional[PalomaConfig] = None) -> str:
+    """Score every document of one file, saving the scores and a sketch of the confidences"""
+    config = config or PalomaConfig()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    sketch = KLLSketch(k=config.sketch_k)
+    sketch.meta = classifier_meta(config.paloma_filter)
+    writer = ScoreWriter(scores_path(output_path), PALOMA_SCORE_DTYPE, tag=str(os.getpid()))
+    for chunk in iter_document_chunks(input_path, config.chunk_docs):
+        scores = score_documents(chunk, config)
+        writer.write(scores)
+        sketch.update(scores["conf"])
+    writer.close()
+
+    # the sketch is written last and marks the file as scored
+    sketch.save(sketch_path(output_path))
+    return sketch_path(output_path)
+
+def process_single_txt_file(input_path: str, output_path: str, config: Optional[PalomaConfig] = None):
+    config = config or PalomaConfig()
+
+    # reuse the scores of the sketch pass, or score the file now
+    if not scores_current(output_path, config):
+        score_single_txt_file(input_path, output_path, config=config)
+    scores = load_scores(scores_path(output_path), PALOMA_SCORE_DTYPE)
+    return write_selected(input_path, output_path, select_documents(scores, config), config=config)
+
+def select_documents(scores: np.ndarray, config: Optional[PalomaConfig] = None) -> np.ndarray:
+    """mask of the documents to keep given their PALOMA_SCORE_DTYPE scores: all paloma and all non-paloma
+    with confs under the cutoff of config, or under the percentile of this file when it has none"""
+    config = config or PalomaConfig()
+    if config.paloma_cutoff is not None:
+        paloma_cutoff = config.paloma_cutoff
+    elif len(scores) > 0:
+        paloma_cutoff = np.percentile(scores["conf"], config.paloma_percentile)
+    else:
+        paloma_cutoff = 0.0
+    return scores["is_paloma"] | (scores["conf"] < paloma_cutoff)
+
+def write_selected(input_path: str, output_path: str, keep: np.ndarray, config: Optional[PalomaConfig] = None) -> str:
+    """Write the documents of input_path where keep is true, keep has one entry per input document"""
+    config = config or PalomaConfig()
+
+    # shards are renamed into place and the manifest is written last, so an existing output is always complete,
+    # and it is only current once the settings are saved
+    write_settings(output_path, None)
+    writer = ShardWriter(output_path, compression=config.output_compression, max_bytes=config.shard_max_bytes,
+                         max_docs=config.shard_max_docs, tag=str(os.getpid()))
+
+    # stream the documents again and write the survivors chunk by chunk
+    start = 0
+    for chunk in iter_document_chunks(input_path, config.chunk_docs):
+        if start + len(chunk) > len(keep):
+            raise RuntimeError(f"{input_path} has more than {len(keep)} documents")
+        for doc, keep_doc in zip(chunk, keep[start:start + len(chunk)]):
+            if keep_doc:
+                writer.write(doc)
+        start += len(chunk)
+    if start != len(keep):
+        raise RuntimeError(f"{input_path} has {start} documents, expected {len(keep)}")
+
+    manifest = writer.close()
+    write_settings(output_path, paloma_settings(config))
+    return manifest
+
+def process_txt_task(task: dict, speculative: bool = False, config: Optional[PalomaConfig] = None):
+    """Process a single txt file pulled from the task queue"""
+    config = config or PalomaConfig()
+    output_path = task["output_path"]
+
+    if task.get("stage") == "sketch":
+        if scores_current(output_path, config):
+            print(f"Skipping sketch of {task['input_path']} because it already exists")
+            return sketch_path(output_path)
+        return score_single_txt_file(task["input_path"], output_path, config=config)
+
+    # check if output file already exists
+    if paloma_output_current(output_path, config):
+        print(f"Skipping {task['input_path']} because it already exists")
+        return output_path
+
+    return process_single_txt_file(task["input_path"], output_path, config=config)
+
+def process_txt_queue(queue_path: str, worker_id: int, config: Optional[PalomaConfig] = None):
+    """Pull txt files from the task queue until it is drained"""
+    print(f"Starting worker {worker_id}")
+    results = run_queue_worker(queue_path, functools.partial(process_txt_task, config=config))
+    print(f"Worker {worker_id} completed with {len(results)} successful files")
+    return results
+
+def run_second_filter(txt_filepaths: list[str], output_directory: str = OUTPUT_DIRECTORY,
+                      config: Optional[PalomaConfig] = None, backend: str = "submitit",
+                      n_workers: int = N_WORKERS, **slurm_params) -> list:
+    """
+    Filter the outputs of the first pass with the Paloma classifier
+
+    Args:
+        txt_filepaths: text files, shards or shard manifests written by the first pass
+        output_directory: directory for the filtered shards and the task queue
+        config: classifier, threshold and outputs, defaults to PalomaConfig()
+        backend: "submitit", "local" or "inprocess", see cs336_data.executors
+        n_workers: number of workers pulling from the task queue
+        slurm_params: overrides of the SLURM parameters
+
+    Returns:
+        output paths of the files processed by each worker
+    """
+    config = config or PalomaConfig()
+    print(f"Found {len(txt_filepaths)} text files")
+    os.makedirs(output_directory, exist_ok=True)
+
+    queue_path = os.path.join(output_directory, "tasks.sqlite")
+    output_paths = []
+    for txt_filepath in txt_filepaths:
+        txt_filename = str(pathlib.Path(txt_filepath).name).split('.')[0]
+        output_paths.append(os.path.join(output_directory, f"{txt_filename}_paloma.txt"))
+
+    def run_stage(stage: str, config: PalomaConfig, is_complete, **extra) -> list:
+        # fill the task queue, workers pull files from it until it is drained, done tasks whose output
+        # was deleted are queued again
+        tasks = [{"stage": stage, "input_path": txt_filepath, "output_path": output_path, **extra}
+                 for txt_filepath, output_path in zip(txt_filepaths, output_paths)]
+        queue = SQLiteTaskQueue(queue_path)
+        added = queue.add_tasks(tasks, is_complete=lambda task: is_complete(task["output_path"], config))
+        print(f"Added {added} new {stage} tasks to {queue_path}: {queue.counts()}")
+        queue.close()
+
+        executor = get_executor(backend, n_workers, **slurm_params)
+        print(f"Submitting {n_workers} {backend} workers...")
+        jobs = [(queue_path, worker_id, config) for worker_id in range(n_workers)]
+        return run_jobs(executor, process_txt_queue, jobs, desc=f"{stage} workers")
+
+    if config.global_cutoff and config.paloma_cutoff is None and txt_filepaths:
+        # score every file once and merge the per-file sketches into a corpus-wide cutoff,
+        # tasks name the classifier so that a new classifier queues them again
+        run_stage("sketch", config, scores_current, classifier=classifier_meta(config.paloma_filter))
+        sketch_paths = [sketch_path(output_path) for output_path in output_paths]
+        missing = [sketch_path(output_path) for output_path in output_paths if not scores_current(output_path, config)]
+        if missing:
+            raise RuntimeError(f"{len(missing)} files failed to score, e.g. {missing[0]}")
+        config = replace(config, paloma_cutoff=global_paloma_cutoff(sketch_paths, config.paloma_percentile))
+
+    # tasks hold the settings, so a new cutoff queues every file again
+    return run_stage("filter", config, paloma_output_current, settings=paloma_settings(config))
+
+def main():
+    parser = argparse.ArgumentParser(description="Second filtering pass with the Paloma classifier")
+    parser.add_argument("--input-dir", default=INPUT_DIRECTORY, help="directory of the first pass outputs")
+    parser.add_argument("--file-list", default=None, help="json list of first pass outputs, instead of every output in --input-dir")
+    parser.add_argument("--output-dir", default=OUTPUT_DIRECTORY, help="directory for the filtered shards")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N files")
+    parser.add_argument("--backend", choices=BACKENDS, default="submitit", help="where to run workers (default: submitit)")
+    parser.add_argument("--n-workers", type=int, default=N_WORKERS, help=f"number of workers (default: {N_WORKERS})")
+    parser.add_argument("--paloma-filter", default=PALOMA_FILTER, help="path of the paloma classifier")
+    parser.add_argument("--paloma-percentile", type=float, default=PALOMA_PERCENTILE)
+    parser.add_argument("--per-file-cutoff", action="store_true", help="compute the percentile within each file")
+    parser.add_argument("--paloma-cutoff", type=float, default=None, help="fixed confidence cutoff, skips the sketch pass")
+    parser.add_argument("--chunk-docs", type=int, default=CHUNK_DOCS, help="documents classified at once")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default=OUTPUT_COMPRESSION or "none")
+    args = parser.parse_args()
+
+    if args.file_list:
+        with open(args.file_list, "r") as f:
+            txt_filepaths = json.load(f)
+    else:
+        txt_filepaths = list_first_pass_outputs(args.input_dir)
+    if args.limit is not None:
+        txt_filepaths = txt_filepaths[:args.limit]
+
+    config = PalomaConfig(
+        paloma_filter=args.paloma_filter,
+        paloma_percentile=args.paloma_percentile,
+        global_cutoff=not args.per_file_cutoff,
+        paloma_cutoff=args.paloma_cutoff,
+        chunk_docs=args.chunk_docs,
+        output_compression=None if args.compression == "none" else args.compression,
     )
-    futures.append(future)
-
-# monitor progress
-print("Monitoring job progress...")
-completed_batches = 0
-for future in tqdm(submitit.helpers.as_completed(futures), total=len(file_batches)):
-    try:
-        result = future.result()
-        completed_batches += 1
-        print(f"Batch completed ({completed_batches}/{len(file_batches)}). Processed {len(result)} files successfully.")
-    except Exception as e:
-        print(f"Batch failed with error: {str(e)}")
-
-print(f"All jobs completed! {completed_batches}/{len(file_batches)} batches finished successfully.")
\ No newline at end of file
+    print(f"Config: {asdict(config)}")
+    run_second_filter(txt_filepaths, args.output_dir, config=config, backend=args.backend, n_workers=args.n_workers)
+
+
+if __name__ == "__main__":
+    main()
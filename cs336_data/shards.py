@@ -0,0 +1,327 @@
+"""
+Buffered, optionally compressed and size-sharded storage for filtered text.
+
+Documents are written in the same format as before (each one followed by
+`<|endoftext|>` and a newline), but through a large in-memory buffer and an
+optional streaming gzip or zstd compressor. Output rolls over to a new shard once a
+byte or document budget is reached. Each shard gets an index of the uncompressed
+byte offsets of its documents (`<shard>.idx`, int64, one entry per document plus
+the end offset), and a manifest listing all shards (`<name>.shards.json`) is written
+last, so its existence marks the output as complete. Pipelines save the settings an
+output was made with (`<name>.settings.json`, e.g. thresholds and classifiers) after
+it is complete, and redo outputs whose settings differ.
+
+Shards are written to temporary files and renamed into place when finished. The
+writer can report its committed state at any point, which is used together with
+`RecordCheckpoint` to resume a killed task: compressed streams are ended at every
+checkpoint (gzip members and zstd frames can be concatenated), so a resumed writer
+simply truncates the temporary shard to the committed offset and starts a new one.
+"""
+
+import codecs
+import gzip
+import io
+import json
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+
+from cs336_data.checkpoint import atomic_write_json
+from cs336_data.docstore import DocStore
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+EOT = "<|endoftext|>"
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def output_stem(path: str) -> str:
+    """strip the .txt and compression suffixes, the .docs suffix or the .shards.json suffix from a shard,
+    store, manifest or output path"""
+    path = path.rstrip("/")
+    for suffix in [".shards.json", ".docs", ".gz", ".zst", ".txt"]:
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+    return path
+
+
+def manifest_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.shards.json"
+
+
+def shards_complete(output_path: str) -> bool:
+    """check whether a sharded output was fully written"""
+    return os.path.exists(manifest_path(output_path))
+
+
+def settings_path(output_path: str) -> str:
+    return f"{output_stem(output_path)}.settings.json"
+
+
+def write_settings(output_path: str, settings: Optional[dict]) -> None:
+    """save the settings a finished output was made with, or remove them before it is rewritten"""
+    path = settings_path(output_path)
+    if settings is not None:
+        atomic_write_json(settings, path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def settings_current(output_path: str, settings: dict) -> bool:
+    """whether an output was made with settings"""
+    path = settings_path(output_path)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        # compare as json, e.g. tuples are saved as lists
+        return json.load(f) == json.loads(json.dumps(settings))
+
+
+class ShardWriter():
+    def __init__(self, output_path: str, compression: Optional[str] = None,
+                 max_bytes: Optional[int] = None, max_docs: Optional[int] = None,
+                 buffer_size: int = BUFFER_SIZE, level: Optional[int] = None,
+                 tag: str = "", resume_state: Optional[dict] = None):
+        """
+        write documents to one or more shards
+
+        Args:
+            output_path: logical output path, e.g. `cc_filtered/X.txt`. Without a budget the
+                single shard is `X.txt` (plus compression suffix), otherwise `X_00000.txt`, ...
+            compression: None, "gzip" or "zstd"
+            max_bytes: roll over to a new shard after this many uncompressed bytes
+            max_docs: roll over to a new shard after this many documents
+            buffer_size: number of bytes buffered in memory before writing
+            level: compression level, defaults to the compressor's default
+            tag: name for the temporary files, so concurrent copies of a task don't collide
+            resume_state: state returned by checkpoint() of a previous writer
+        """
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is required for zstd compression")
+
+        self.output_path = output_path
+        self.stem = output_stem(output_path)
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.buffer_size = buffer_size
+        self.level = level
+        self.suffix = f".{tag}" if tag else ""
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+        # completed shards and position in the current one
+        state = resume_state or {"shard": 0, "offset": 0, "uncompressed": 0, "docs": 0, "shards": []}
+        self.shards = list(state["shards"])
+        self.shard_idx = state["shard"]
+        self._open_shard(state["offset"], state["uncompressed"], state["docs"])
+
+    def shard_path(self, shard_idx: int) -> str:
+        ext = f".txt{COMPRESSION_SUFFIXES[self.compression]}"
+        if self.max_bytes is None and self.max_docs is None:
+            return f"{self.stem}{ext}"
+        return f"{self.stem}_{shard_idx:05d}{ext}"
+
+    def _open_shard(self, offset: int = 0, uncompressed: int = 0, docs: int = 0):
+        path = self.shard_path(self.shard_idx)
+        self._tmp_path = f"{path}{self.suffix}.tmp"
+        self._idx_tmp_path = f"{path}.idx{self.suffix}.tmp"
+
+        if offset > 0 or docs > 0:
+            # the shard may have been finished after the last checkpoint, reopen it
+            if not os.path.exists(self._tmp_path):
+                os.replace(path, self._tmp_path)
+                os.replace(f"{path}.idx", self._idx_tmp_path)
+
+            # drop anything written after the last checkpoint
+            self._raw = open(self._tmp_path, "r+b")
+            self._raw.truncate(offset)
+            self._raw.seek(offset)
+            self._idx = open(self._idx_tmp_path, "r+b")
+            self._idx.truncate(docs * 8)
+            self._idx.seek(docs * 8)
+        else:
+            self._raw = open(self._tmp_path, "wb")
+            self._idx = open(self._idx_tmp_path, "wb")
+
+        self._uncompressed = uncompressed
+        self._docs = docs
+        self._buffer = []
+        self._buffered = 0
+        self._offsets = []
+        self._open_stream()
+
+    def _open_stream(self):
+        if self.compression == "gzip":
+            level = 6 if self.level is None else self.level
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=level, mtime=0)
+        elif self.compression == "zstd":
+            level = 3 if self.level is None else self.level
+            self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+
+    def _flush_buffer(self):
+        if self._buffer:
+            self._stream.write(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        if self._offsets:
+            self._idx.write(np.array(self._offsets, dtype=np.int64).tobytes())
+            self._offsets = []
+
+    def _end_stream(self):
+        """write out the buffer and end the current gzip member / zstd frame"""
+        self._flush_buffer()
+        if self.compression == "gzip":
+            # closing a GzipFile writes the trailer but leaves the underlying file open
+            self._stream.close()
+        elif self.compression == "zstd":
+            self._stream.flush(zstandard.FLUSH_FRAME)
+        for f in [self._raw, self._idx]:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write(self, text: str) -> None:
+        """append a document"""
+        data = f"{text}{EOT}\n".encode("utf-8")
+        self._offsets.append(self._uncompressed)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._uncompressed += len(data)
+        self._docs += 1
+
+        if self._buffered >= self.buffer_size:
+            self._flush_buffer()
+
+        if (self.max_bytes is not None and self._uncompressed >= self.max_bytes) or \
+           (self.max_docs is not None and self._docs >= self.max_docs):
+            self._finish_shard()
+            self.shard_idx += 1
+            self._open_shard()
+
+    def _finish_shard(self):
+        self._end_stream()
+        self._idx.write(np.array([self._uncompressed], dtype=np.int64).tobytes())
+        self._idx.close()
+        compressed = self._raw.tell()
+        self._raw.close()
+
+        path = self.shard_path(self.shard_idx)
+        os.replace(self._idx_tmp_path, f"{path}.idx")
+        os.replace(self._tmp_path, path)
+        self.shards.append({
+            "path": os.path.basename(path),
+            "docs": self._docs,
+            "bytes": self._uncompressed,
+            "compressed_bytes": compressed,
+        })
+
+    def checkpoint(self) -> dict:
+        """make everything written so far durable and return the state needed to resume"""
+        self._end_stream()
+        state = {
+            "shard": self.shard_idx,
+            "offset": self._raw.tell(),
+            "uncompressed": self._uncompressed,
+            "docs": self._docs,
+            "shards": list(self.shards),
+        }
+        self._open_stream()
+        return state
+
+    def close(self) -> str:
+        """finish the last shard and write the manifest, returns the manifest path"""
+        if self._docs > 0 or not self.shards:
+            self._finish_shard()
+        else:
+            # budget was hit exactly on the last document, drop the empty shard
+            self._end_stream()
+            self._raw.close()
+            self._idx.close()
+            os.remove(self._tmp_path)
+            os.remove(self._idx_tmp_path)
+
+        manifest = {
+            "compression": self.compression,
+            "docs": sum(shard["docs"] for shard in self.shards),
+            "bytes": sum(shard["bytes"] for shard in self.shards),
+            "compressed_bytes": sum(shard["compressed_bytes"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        path = manifest_path(self.output_path)
+        atomic_write_json(manifest, path)
+        return path
+
+
+def open_shard(path: str) -> io.IOBase:
+    """open a plain, gzip or zstd compressed shard for binary reading"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is required to read .zst shards")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+def is_docstore(path: str) -> bool:
+    return path.rstrip("/").endswith(".docs")
+
+
+def list_shards(path: str) -> list[str]:
+    """expand a manifest into its shard paths, an output path (`X.txt`) that was written as shards is
+    resolved to its manifest, any other path is returned as is"""
+    if not path.endswith(".shards.json"):
+        if os.path.exists(path) or not shards_complete(path):
+            return [path]
+        path = manifest_path(path)
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(path)
+    return [os.path.join(directory, shard["path"]) for shard in manifest["shards"]]
+
+
+def load_index(shard_path: str) -> np.ndarray:
+    """uncompressed start offsets of each document in a shard, plus the end offset"""
+    return np.fromfile(f"{shard_path}.idx", dtype=np.int64)
+
+
+def iter_documents(path: str, chunk_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    stream the stripped, non-empty documents of a shard, manifest, plain text file or `.docs` store
+
+    Reads `chunk_size` bytes at a time, so memory does not depend on the file size.
+    """
+    if is_docstore(path):
+        for doc in DocStore(path):
+            doc = doc.strip()
+            if doc:
+                yield doc
+        return
+
+    for shard_path in list_shards(path):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        tail = ""
+        with open_shard(shard_path) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                tail += decoder.decode(chunk, final=not chunk)
+                docs = tail.split(EOT)
+                tail = docs.pop()
+                for doc in docs:
+                    doc = doc.strip()
+                    if doc:
+                        yield doc
+                if not chunk:
+                    break
+        tail = tail.strip()
+        if tail:
+            yield tail
@@ -0,0 +1,176 @@
+"""
+Combine, rebalance, shuffle and split fastText training files in bounded memory.
+
+The converter writes each class to its own file in crawl order (e.g. positive_data_cleaner.txt
+and negative_data.txt). This reads them three times and never holds more than one bucket:
+
+1. count the lines of every label (the first token of a line, e.g. __label__high-quality)
+2. keep exactly min(count, max_ratio * smallest count) lines of each label and put exactly
+   valid_fraction of them in the validation split, choosing lines with selection sampling
+   (Knuth's Algorithm S), and write each kept line to a bucket file of its split picked at random
+3. read the buckets one at a time, shuffle each in memory and append it to the split
+
+Since every line lands in a uniformly random bucket and every bucket is shuffled, the
+concatenation is a uniformly random order. Buckets hold about BUCKET_BYTES each.
+
+    python -m cs336_data.shuffle positive_data_cleaner.txt negative_data.txt --train quality.train --valid quality.valid
+"""
+
+import argparse
+import math
+import os
+import random
+import shutil
+import tempfile
+from collections import Counter
+from typing import Iterator, Optional
+
+# bytes of training data per bucket, the memory needed to shuffle one
+BUCKET_BYTES = 256 * 1024 * 1024
+VALID_FRACTION = 0.1
+# kept lines of a label are at most this many times the lines of the smallest label, None keeps everything
+MAX_RATIO = 1.0
+
+
+def extract_label(line: str) -> str:
+    """first label of a fastText line"""
+    return line.split(maxsplit=1)[0]
+
+
+def iter_examples(input_paths: list[str]) -> Iterator[str]:
+    """non-empty lines of every file, in order, without the newline"""
+    for input_path in input_paths:
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def target_counts(counts: Counter, max_ratio: Optional[float]) -> dict:
+    """lines kept of every label when down-sampling to max_ratio times the smallest label"""
+    if max_ratio is None:
+        return dict(counts)
+    limit = math.floor(max_ratio * min(counts.values()))
+    return {label: min(count, limit) for label, count in counts.items()}
+
+
+def _select(rng: random.Random, needed: int, remaining: int) -> bool:
+    """Algorithm S: keep the current item with probability needed / remaining, exact count overall"""
+    return rng.random() * remaining < needed
+
+
+def _shuffle_buckets(bucket_paths: list[str], output_path: str, rng: random.Random) -> None:
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        for bucket_path in bucket_paths:
+            with open(bucket_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+            rng.shuffle(lines)
+            out.writelines(lines)
+            os.remove(bucket_path)
+    os.replace(tmp_path, output_path)
+
+
+def shuffle_and_split(input_paths: list[str], output_train: str, output_valid: str,
+                      valid_fraction: float = VALID_FRACTION, max_ratio: Optional[float] = MAX_RATIO,
+                      bucket_bytes: int = BUCKET_BYTES, random_seed: Optional[int] = 42) -> dict:
+    """
+    Combine fastText files, down-sample labels, shuffle and split into train and validation files
+
+    Args:
+        input_paths: fastText files, any number of labels each
+        output_train: training split, written once it is complete
+        output_valid: validation split, written once it is complete
+        valid_fraction: fraction of the kept lines of every label that go to the validation split
+        max_ratio: keep at most max_ratio times the lines of the smallest label of every label
+            (1.0 balances the labels), None to keep every line
+        bucket_bytes: approximate size of a bucket, which bounds memory
+        random_seed: seed of the sampling and shuffling
+
+    Returns:
+        stats: lines of every label in the inputs, kept, and in each split
+    """
+    rng = random.Random(random_seed)
+
+    # first pass: lines of every label
+    counts = Counter(extract_label(line) for line in iter_examples(input_paths))
+    if not counts:
+        raise ValueError(f"No examples in {input_paths}")
+    kept = target_counts(counts, max_ratio)
+    valid = {label: n - int(n * (1 - valid_fraction)) for label, n in kept.items()}
+    print(f"Label distribution: {dict(counts)}")
+    print(f"Keeping {kept}, {valid} of them for validation")
+
+    # kept lines of each split, estimated from the share of lines kept, sets the number of buckets
+    input_bytes = sum(os.path.getsize(path) for path in input_paths)
+    kept_fraction = sum(kept.values()) / sum(counts.values())
+    split_bytes = {"train": input_bytes * kept_fraction * (1 - valid_fraction), "valid": input_bytes * kept_fraction * valid_fraction}
+    n_buckets = {split: max(1, math.ceil(size / bucket_bytes)) for split, size in split_bytes.items()}
+
+    bucket_dir = tempfile.mkdtemp(prefix="shuffle-", dir=os.path.dirname(os.path.abspath(output_train)))
+    try:
+        buckets = {split: [os.path.join(bucket_dir, f"{split}_{i:05d}.txt") for i in range(n)] for split, n in n_buckets.items()}
+        files = {split: [open(path, "w", encoding="utf-8") for path in paths] for split, paths in buckets.items()}
+
+        # second pass: down-sample and split with exact counts, scatter lines to random buckets
+        remaining = dict(counts)
+        to_keep = dict(kept)
+        to_valid = dict(valid)
+        split_counts = {"train": Counter(), "valid": Counter()}
+        for line in iter_examples(input_paths):
+            label = extract_label(line)
+            keep = _select(rng, to_keep[label], remaining[label])
+            remaining[label] -= 1
+            if not keep:
+                continue
+            split = "valid" if _select(rng, to_valid[label], to_keep[label]) else "train"
+            to_keep[label] -= 1
+            if split == "valid":
+                to_valid[label] -= 1
+            split_counts[split][label] += 1
+            files[split][rng.randrange(n_buckets[split])].write(line + "\n")
+        for split_files in files.values():
+            for f in split_files:
+                f.close()
+
+        # third pass: shuffle one bucket at a time
+        _shuffle_buckets(buckets["train"], output_train, rng)
+        _shuffle_buckets(buckets["valid"], output_valid, rng)
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    stats = {
+        "input": dict(counts),
+        "kept": kept,
+        "train": dict(split_counts["train"]),
+        "valid": dict(split_counts["valid"]),
+        "buckets": n_buckets,
+    }
+    print(f"Wrote {sum(stats['train'].values())} lines to {output_train} and {sum(stats['valid'].values())} to {output_valid}")
+    print(f"train distribution: {stats['train']}, valid distribution: {stats['valid']}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Combine, rebalance, shuffle and split fastText training files")
+    parser.add_argument("inputs", nargs="+", help="fastText files, e.g. the positive and negative examples")
+    parser.add_argument("--train", required=True, help="output training file")
+    parser.add_argument("--valid", required=True, help="output validation file")
+    parser.add_argument("--valid-fraction", type=float, default=VALID_FRACTION,
+                        help=f"fraction of every label kept for validation (default: {VALID_FRACTION})")
+    parser.add_argument("--max-ratio", type=float, default=MAX_RATIO,
+                        help=f"keep at most this many times the smallest label of every label (default: {MAX_RATIO})")
+    parser.add_argument("--no-balance", action="store_true", help="keep every line")
+    parser.add_argument("--bucket-mb", type=int, default=BUCKET_BYTES // (1024 * 1024),
+                        help="size of the buckets shuffled in memory (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default: 42)")
+    args = parser.parse_args()
+
+    shuffle_and_split(args.inputs, args.train, args.valid, valid_fraction=args.valid_fraction,
+                      max_ratio=None if args.no_balance else args.max_ratio,
+                      bucket_bytes=args.bucket_mb * 1024 * 1024, random_seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Mergeable streaming quantile sketch (KLL, Karnin, Lang and Liberty 2016).
+
+A sketch summarizes a stream of values in O(k log(n / k)) memory and answers
+quantile queries with a rank error of roughly 1.7 / k. Sketches built on
+different files can be merged, so a corpus-wide percentile can be computed from
+per-file sketches without ever holding all the values in one place.
+"""
+
+import json
+from typing import Optional
+
+import numpy as np
+
+from cs336_data.checkpoint import atomic_write_json
+
+SKETCH_K = 2000
+
+
+class KLLSketch():
+    def __init__(self, k: int = SKETCH_K, c: float = 2 / 3, seed: Optional[int] = None):
+        """
+        Args:
+            k: size of the top compactor, controls accuracy and memory
+            c: capacity ratio between consecutive compactors
+            seed: seed for the random compaction offsets
+        """
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.compactors = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+        # saved with the sketch, e.g. what produced the values
+        self.meta = {}
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(int(np.ceil(self.k * self.c ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            compactor = self.compactors[level]
+            if len(compactor) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                # keep every other item of the sorted compactor, with double the weight, one level up
+                compactor = np.sort(compactor)
+                odd = len(compactor) % 2
+                promoted = compactor[odd:][self.rng.integers(2)::2]
+                self.compactors[level] = compactor[:odd]
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted])
+            level += 1
+
+    def update(self, values) -> None:
+        """add a single value or an array of values"""
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """add all values summarized by another sketch to this one"""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], compactor])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> float:
+        """approximate value at quantile q in [0, 1]"""
+        if self.n == 0:
+            raise ValueError("quantile of an empty sketch")
+        values = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(compactor), 2 ** level, dtype=np.float64)
+                                  for level, compactor in enumerate(self.compactors)])
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return float(values[order][min(idx, len(values) - 1)])
+
+    def percentile(self, p: float) -> float:
+        """approximate value at percentile p in [0, 100], like np.percentile"""
+        return self.quantile(p / 100)
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "c": self.c, "n": self.n, "meta": self.meta,
+                "compactors": [compactor.tolist() for compactor in self.compactors]}
+
+    @classmethod
+    def from_dict(cls, state: dict, seed: Optional[int] = None) -> "KLLSketch":
+        sketch = cls(k=state["k"], c=state["c"], seed=seed)
+        sketch.n = state["n"]
+        sketch.meta = state.get("meta", {})
+        sketch.compactors = [np.array(compactor, dtype=np.float64) for compactor in state["compactors"]]
+        return sketch
+
+    def save(self, path: str) -> None:
+        atomic_write_json(self.to_dict(), path)
+
+    @classmethod
+    def load(cls, path: str, seed: Optional[int] = None) -> "KLLSketch":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f), seed=seed)
+
+
+def merge_sketches(paths: list[str], seed: int = 0) -> KLLSketch:
+    """load and merge the sketches saved at paths, with a fixed seed so the same sketches always give
+    the same quantiles (e.g. a cutoff saved with the outputs it made)"""
+    if not paths:
+        raise ValueError("no sketches to merge")
+    sketches = [KLLSketch.load(path, seed=seed) for path in paths]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
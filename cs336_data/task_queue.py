@@ -0,0 +1,233 @@
+"""
+Lease-based task queue for dynamically assigning files to workers.
+
+Instead of splitting the file list into fixed chunks up front, every worker pulls
+one task at a time from a shared queue. A pulled task is leased to the worker for a
+limited time and the lease is renewed by a heartbeat while the worker is alive, so
+tasks of workers that die (e.g. hit the SLURM time limit) are handed out again once
+their lease expires, up to MAX_ATTEMPTS times: a task that keeps killing or hanging its
+workers is marked failed instead of taking down every worker that picks it up. Failed
+tasks are retried when the queue is filled again by a new run, and so are done tasks
+whose output fails a check passed by the run (e.g. it was deleted). Payloads hold the
+settings that change the output, so a run with new settings adds new tasks. When
+nothing is left to hand out, idle workers speculatively re-run tasks that are still in
+progress; whichever copy finishes first completes it.
+
+The queue is stored in a SQLite database, which is enough for local runs and small
+array jobs on a shared filesystem.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+
+class Task(NamedTuple):
+    task_id: int
+    payload: dict
+    speculative: bool
+
+
+class SQLiteTaskQueue():
+    def __init__(self, db_path: str, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, speculative: bool = True):
+        """
+        open (and create if needed) a task queue
+
+        Args:
+            db_path: path of the SQLite database shared by all workers
+            lease_seconds: how long a task stays assigned without a heartbeat
+            max_attempts: number of failed attempts before a task is given up on
+            speculative: whether idle workers re-run tasks that are still leased
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.speculative = speculative
+        self.conn = self._connect()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                payload TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                leased_at REAL,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                speculative_runs INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=120, isolation_level=None)
+
+    def add_tasks(self, payloads: list[dict], is_complete: Optional[Callable[[dict], bool]] = None) -> int:
+        """add tasks to the queue, skipping ones that are already present, and make failed ones pending
+        again with fresh attempts, as well as done ones whose payload fails is_complete (e.g. the output
+        was deleted), returns the number of tasks added or reset"""
+        rows = [(json.dumps(payload, sort_keys=True),) for payload in payloads]
+        # check the outputs before locking the queue, it can take a while on a shared filesystem
+        redo = []
+        if is_complete is not None:
+            done = {row[0] for row in self.conn.execute("SELECT payload FROM tasks WHERE status = 'done'")}
+            redo = [row for row, payload in zip(rows, payloads) if row[0] in done and not is_complete(payload)]
+        self.conn.execute("BEGIN IMMEDIATE")
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO tasks (payload) VALUES (?)", rows)
+        self.conn.executemany(
+            """UPDATE tasks SET status = 'pending', worker = NULL, leased_at = NULL, lease_expires = NULL,
+               attempts = 0, speculative_runs = 0 WHERE payload = ? AND status = 'failed'""", rows)
+        self.conn.executemany(
+            """UPDATE tasks SET status = 'pending', worker = NULL, leased_at = NULL, lease_expires = NULL,
+               attempts = 0, speculative_runs = 0 WHERE payload = ? AND status = 'done'""", redo)
+        self.conn.execute("COMMIT")
+        return self.conn.total_changes - before
+
+    def acquire(self, worker_id: str) -> Optional[Task]:
+        """lease the next pending or expired task, or a running task to run speculatively"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # expired leases out of attempts most likely crashed or hung their workers, give up on them
+            self.conn.execute(
+                """UPDATE tasks SET status = 'failed', worker = NULL, lease_expires = NULL
+                   WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""", (now, self.max_attempts))
+            row = self.conn.execute(
+                """SELECT id, payload FROM tasks
+                   WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ? AND attempts < ?)
+                   ORDER BY id LIMIT 1""", (now, self.max_attempts)).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    """UPDATE tasks SET status = 'leased', worker = ?, leased_at = ?, lease_expires = ?,
+                       attempts = attempts + 1 WHERE id = ?""",
+                    (worker_id, now, now + self.lease_seconds, row[0]))
+                self.conn.execute("COMMIT")
+                return Task(row[0], json.loads(row[1]), False)
+
+            if self.speculative:
+                # queue is drained, help with the longest running task that has no backup copy yet
+                row = self.conn.execute(
+                    """SELECT id, payload FROM tasks
+                       WHERE status = 'leased' AND worker != ? AND speculative_runs = 0
+                       ORDER BY leased_at LIMIT 1""", (worker_id,)).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE tasks SET speculative_runs = speculative_runs + 1 WHERE id = ?", (row[0],))
+                    self.conn.execute("COMMIT")
+                    return Task(row[0], json.loads(row[1]), True)
+
+            self.conn.execute("COMMIT")
+            return None
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def renew(self, task: Task, worker_id: str) -> None:
+        """extend the lease of a task held by this worker"""
+        self.conn.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                          (time.time() + self.lease_seconds, task.task_id, worker_id))
+
+    def complete(self, task: Task) -> bool:
+        """mark a task done, returns False if another copy already finished it"""
+        cursor = self.conn.execute("UPDATE tasks SET status = 'done' WHERE id = ? AND status != 'done'",
+                                   (task.task_id,))
+        return cursor.rowcount > 0
+
+    def fail(self, task: Task, worker_id: str) -> None:
+        """release a task after an error so it can be retried, up to max_attempts"""
+        if task.speculative:
+            # the original lease holder is still responsible for the task
+            return
+        self.conn.execute(
+            """UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+               worker = NULL, lease_expires = NULL
+               WHERE id = ? AND worker = ? AND status = 'leased'""",
+            (self.max_attempts, task.task_id, worker_id))
+
+    def counts(self) -> dict:
+        """number of tasks in each status"""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class _Heartbeat(threading.Thread):
+    """renews the lease of the current task in the background while it is processed"""
+
+    def __init__(self, queue: SQLiteTaskQueue, task: Task, worker_id: str):
+        super().__init__(daemon=True)
+        self.db_path = queue.db_path
+        self.lease_seconds = queue.lease_seconds
+        self.task = task
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        # sqlite connections can't be shared across threads, so open a separate one
+        queue = SQLiteTaskQueue(self.db_path, lease_seconds=self.lease_seconds)
+        while not self.stopped.wait(self.lease_seconds / 3):
+            queue.renew(self.task, self.worker_id)
+        queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def default_worker_id() -> str:
+    job_id = os.environ.get("SLURM_ARRAY_JOB_ID", os.environ.get("SLURM_JOB_ID", "local"))
+    task_id = os.environ.get("SLURM_ARRAY_TASK_ID", "0")
+    return f"{socket.gethostname()}-{job_id}_{task_id}-{os.getpid()}"
+
+
+def run_queue_worker(db_path: str, process_fn: Callable[[dict, bool], object],
+                     worker_id: Optional[str] = None, **queue_kwargs) -> list:
+    """
+    pull tasks from the queue until it is drained
+
+    Args:
+        db_path: path of the queue database
+        process_fn: called as process_fn(payload, speculative) for each task
+        worker_id: unique name of this worker, defaults to host/job/pid
+        queue_kwargs: passed on to SQLiteTaskQueue
+
+    Returns:
+        results of process_fn for the tasks this worker completed first
+    """
+    worker_id = worker_id or default_worker_id()
+    queue = SQLiteTaskQueue(db_path, **queue_kwargs)
+    results = []
+
+    while True:
+        task = queue.acquire(worker_id)
+        if task is None:
+            break
+
+        print(f"Worker {worker_id}: starting task {task.task_id}{' (speculative)' if task.speculative else ''}")
+        heartbeat = _Heartbeat(queue, task, worker_id)
+        heartbeat.start()
+        try:
+            result = process_fn(task.payload, task.speculative)
+        except Exception as e:
+            print(f"Worker {worker_id}: error in task {task.task_id}: {e}")
+            queue.fail(task, worker_id)
+            continue
+        finally:
+            heartbeat.stop()
+
+        if queue.complete(task):
+            results.append(result)
+        else:
+            print(f"Worker {worker_id}: task {task.task_id} was already completed by another worker")
+
+    print(f"Worker {worker_id}: queue drained, completed {len(results)} tasks. Queue status: {queue.counts()}")
+    queue.close()
+    return results
@@ -0,0 +1,127 @@
+"""
+Content-addressed cache of token ids, so re-tokenizing a corpus that only partly
+changed only encodes the new documents.
+
+Documents are keyed by a 128 bit blake2b hash of their text. The cache is a directory
+of segments, one per tokenized file: `<name>.ids` holds the uint16 ids of the
+documents it added back to back, and `<name>.index` one CACHE_DTYPE record per
+document (hash, offset and length in the ids file). Segments are only appended,
+renamed into place when finished, and memory-mapped when read, so workers can add
+segments concurrently and a lookup only reads the ids it returns. `meta.json`
+records the tokenizer, so a cache is never reused with a different one.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from cs336_data.checkpoint import atomic_write_json
+
+CACHE_DTYPE = np.dtype([("key", "<u8"), ("check", "<u8"), ("offset", "<i8"), ("length", "<i8")])
+
+
+def document_hash(text: str) -> tuple[int, int]:
+    """(key, check) halves of the 128 bit hash of a document"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+class TokenCacheSegment():
+    def __init__(self, cache_dir: str, name: str):
+        """ids of new documents, committed to the cache on close"""
+        self.ids_path = os.path.join(cache_dir, f"{name}.ids")
+        self.index_path = os.path.join(cache_dir, f"{name}.index")
+        self._ids = open(f"{self.ids_path}.tmp", "wb")
+        self._index = []
+        self.offset = 0
+
+    def add(self, key: int, check: int, ids: np.ndarray) -> None:
+        self._ids.write(ids.astype(np.uint16).tobytes())
+        self._index.append((key, check, self.offset, len(ids)))
+        self.offset += len(ids)
+
+    def close(self) -> Optional[str]:
+        """rename the segment into place, the index last, returns its path or None if it is empty"""
+        self._ids.close()
+        if not self._index:
+            os.remove(f"{self.ids_path}.tmp")
+            return None
+        os.replace(f"{self.ids_path}.tmp", self.ids_path)
+        np.array(self._index, dtype=CACHE_DTYPE).tofile(f"{self.index_path}.tmp")
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        return self.index_path
+
+
+class TokenCache():
+    def __init__(self, cache_dir: str, tokenizer_name: str):
+        """
+        open or create a cache
+
+        Args:
+            cache_dir: directory of the cache segments
+            tokenizer_name: name of the tokenizer the ids come from, checked against the cache
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta["tokenizer"] != tokenizer_name:
+                raise ValueError(f"Cache {cache_dir} was built with {meta['tokenizer']}, not {tokenizer_name}")
+        else:
+            atomic_write_json({"tokenizer": tokenizer_name}, meta_path)
+
+        # sorted runs of (index, segment of each entry): the segments found on load, then one per segment added since
+        self.segments = []
+        self.runs = []
+        self.load()
+
+    def _read_segment(self, index_path: str) -> tuple[np.ndarray, np.ndarray]:
+        index = np.fromfile(index_path, dtype=CACHE_DTYPE)
+        self.segments.append(np.memmap(index_path[:-len(".index")] + ".ids", dtype=np.uint16, mode="r"))
+        return index, np.full(len(index), len(self.segments) - 1, dtype=np.int32)
+
+    def _add_run(self, index: np.ndarray, segment_ids: np.ndarray) -> None:
+        order = np.argsort(index["key"], kind="stable")
+        self.runs.append((index[order], segment_ids[order]))
+
+    def load(self) -> None:
+        """read the index of every finished segment"""
+        self.segments = []
+        self.runs = []
+        segments = [self._read_segment(path) for path in sorted(glob.glob(os.path.join(self.cache_dir, "*.index")))]
+        if segments:
+            self._add_run(np.concatenate([index for index, _ in segments]),
+                          np.concatenate([segment_ids for _, segment_ids in segments]))
+        print(f"Loaded {len(self)} cached documents from {len(self.segments)} segments")
+
+    def add_segment(self, index_path: str) -> None:
+        """make a segment finished by this process available to later lookups"""
+        self._add_run(*self._read_segment(index_path))
+
+    def __len__(self) -> int:
+        return sum(len(index) for index, _ in self.runs)
+
+    def lookup(self, keys: np.ndarray, checks: np.ndarray) -> list[Optional[np.ndarray]]:
+        """ids of every document found in the cache, None for the others"""
+        results = [None] * len(keys)
+        for index, segment_ids in self.runs:
+            positions = np.searchsorted(index["key"], keys)
+            for i, position in enumerate(positions):
+                # keys are the first half of the hash, so a few documents may share one
+                while results[i] is None and position < len(index) and index["key"][position] == keys[i]:
+                    if index["check"][position] == checks[i]:
+                        entry = index[position]
+                        segment = self.segments[segment_ids[position]]
+                        results[i] = segment[entry["offset"]:entry["offset"] + entry["length"]]
+                    position += 1
+        return results
+
+    def new_segment(self, name: str) -> TokenCacheSegment:
+        """segment for the documents of one file, unique per process so concurrent runs don't collide"""
+        return TokenCacheSegment(self.cache_dir, f"{name}-{os.getpid()}-{os.urandom(4).hex()}")
@@ -0,0 +1,120 @@
+"""
+GPT-2 tokenized output shards.
+
+Documents are tokenized in batches with the fast GPT-2 tokenizer and appended as
+uint16 ids, each followed by the <|endoftext|> id, to a .bin file in the format
+expected by the training script (`np.memmap(path, dtype=np.uint16)`). A sidecar
+`<name>.bin.idx` holds the int64 token offset of every document plus the end
+offset.
+
+The writer has the same checkpoint()/close() interface as
+`cs336_data.shards.ShardWriter`, so it can be used as an extra output of the
+filtering pipeline and tokenize surviving documents without another pass.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+TOKENIZER_NAME = "gpt2"
+BATCH_SIZE = 64
+
+_TOKENIZER = None
+
+
+def get_tokenizer():
+    """load the GPT-2 tokenizer once per process"""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        from transformers import AutoTokenizer
+        _TOKENIZER = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    return _TOKENIZER
+
+
+def load_token_index(bin_path: str) -> np.ndarray:
+    """token start offsets of each document in a .bin shard, plus the end offset"""
+    return np.fromfile(f"{bin_path}.idx", dtype=np.int64)
+
+
+class TokenShardWriter():
+    def __init__(self, output_path: str, tokenizer=None, batch_size: int = BATCH_SIZE,
+                 tag: str = "", resume_state: Optional[dict] = None):
+        """
+        tokenize documents into a .bin shard
+
+        Args:
+            output_path: path of the .bin file, only created on close
+            tokenizer: huggingface tokenizer, defaults to GPT-2
+            batch_size: number of documents encoded at once
+            tag: name for the temporary files, so concurrent copies of a task don't collide
+            resume_state: state returned by checkpoint() of a previous writer
+        """
+        self.output_path = output_path
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.eos_id = self.tokenizer.eos_token_id
+        self.batch_size = batch_size
+        suffix = f".{tag}" if tag else ""
+        self._tmp_path = f"{output_path}{suffix}.tmp"
+        self._idx_tmp_path = f"{output_path}.idx{suffix}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+        state = resume_state or {"tokens": 0, "docs": 0}
+        self.tokens = state["tokens"]
+        self.docs = state["docs"]
+        if self.tokens > 0 or self.docs > 0:
+            # drop anything written after the last checkpoint
+            self._bin = open(self._tmp_path, "r+b")
+            self._bin.truncate(self.tokens * 2)
+            self._bin.seek(self.tokens * 2)
+            self._idx = open(self._idx_tmp_path, "r+b")
+            self._idx.truncate(self.docs * 8)
+            self._idx.seek(self.docs * 8)
+        else:
+            self._bin = open(self._tmp_path, "wb")
+            self._idx = open(self._idx_tmp_path, "wb")
+        self._pending = []
+
+    def write(self, text: str) -> None:
+        """queue a document, it is tokenized once a full batch is collected"""
+        self._pending.append(text)
+        if len(self._pending) >= self.batch_size:
+            self._encode_pending()
+
+    def _encode_pending(self):
+        if not self._pending:
+            return
+        batch_ids = self.tokenizer(self._pending, verbose=False)["input_ids"]
+        self._pending = []
+
+        lengths = np.array([len(ids) + 1 for ids in batch_ids], dtype=np.int64)
+        ids = np.empty(int(lengths.sum()), dtype=np.uint16)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        for doc_ids, doc_start, doc_end in zip(batch_ids, offsets[:-1], offsets[1:]):
+            ids[doc_start:doc_end - 1] = doc_ids
+            ids[doc_end - 1] = self.eos_id
+
+        self._idx.write((offsets[:-1] + self.tokens).astype(np.int64).tobytes())
+        self._bin.write(ids.tobytes())
+        self.tokens += len(ids)
+        self.docs += len(lengths)
+
+    def checkpoint(self) -> dict:
+        """make everything written so far durable and return the state needed to resume"""
+        self._encode_pending()
+        for f in [self._bin, self._idx]:
+            f.flush()
+            os.fsync(f.fileno())
+        return {"tokens": self.tokens, "docs": self.docs}
+
+    def close(self) -> str:
+        """finish the shard and move it into place, the .bin is renamed last"""
+        self._encode_pending()
+        self._idx.write(np.array([self.tokens], dtype=np.int64).tobytes())
+        for f in [self._bin, self._idx]:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        os.replace(self._idx_tmp_path, f"{self.output_path}.idx")
+        os.replace(self._tmp_path, self.output_path)
+        return self.output_path
@@ -0,0 +1,183 @@
+"""
+Train the fastText quality classifier used by `cs336_data.utils.QualityFilter`.
+
+Replaces the training cells of fasttext.ipynb with a pipeline step. Train and validation
+files come from `cs336_data.shuffle`. Every configuration of a sweep is trained in its own
+process with cpu_count / n_procs threads, and with autotune each one runs fastText's
+hyperparameter search for the given duration starting from its configuration and seed.
+The model with the best validation accuracy is saved as the .bin, and optionally quantized
+(product quantization with a pruned vocabulary, retrained on the training file) into a .ftz
+that is several times smaller and loads faster in each worker. Both are reported with
+validation accuracy, size, load time and predictions per second, and the report is written
+next to the model.
+
+    python -m cs336_data.train_quality_classifier --train quality.train --valid quality.valid --output quality_v2.bin --autotune-seconds 300 --quantize
+
+The model is never written to QUALITY_FILTER directly: compare the report with the one of the
+current model and copy the new one over QUALITY_FILTER to promote it.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+import multiprocessing
+import fasttext
+from cs336_data.utils import QUALITY_FILTER
+
+# configurations trained in parallel, starting points of autotune when it is on
+SWEEP = [
+    {"wordNgrams": 1, "dim": 100, "lr": 0.1, "epoch": 5, "seed": 0},
+    {"wordNgrams": 2, "dim": 100, "lr": 0.1, "epoch": 5, "seed": 1},
+    {"wordNgrams": 2, "dim": 50, "lr": 0.5, "epoch": 10, "seed": 2},
+    {"wordNgrams": 3, "dim": 100, "lr": 0.5, "epoch": 25, "seed": 3, "minCount": 2},
+]
+# seconds of autotune per configuration, 0 to train each configuration as is
+AUTOTUNE_SECONDS = 0
+# words kept by quantization, and the size of its subvectors
+QUANTIZE_CUTOFF = 100000
+QUANTIZE_DSUB = 2
+# validation texts timed with predict
+BENCHMARK_TEXTS = 10000
+
+
+def read_texts(path: str, limit: Optional[int] = None) -> list[str]:
+    """lines of a fastText file without their labels"""
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            text = " ".join(token for token in line.split() if not token.startswith("__label__"))
+            if text:
+                texts.append(text)
+                if limit is not None and len(texts) >= limit:
+                    break
+    return texts
+
+
+def benchmark_model(model_path: str, valid_file: str, n_texts: int = BENCHMARK_TEXTS) -> dict:
+    """validation accuracy, size, load time and predictions per second of a saved model"""
+    start = time.time()
+    model = fasttext.load_model(model_path)
+    load_seconds = time.time() - start
+
+    n_examples, precision, _ = model.test(valid_file)
+    # one text per call, as the filters call it
+    texts = read_texts(valid_file, n_texts)
+    start = time.time()
+    for text in texts:
+        model.predict(text)
+    predict_seconds = time.time() - start
+    return {
+        "path": model_path,
+        "valid_examples": n_examples,
+        "valid_accuracy": precision,
+        "size_mb": os.path.getsize(model_path) / (1024 * 1024),
+        "load_seconds": load_seconds,
+        "predictions_per_second": len(texts) / max(predict_seconds, 1e-9),
+    }
+
+
+def train_config(job: tuple) -> dict:
+    """train one configuration of a sweep and save it, returns its parameters and validation accuracy"""
+    train_file, valid_file, params, autotune_seconds, threads, model_path = job
+    start = time.time()
+    kwargs = dict(params, input=train_file, thread=threads, verbose=0)
+    if autotune_seconds:
+        kwargs.update(autotuneValidationFile=valid_file, autotuneDuration=autotune_seconds)
+    model = fasttext.train_supervised(**kwargs)
+    model.save_model(model_path)
+    _, precision, _ = model.test(valid_file)
+
+    # autotune changes the parameters, report the ones that were used
+    args = model.f.getArgs()
+    used = {name: getattr(args, name) for name in ["wordNgrams", "dim", "lr", "epoch", "minCount", "bucket", "minn", "maxn"]}
+    print(f"Trained {used} in {time.time() - start:.0f}s, validation accuracy {precision:.4f}")
+    return {"params": params, "trained": used, "valid_accuracy": precision, "path": model_path,
+            "seconds": time.time() - start}
+
+
+def quantize_model(model_path: str, train_file: Optional[str], output_path: str, cutoff: int = QUANTIZE_CUTOFF,
+                   dsub: int = QUANTIZE_DSUB) -> None:
+    """product-quantize a model, keeping the cutoff most important words, and retrain it on train_file.
+    Without a training file (e.g. for the dolma NSFW and toxicity models) it is not retrained."""
+    model = fasttext.load_model(model_path)
+    model.quantize(input=train_file, qnorm=True, retrain=train_file is not None, cutoff=cutoff, dsub=dsub, verbose=0)
+    model.save_model(output_path)
+
+
+def train_quality_classifier(train_file: str, valid_file: str, output_path: str,
+                             sweep: list[dict] = SWEEP, autotune_seconds: int = AUTOTUNE_SECONDS,
+                             n_procs: Optional[int] = None, quantize: bool = False,
+                             cutoff: int = QUANTIZE_CUTOFF) -> dict:
+    """
+    Train every configuration of a sweep in parallel and keep the best one
+
+    Args:
+        train_file: fastText training file
+        valid_file: fastText validation file, used by autotune and to pick the best model
+        output_path: best model (.bin), the quantized model is saved with .ftz and the report with .json
+        sweep: fastText parameters of each configuration
+        autotune_seconds: seconds of autotune per configuration, 0 to train the configurations as is
+        n_procs: configurations trained at once (default: all of them, at most one per core)
+        quantize: also save a quantized model
+        cutoff: words kept by quantization
+
+    Returns:
+        report: the result of every configuration and the benchmark of the saved models
+    """
+    n_procs = n_procs or min(len(sweep), multiprocessing.cpu_count())
+    threads = max(1, multiprocessing.cpu_count() // n_procs)
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    sweep_dir = tempfile.mkdtemp(prefix="sweep-", dir=output_dir)
+    try:
+        jobs = [(train_file, valid_file, params, autotune_seconds, threads, os.path.join(sweep_dir, f"model_{i}.bin"))
+                for i, params in enumerate(sweep)]
+        print(f"Training {len(jobs)} configurations, {n_procs} at once with {threads} threads each")
+        with multiprocessing.Pool(n_procs) as pool:
+            results = pool.map(train_config, jobs)
+        best = max(results, key=lambda result: result["valid_accuracy"])
+        print(f"Best configuration {best['trained']} with validation accuracy {best['valid_accuracy']:.4f}")
+        os.replace(best["path"], output_path)
+    finally:
+        shutil.rmtree(sweep_dir, ignore_errors=True)
+
+    for result in results:
+        del result["path"]
+    report = {"sweep": results, "best": best["trained"], "models": [benchmark_model(output_path, valid_file)]}
+    if quantize:
+        quantized_path = f"{os.path.splitext(output_path)[0]}.ftz"
+        quantize_model(output_path, train_file, quantized_path, cutoff=cutoff)
+        report["models"].append(benchmark_model(quantized_path, valid_file))
+
+    for model in report["models"]:
+        print(f"{model['path']}: validation accuracy {model['valid_accuracy']:.4f}, {model['size_mb']:.1f} MB, "
+              f"loads in {model['load_seconds']:.2f}s, {model['predictions_per_second']:.0f} predictions/s")
+    with open(f"{os.path.splitext(output_path)[0]}.json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"To promote it, copy {output_path} to {QUALITY_FILTER}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the fastText quality classifier")
+    parser.add_argument("--train", required=True, help="training file, e.g. from cs336_data.shuffle")
+    parser.add_argument("--valid", required=True, help="validation file")
+    parser.add_argument("--output", required=True, help="path of the best model, not the QUALITY_FILTER in use")
+    parser.add_argument("--autotune-seconds", type=int, default=AUTOTUNE_SECONDS,
+                        help="seconds of autotune per configuration, 0 to train them as is (default: %(default)s)")
+    parser.add_argument("--n-procs", type=int, default=None, help="configurations trained at once")
+    parser.add_argument("--quantize", action="store_true", help="also save a quantized .ftz model")
+    parser.add_argument("--cutoff", type=int, default=QUANTIZE_CUTOFF, help="words kept by quantization (default: %(default)s)")
+    args = parser.parse_args()
+
+    train_quality_classifier(args.train, args.valid, args.output, autotune_seconds=args.autotune_seconds,
+                             n_procs=args.n_procs, quantize=args.quantize, cutoff=args.cutoff)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
 """
-Parallel URL scraper with wget/submitit.
+Parallel URL scraper with submitit, fetching each batch with the async fetcher
+(`cs336_data.fetch`) or wget.
 """
 
 import argparse
 import gzip
+import hashlib
+import heapq
+import json
+import math
 import os
 import random
 import subprocess
 import sys
+from collections import Counter
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+import tldextract
+
+from cs336_data.checkpoint import atomic_write_json
+from cs336_data.fetch import AIOHTTP_AVAILABLE, fetch_urls
+from cs336_data.url_filter import URLFilter
 
 try:
     import submitit
@@ -18,42 +31,136 @@ except ImportError:
     SUBMITIT_AVAILABLE = False
     print("Warning: submitit not available. Falling back to local multiprocessing.")
 
+# "async" fetches every url of a batch concurrently and writes the WARC directly, "wget" runs one wget per batch
+FETCHERS = ["async", "wget"]
+FETCHER = "async" if AIOHTTP_AVAILABLE else "wget"
+
+# query parameters that only track the visitor, dropped when normalizing
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# responses fetched again when a batch is rerun, along with urls that got no response
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+_TLD_EXTRACT = None
+
+
+def _uniform(rng: random.Random) -> float:
+    """uniform in (0, 1), so its log is finite"""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def reservoir_sample(items: Iterable[str], k: int, rng: random.Random = random) -> Tuple[List[str], int]:
+    """
+    Uniform sample of k items in one pass with Algorithm L, which draws the number of items
+    to skip between replacements instead of one random number per item.
+
+    Returns:
+        sample: min(k, n) items, in no particular order
+        n: number of items seen
+    """
+    reservoir = []
+    n = 0
+    if k <= 0:
+        return reservoir, sum(1 for _ in items)
+    # log of the largest of k uniform weights, and index of the next item that enters the reservoir
+    log_w = 0.0
+    next_index = k
+    for item in items:
+        if n < k:
+            reservoir.append(item)
+            if n == k - 1:
+                log_w = math.log(_uniform(rng)) / k
+                next_index = k + math.floor(math.log(_uniform(rng)) / math.log(-math.expm1(log_w)))
+        elif n == next_index:
+            reservoir[rng.randrange(k)] = item
+            log_w += math.log(_uniform(rng)) / k
+            next_index += 1 + math.floor(math.log(_uniform(rng)) / math.log(-math.expm1(log_w)))
+        n += 1
+    return reservoir, n
+
+
+def merge_samples(samples: List[Tuple[List[str], int]], k: int, rng: random.Random = random) -> List[str]:
+    """
+    Merge uniform samples of disjoint chunks into a uniform sample of k items of their union.
+    How many items come from each chunk follows the hypergeometric distribution of drawing k
+    items without replacement from all chunks.
+    """
+    remaining = [n for _, n in samples]
+    counts = [0] * len(samples)
+    for _ in range(min(k, sum(remaining))):
+        i = rng.choices(range(len(samples)), weights=remaining)[0]
+        counts[i] += 1
+        remaining[i] -= 1
+    merged = []
+    for (sample, _), count in zip(samples, counts):
+        merged.extend(rng.sample(sample, count))
+    return merged
+
+
+def _non_empty_lines(lines: Iterable) -> Iterator[str]:
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _iter_chunk_lines(input_file: str, start: int, end: int) -> Iterator[bytes]:
+    """lines of a plain text file that start in the byte range [start, end)"""
+    with open(input_file, 'rb') as f:
+        if start > 0:
+            # the line that straddles start belongs to the previous chunk
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
 
-def sample_urls(input_file: str, n_samples: int, output_file: str) -> None:
-    """Sample n_samples URLs from the input file."""
+
+def sample_chunk(job: tuple) -> Tuple[List[str], int]:
+    """reservoir sample of the non-empty lines of one byte range of a file"""
+    input_file, start, end, k, seed = job
+    return reservoir_sample(_non_empty_lines(_iter_chunk_lines(input_file, start, end)), k, random.Random(seed))
+
+
+def sample_urls(input_file: str, n_samples: int, output_file: str, n_procs: int = 1) -> None:
+    """Sample n_samples URLs from the input file in a single read.
+
+    Plain text files are split into n_procs byte ranges that are sampled in parallel and merged,
+    gzipped files can't be split and are sampled in one stream. The sample is written in random order."""
     print(f"Sampling {n_samples} URLs from {input_file}")
-    
-    # count total lines
-    if input_file.endswith('.gz'):
-        with gzip.open(input_file, 'rt', encoding='utf-8') as f:
-            total_lines = sum(1 for _ in f)
+
+    if input_file.endswith('.gz') or n_procs <= 1:
+        opener = gzip.open if input_file.endswith('.gz') else open
+        with opener(input_file, 'rt', encoding='utf-8') as f:
+            sampled_urls, total_lines = reservoir_sample(_non_empty_lines(f), n_samples)
     else:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            total_lines = sum(1 for _ in f)
-    
+        from multiprocessing import Pool
+
+        size = os.path.getsize(input_file)
+        bounds = [size * i // n_procs for i in range(n_procs + 1)]
+        # seeds drawn from the global generator, so random.seed() still makes the sample reproducible
+        jobs = [(input_file, bounds[i], bounds[i + 1], n_samples, random.getrandbits(64)) for i in range(n_procs)]
+        with Pool(n_procs) as pool:
+            samples = pool.map(sample_chunk, jobs)
+        total_lines = sum(n for _, n in samples)
+        sampled_urls = merge_samples(samples, n_samples)
+
     print(f"Total URLs available: {total_lines}")
-    
     if n_samples > total_lines:
         print(f"Warning: Requested {n_samples} samples but only {total_lines} available")
-        n_samples = total_lines
-    
-    # sample random line indices
-    sampled_indices = set(random.sample(range(total_lines), n_samples))
-    
-    # extract sampled URLs
-    sampled_urls = []
-    if input_file.endswith('.gz'):
-        with gzip.open(input_file, 'rt', encoding='utf-8') as f:
-            for i, line in enumerate(f):
-                if i in sampled_indices:
-                    sampled_urls.append(line.strip())
-    else:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f):
-                if i in sampled_indices:
-                    sampled_urls.append(line.strip())
-    
-    # write sampled URLs
+
+    # the reservoir is not in a uniformly random order
+    random.shuffle(sampled_urls)
     with open(output_file, 'w', encoding='utf-8') as f:
         for url in sampled_urls:
             f.write(f"{url}\n")
@@ -61,35 +168,279 @@ def sample_urls(input_file: str, n_samples: int, output_file: str) -> None:
     print(f"Sampled {len(sampled_urls)} URLs to {output_file}")
 
 
-def split_urls_into_batches(url_file: str, batch_size: int, output_dir: str) -> List[str]:
-    """Split URLs into batches and return list of batch files."""
+def split_urls_into_batches(url_file: str, batch_size: int, output_dir: str,
+                            url_filter: Optional[URLFilter] = None) -> List[str]:
+    """Split URLs into batches and return list of batch files, writing each batch as the URLs are read.
+    URLs rejected by url_filter are dropped."""
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
     batch_files = []
-    
+    print(f"Splitting URLs from {url_file} into batches of {batch_size}")
+
+    batch = None
+    n_urls = n_blocked = 0
     with open(url_file, 'r', encoding='utf-8') as f:
-        urls = [line.strip() for line in f if line.strip()]
-    
-    print(f"Splitting {len(urls)} URLs into batches of {batch_size}")
-    
-    for i in range(0, len(urls), batch_size):
-        batch_num = i // batch_size
+        for url in _non_empty_lines(f):
+            if url_filter is not None and not url_filter.allowed(url):
+                n_blocked += 1
+                continue
+            if n_urls % batch_size == 0:
+                if batch is not None:
+                    batch.close()
+                    print(f"Created batch {len(batch_files) - 1}: {batch_size} URLs -> {batch_files[-1]}")
+                batch_file = output_path / f"batch_{len(batch_files):04d}.txt"
+                batch = open(batch_file, 'w', encoding='utf-8')
+                batch_files.append(str(batch_file))
+            batch.write(f"{url}\n")
+            n_urls += 1
+    if batch is not None:
+        batch.close()
+        print(f"Created batch {len(batch_files) - 1}: {n_urls - (len(batch_files) - 1) * batch_size} URLs -> {batch_files[-1]}")
+
+    print(f"Split {n_urls} URLs into {len(batch_files)} batches, {n_blocked} URLs blocked")
+    return batch_files
+
+
+def hash_url(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _is_tracking_param(param: str) -> bool:
+    key = unquote_plus(param.split("=", 1)[0]).lower()
+    return key.startswith(TRACKING_PREFIXES) or key in TRACKING_PARAMS
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """Canonical form of an http(s) URL, None if it can't be fetched.
+
+    Lowercases the scheme and host, drops the fragment, default port, user info and tracking
+    parameters, and gives an empty path as "/". The rest of the query is kept byte for byte, since
+    servers differ in how they parse it (e.g. "?q" vs "?q=", "%20" vs "+", ";" separators)."""
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").rstrip(".")
+        port = parts.port
+    except ValueError:
+        return None
+    if scheme not in ("http", "https") or not host:
+        return None
+    if ":" in host:
+        # ipv6 address
+        host = f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+    query = "&".join(param for param in parts.query.split("&") if not _is_tracking_param(param)) if parts.query else ""
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def registered_domain(url: str) -> str:
+    """Domain registered under a public suffix, e.g. bbc.co.uk for news.bbc.co.uk, or the host for IPs."""
+    global _TLD_EXTRACT
+    if _TLD_EXTRACT is None:
+        # bundled public suffix list, compute nodes can't fetch the latest one
+        _TLD_EXTRACT = tldextract.TLDExtract(suffix_list_urls=())
+    extracted = _TLD_EXTRACT(url)
+    return ".".join(part for part in (extracted.domain, extracted.suffix) if part)
+
+
+def group_urls_into_batches(url_file: str, batch_size: int, output_dir: str,
+                            url_filter: Optional[URLFilter] = None) -> List[str]:
+    """Normalize and deduplicate URLs, drop those rejected by url_filter, and split them into
+    batches grouped by registered domain.
+
+    All URLs of a domain go to the same batch unless the domain has more than batch_size URLs, so a
+    batch reuses keep-alive connections and the fetcher's per-host limits hold across batches."""
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # 64 bit hashes of the normalized URLs seen so far
+    seen = set()
+    domains = {}
+    n_urls = n_invalid = n_duplicates = n_blocked = 0
+    with open(url_file, 'r', encoding='utf-8') as f:
+        for url in _non_empty_lines(f):
+            n_urls += 1
+            url = normalize_url(url)
+            if url is None:
+                n_invalid += 1
+                continue
+            if url_filter is not None and not url_filter.allowed(url):
+                n_blocked += 1
+                continue
+            key = hash_url(url)
+            if key in seen:
+                n_duplicates += 1
+                continue
+            seen.add(key)
+            domains.setdefault(registered_domain(url), []).append(url)
+
+    print(f"Read {n_urls} URLs: {n_invalid} invalid, {n_blocked} blocked, {n_duplicates} duplicates, "
+          f"{n_urls - n_invalid - n_blocked - n_duplicates} unique URLs on {len(domains)} domains")
+
+    # largest domains first, the rest fill up the remaining space of each batch
+    batches = []
+    # (-free space, index) of the batches that are not full, the emptiest one first
+    free = []
+    for domain in sorted(domains, key=lambda d: (-len(domains[d]), d)):
+        urls = sorted(domains[domain])
+        while urls:
+            # the emptiest batch if the domain fits in it, a new one if it doesn't fit anywhere
+            if free and -free[0][0] >= len(urls):
+                _, i = heapq.heappop(free)
+            else:
+                i = len(batches)
+                batches.append([])
+            batch = batches[i]
+            n = batch_size - len(batch)
+            batch.extend(urls[:n])
+            urls = urls[n:]
+            if len(batch) < batch_size:
+                heapq.heappush(free, (len(batch) - batch_size, i))
+
+    batch_files = []
+    for batch_num, batch in enumerate(batches):
         batch_file = output_path / f"batch_{batch_num:04d}.txt"
-        batch_urls = urls[i:i + batch_size]
-        
         with open(batch_file, 'w', encoding='utf-8') as f:
-            for url in batch_urls:
+            for url in batch:
                 f.write(f"{url}\n")
-        
         batch_files.append(str(batch_file))
-        print(f"Created batch {batch_num}: {len(batch_urls)} URLs -> {batch_file}")
-    
+    print(f"Split {sum(len(b) for b in batches)} URLs into {len(batch_files)} batches grouped by domain")
     return batch_files
 
 
-def download_batch(batch_file: str, output_dir: str, timeout: int = 5) -> str:
-    """Download a batch of URLs using wget."""
+def warc_segment(output_path: Path, batch_name: str, segment: int) -> Path:
+    """WARC written by the n-th run of a batch, later runs only fetch what earlier ones didn't get"""
+    if segment == 0:
+        return output_path / f"{batch_name}.warc.gz"
+    return output_path / f"{batch_name}.{segment}.warc.gz"
+
+
+def list_warc_segments(output_path: Path, batch_name: str) -> dict:
+    """segment number -> path of every WARC segment of a batch"""
+    segments = {}
+    if warc_segment(output_path, batch_name, 0).exists():
+        segments[0] = warc_segment(output_path, batch_name, 0)
+    for path in output_path.glob(f"{batch_name}.*.warc.gz"):
+        number = path.name[len(batch_name) + 1:-len(".warc.gz")]
+        if number.isdigit():
+            segments[int(number)] = path
+    return segments
+
+
+def read_manifest(manifest_file: Path) -> List[dict]:
+    """Every entry of a batch manifest, dropping a last line cut off by a killed run."""
+    if not manifest_file.exists():
+        return []
+    with open(manifest_file, 'rb') as f:
+        data = f.read()
+    complete = data[:data.rfind(b"\n") + 1]
+    if len(complete) < len(data):
+        # later runs append to the manifest, so it has to end with a complete line
+        with open(manifest_file, 'r+b') as f:
+            f.truncate(len(complete))
+    return [json.loads(line) for line in complete.decode('utf-8').splitlines() if line]
+
+
+def repair_warc_segments(output_path: Path, batch_name: str, entries: List[dict]) -> dict:
+    """Cut every WARC segment after the last record the manifest points to, the rest was written by a killed run."""
+    ends = {}
+    for entry in entries:
+        if entry.get("warc"):
+            ends[entry["warc"]] = max(ends.get(entry["warc"], 0), entry["offset"] + entry["length"])
+    segments = list_warc_segments(output_path, batch_name)
+    for number, path in list(segments.items()):
+        end = ends.get(path.name, 0)
+        if end == 0:
+            path.unlink()
+            del segments[number]
+        elif path.stat().st_size > end:
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+    return segments
+
+
+def needs_retry(entry: dict) -> bool:
+    return entry["status"] is None or entry["status"] in RETRY_STATUSES
+
+
+def fetch_batch(batch_file: str, output_dir: str, timeout: int = 5, on_response=None) -> str:
+    """Download a batch of URLs with the async fetcher, stats go to <batch>.json.
+
+    The outcome of every URL is recorded in <batch>.manifest.jsonl, so a rerun only fetches
+    the URLs that failed or were never reached, into a new WARC segment. on_response is
+    passed to `cs336_data.fetch.fetch_urls` to consume responses as they arrive."""
+    batch_name = Path(batch_file).stem
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    manifest_file = output_path / f"{batch_name}.manifest.jsonl"
+    stats_file = output_path / f"{batch_name}.json"
+
+    with open(batch_file, 'r', encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip()]
+
+    try:
+        entries = read_manifest(manifest_file)
+        segments = repair_warc_segments(output_path, batch_name, entries)
+        done = {entry["url"]: entry for entry in entries}
+        pending = [url for url in urls if url not in done or needs_retry(done[url])]
+        seconds = 0.0
+        if stats_file.exists():
+            with open(stats_file, 'r') as f:
+                seconds = json.load(f)["seconds"]
+
+        if pending:
+            warc_file = warc_segment(output_path, batch_name, max(segments, default=-1) + 1)
+            if len(pending) < len(urls):
+                print(f"Resuming download for {batch_file}: {len(pending)} of {len(urls)} URLs left -> {warc_file}")
+            else:
+                print(f"Starting download for {batch_file}")
+            run = fetch_urls(pending, str(warc_file), log_path=str(output_path / f"{batch_name}.log"),
+                             manifest_path=str(manifest_file), timeout=timeout, on_response=on_response)
+            seconds += run["seconds"]
+            done.update((entry["url"], entry) for entry in read_manifest(manifest_file))
+        else:
+            print(f"Skipping {batch_file} because every URL is done")
+    except Exception as e:
+        status = f"ERROR: {batch_file} failed with exception: {e}"
+        print(status)
+        return status
+
+    # stats of the latest outcome of every url, over all runs
+    outcomes = [done[url] for url in urls if url in done]
+    status_codes = Counter(entry["status"] for entry in outcomes if entry["status"] is not None)
+    stats = {
+        "urls": len(urls),
+        "responses": sum(status_codes.values()),
+        "errors": len(outcomes) - sum(status_codes.values()),
+        # never reached, e.g. after a streaming run stopped
+        "missing": len(urls) - len(outcomes),
+        "status_codes": dict(sorted(status_codes.items())),
+        "bytes": sum(entry.get("bytes", 0) for entry in outcomes),
+        "seconds": seconds,
+    }
+    stats["bytes_per_second"] = stats["bytes"] / max(seconds, 1e-9)
+    atomic_write_json(stats, str(stats_file))
+
+    summary = (f"{stats['responses']}/{stats['urls']} responses, {stats['errors']} errors, {stats['missing']} missing, "
+               f"{stats['bytes_per_second'] / 1e6:.2f} MB/s, status codes {stats['status_codes']}")
+    # same as wget, which exits with an error on failed urls and error responses
+    if stats["errors"] == 0 and stats["missing"] == 0 and all(code < 400 for code in stats["status_codes"]):
+        status = f"SUCCESS: {batch_file} -> {output_path / batch_name}*.warc.gz ({summary})"
+    else:
+        status = f"PARTIAL: {batch_file} completed with errors ({summary})"
+    print(status)
+    return status
+
+
+def download_batch(batch_file: str, output_dir: str, timeout: int = 5, fetcher: str = FETCHER) -> str:
+    """Download a batch of URLs using the async fetcher or wget."""
+    if fetcher == "async":
+        return fetch_batch(batch_file, output_dir, timeout)
+    if fetcher != "wget":
+        raise ValueError(f"Unknown fetcher {fetcher}, expected one of {FETCHERS}")
+
     batch_path = Path(batch_file)
     batch_name = batch_path.stem
     output_path = Path(output_dir)
@@ -138,7 +489,8 @@ def download_batch(batch_file: str, output_dir: str, timeout: int = 5) -> str:
     return status
 
 
-def process_batch_chunk(batch_files_chunk: List[str], output_dir: str, n_workers: int = 4) -> List[str]:
+def process_batch_chunk(batch_files_chunk: List[str], output_dir: str, n_workers: int = 4,
+                        fetcher: str = FETCHER) -> List[str]:
     """Process a chunk of batch files using local multiprocessing on a single node."""
     from concurrent.futures import ProcessPoolExecutor, as_completed
     
@@ -150,7 +502,7 @@ def process_batch_chunk(batch_files_chunk: List[str], output_dir: str, n_workers
     with ProcessPoolExecutor(max_workers=n_workers) as executor:
         # submit all jobs for this chunk
         future_to_batch = {
-            executor.submit(download_batch, batch_file, output_dir): batch_file 
+            executor.submit(download_batch, batch_file, output_dir, fetcher=fetcher): batch_file 
             for batch_file in batch_files_chunk
         }
         
@@ -185,6 +537,37 @@ def distribute_batches_across_jobs(batch_files: List[str], n_slurm_jobs: int) ->
     return chunks
 
 
+def print_summary(results: List[str], batch_files: List[str], output_dir: str) -> None:
+    """Count batch statuses, and add up the stats the async fetcher wrote for each batch."""
+    success_count = sum(1 for r in results if r.startswith("SUCCESS"))
+    partial_count = sum(1 for r in results if r.startswith("PARTIAL"))
+    error_count = len(results) - success_count - partial_count
+    
+    print(f"\nSUMMARY:")
+    print(f"  Successful batches: {success_count}")
+    print(f"  Partial batches: {partial_count}")
+    print(f"  Failed batches: {error_count}")
+    print(f"  Total batches: {len(batch_files)}")
+
+    totals = {"urls": 0, "responses": 0, "errors": 0, "bytes": 0, "seconds": 0.0}
+    status_codes = {}
+    for batch_file in batch_files:
+        stats_file = Path(output_dir) / f"{Path(batch_file).stem}.json"
+        if not stats_file.exists():
+            continue
+        with open(stats_file, 'r') as f:
+            stats = json.load(f)
+        for key in totals:
+            totals[key] += stats[key]
+        for code, count in stats["status_codes"].items():
+            status_codes[code] = status_codes.get(code, 0) + count
+    if totals["urls"]:
+        print(f"  URLs: {totals['urls']} ({totals['responses']} responses, {totals['errors']} errors)")
+        # batches run concurrently, so this is the mean rate of one batch
+        print(f"  Downloaded: {totals['bytes'] / 1e6:.1f} MB, {totals['bytes'] / max(totals['seconds'], 1e-9) / 1e6:.2f} MB/s per batch")
+        print(f"  Status codes: {dict(sorted(status_codes.items()))}")
+
+
 def run_with_submitit(batch_files: List[str], 
                     output_dir: str, 
                      slurm_partition: str = "a4-cpu", 
@@ -192,7 +575,8 @@ def run_with_submitit(batch_files: List[str],
                      slurm_mem: str = "16GB",
                      slurm_qos: str = "a4-cpu-qos",
                      n_slurm_jobs: int = 4,
-                     local_workers: int = 4) -> None:
+                     local_workers: int = 4,
+                     fetcher: str = FETCHER) -> None:
     """Run downloads using submitit on SLURM with fixed number of jobs."""
     if not SUBMITIT_AVAILABLE:
         raise ImportError("submitit is required for SLURM execution")
@@ -221,7 +605,7 @@ def run_with_submitit(batch_files: List[str],
         if not batch_chunk:  # skip empty chunks
             continue
             
-        job = executor.submit(process_batch_chunk, batch_chunk, output_dir, local_workers)
+        job = executor.submit(process_batch_chunk, batch_chunk, output_dir, local_workers, fetcher)
         jobs.append(job)
         print(f"Submitted SLURM job {job.job_id} for chunk {i} ({len(batch_chunk)} batches)")
     
@@ -238,30 +622,11 @@ def run_with_submitit(batch_files: List[str],
             all_results.append(error_msg)
             print(error_msg)
     
-    # print summary
-    success_count = sum(1 for r in all_results if r.startswith("SUCCESS"))
-    partial_count = sum(1 for r in all_results if r.startswith("PARTIAL"))
-    error_count = len(all_results) - success_count - partial_count
-    
-    print(f"\nSUMMARY:")
-    print(f"  Successful batches: {success_count}")
-    print(f"  Partial batches: {partial_count}")
-    print(f"  Failed batches: {error_count}")
-    print(f"  Total batches: {len(batch_files)}")
+    print_summary(all_results, batch_files, output_dir)
 
 
 def run_with_local_multiprocessing(batch_files: List[str], output_dir: str, 
-                                 n_workers: int = 4) -> None:
+                                 n_workers: int = 4, fetcher: str = FETCHER) -> None:
     """Run downloads using local multiprocessing."""
-    results = process_batch_chunk(batch_files, output_dir, n_workers)
-    
-    # print summary
-    success_count = sum(1 for r in results if r.startswith("SUCCESS"))
-    partial_count = sum(1 for r in results if r.startswith("PARTIAL"))
-    error_count = len(results) - success_count - partial_count
-    
-    print(f"\nSUMMARY:")
-    print(f"  Successful batches: {success_count}")
-    print(f"  Partial batches: {partial_count}")
-    print(f"  Failed batches: {error_count}")
-    print(f"  Total batches: {len(batch_files)}")
\ No newline at end of file
+    results = process_batch_chunk(batch_files, output_dir, n_workers, fetcher)
+    print_summary(results, batch_files, output_dir)
@@ -0,0 +1,107 @@
+"""
+Domain list and URL pattern prefilter, run on URLs before they are fetched and on WET
+records before they are classified.
+
+Blocklists and allowlists are hash sets of lowercased domains. A URL is looked up by
+its host and then every parent domain (a.b.example.com, b.example.com, example.com,
+com), and the most specific listed domain decides: allowlisting good.blogspot.com
+keeps it even if blogspot.com is blocked, and blocking spam.example.org rejects it
+even if example.org is allowed. URL rules are regexes compiled into one alternation
+that is searched once per URL, so a check is a handful of set lookups and one regex
+search. Lists have one domain per line (hosts-file lines, "*.domain" and URLs are
+also accepted) and "#" comments. The prefilter is opt-in in both places it runs,
+`--url-filter` of `cs336_data.download` and of `cs336_data.first_filter`.
+
+    url_filter = URLFilter.from_files("blocklist.txt")
+    url_filter.reason("https://ads.example.com/x.jpg")  # "blocklist:example.com" or "pattern", None if allowed
+"""
+
+import re
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
+# links to files that are not web pages, and pages without content for training
+DEFAULT_PATTERNS = [
+    r"\.(?:jpe?g|png|gif|bmp|svg|webp|ico|pdf|zip|gz|tgz|rar|7z|exe|dmg|iso|mp3|mp4|m4a|avi|mov|wmv|flv|wav|ogg|css|js|xml|rss)(?:[?#]|$)",
+    r"/(?:wp-admin|wp-login\.php|cart|checkout|login|signin|signup|register)(?:[/?#]|$)",
+]
+
+_URL_FILTERS = {}
+
+
+def read_domain_list(path: str) -> list[str]:
+    """domains of a list file, lowercased, without comments, wildcards or hosts-file addresses"""
+    domains = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            # hosts files have "0.0.0.0 domain"
+            entry = line.split()[-1]
+            if "://" in entry:
+                entry = urlsplit(entry).hostname or ""
+            entry = entry.lower().lstrip("*").strip(".")
+            if entry:
+                domains.append(entry)
+    return domains
+
+
+def read_patterns(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip() and not line.startswith("#")]
+
+
+class URLFilter():
+    def __init__(self, blocklist: Iterable[str] = (), allowlist: Iterable[str] = (),
+                 patterns: Optional[Iterable[str]] = None):
+        """
+        Args:
+            blocklist: domains whose URLs are rejected, with all their subdomains
+            allowlist: domains whose URLs are kept, with all their subdomains, unless a more specific domain is blocked
+            patterns: regexes rejecting the URLs they match anywhere, defaults to DEFAULT_PATTERNS
+        """
+        # domain -> True if allowed, False if blocked, a domain on both lists is allowed
+        self.domains = {domain.lower(): False for domain in blocklist}
+        self.domains.update((domain.lower(), True) for domain in allowlist)
+        patterns = DEFAULT_PATTERNS if patterns is None else list(patterns)
+        self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+
+    @classmethod
+    def from_files(cls, blocklist_path: Optional[str] = None, allowlist_path: Optional[str] = None,
+                   patterns_path: Optional[str] = None) -> "URLFilter":
+        return cls(read_domain_list(blocklist_path) if blocklist_path else (),
+                   read_domain_list(allowlist_path) if allowlist_path else (),
+                   read_patterns(patterns_path) if patterns_path else None)
+
+    def reason(self, url: str) -> Optional[str]:
+        """why a URL is rejected ("blocklist:<domain>" or "pattern"), None if it is kept"""
+        if self.domains:
+            try:
+                host = (urlsplit(url).hostname or "").rstrip(".")
+            except ValueError:
+                host = ""
+            # the host, then each parent domain, most specific first
+            while host:
+                allowed = self.domains.get(host)
+                if allowed is not None:
+                    if not allowed:
+                        return f"blocklist:{host}"
+                    break
+                host = host.partition(".")[2]
+        if self.pattern is not None and self.pattern.search(url):
+            return "pattern"
+        return None
+
+    def allowed(self, url: str) -> bool:
+        return self.reason(url) is None
+
+
+def get_url_filter(blocklist_path: Optional[str] = None, allowlist_path: Optional[str] = None,
+                   patterns_path: Optional[str] = None) -> URLFilter:
+    """load the lists once per process, forked pool workers share them"""
+    key = (blocklist_path, allowlist_path, patterns_path)
+    if key not in _URL_FILTERS:
+        _URL_FILTERS[key] = URLFilter.from_files(blocklist_path, allowlist_path, patterns_path)
+        print(f"Loaded URL filter with {len(_URL_FILTERS[key].domains)} domains")
+    return _URL_FILTERS[key]
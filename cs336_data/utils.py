@@ -11,7 +11,7 @@ from resiliparse.parse.encoding import detect_encoding
 import fasttext
 from resiliparse.extract.html2text import extract_plain_text
 import os
-from typing import Tuple
+from typing import Optional, Tuple
 import random
 import re
 from cs336_data.gopher import GopherFilter
@@ -24,6 +24,8 @@ NSFW_FILTER = "classifiers/dolma_fasttext_nsfw_jigsaw_model.bin"
 TOXIC_FILTER = "classifiers/dolma_fasttext_hatespeech_jigsaw_model.bin"
 LANGUAGE_FILTER = "classifiers/lid.176.bin"
 QUALITY_FILTER = "/home/c-cye/assignment4-data/cs336_data/quality_classifier.bin"
+# with a cheap model, its predictions with a confidence in [low, high) are escalated to the full model
+CASCADE_BAND = (0.0, 0.9)
 
 def html_to_txt(html: bytes) -> str:
     encoding = detect_encoding(html)
@@ -46,6 +48,12 @@ def html_to_txt(html: bytes) -> str:
             print(f"Error decoding HTML: {e}")
             return ""
 
+def warc_payloads(warc_file: str):
+    """raw payload of every response record, without extracting text"""
+    stream = GZipStream(FileStream(warc_file, 'rb'))
+    for record in ArchiveIterator(stream, record_types=WarcRecordType.response):
+        yield record.reader.read()
+
 def warc_to_txt(warc_file: str, n_records: int = 10, record_id: int = 0):
     stream = GZipStream(FileStream(warc_file, 'rb'))
     for i, record in enumerate(ArchiveIterator(stream, record_types=WarcRecordType.response)):
@@ -80,9 +88,52 @@ class PIIFilter():
         masked_text, count = self.ipv4_regex.subn("|||IP_ADDRESS|||", text)
         return masked_text, count
 
-def load_classifier(classifier_id: str) -> fasttext.FastText:
-    classifier_path = os.path.join(BASE_DIR, classifier_id)
-    return fasttext.load_model(classifier_path)
+class CascadeClassifier():
+    def __init__(self, full: fasttext.FastText, cheap: fasttext.FastText, band: Tuple[float, float] = CASCADE_BAND):
+        """
+        Predicts with a cheap model (e.g. quantized with cs336_data.train_quality_classifier) and
+        only runs the full model when the cheap confidence is in the uncertainty band, same
+        predict as a fastText model so it can replace one
+
+        Args:
+            full: the reference model
+            cheap: the model tried first
+            band: (low, high), cheap predictions with a confidence in [low, high) are escalated
+        """
+        self.full = full
+        self.cheap = cheap
+        self.band = band
+        # route every prediction to the full model, to compare with it
+        self.full_only = False
+        self.predictions = 0
+        self.escalations = 0
+
+    def predict(self, text: str, k: int = 1):
+        if self.full_only:
+            return self.full.predict(text, k)
+        labels, probs = self.cheap.predict(text, k)
+        self.predictions += 1
+        if self.band[0] <= probs[0] < self.band[1]:
+            self.escalations += 1
+            return self.full.predict(text, k)
+        return labels, probs
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalations / max(self.predictions, 1)
+
+def classifier_meta(classifier_id: str) -> dict:
+    """path and modification time of a classifier, saved with outputs so that a retrained one is noticed"""
+    path = os.path.abspath(os.path.join(BASE_DIR, classifier_id))
+    return {"classifier": path, "classifier_mtime": os.path.getmtime(path) if os.path.exists(path) else None}
+
+def load_classifier(classifier_id: str, cheap_classifier_id: Optional[str] = None,
+                    band: Tuple[float, float] = CASCADE_BAND):
+    """a fastText model, or a cascade of a cheap model and the full one"""
+    classifier = fasttext.load_model(os.path.join(BASE_DIR, classifier_id))
+    if cheap_classifier_id is None:
+        return classifier
+    return CascadeClassifier(classifier, fasttext.load_model(os.path.join(BASE_DIR, cheap_classifier_id)), band)
 
 def filter_fasttext(text: str, classifier: fasttext.FastText) -> str:
     # strip newlines
@@ -94,8 +145,9 @@ def filter_fasttext(text: str, classifier: fasttext.FastText) -> str:
     return label, confidence
 
 class QualityFilter():
-    def __init__(self, classifier_id: str = QUALITY_FILTER):
-        self.classifier = load_classifier(classifier_id)
+    def __init__(self, classifier_id: str = QUALITY_FILTER, cheap_classifier_id: Optional[str] = None,
+                 band: Tuple[float, float] = CASCADE_BAND):
+        self.classifier = load_classifier(classifier_id, cheap_classifier_id, band)
 
     def filter_quality(self, text: str) -> str:
         return filter_fasttext(text, self.classifier)
@@ -108,15 +160,17 @@ class LanguageDetector():
         return filter_fasttext(text, self.classifier)
 
 class NSFWDetector():
-    def __init__(self, classifier_id: str = NSFW_FILTER):
-        self.classifier = load_classifier(classifier_id)
+    def __init__(self, classifier_id: str = NSFW_FILTER, cheap_classifier_id: Optional[str] = None,
+                 band: Tuple[float, float] = CASCADE_BAND):
+        self.classifier = load_classifier(classifier_id, cheap_classifier_id, band)
 
     def filter_nsfw(self, text: str) -> str:
         return filter_fasttext(text, self.classifier)
 
 class ToxicDetector():
-    def __init__(self, classifier_id: str = TOXIC_FILTER):
-        self.classifier = load_classifier(classifier_id)
+    def __init__(self, classifier_id: str = TOXIC_FILTER, cheap_classifier_id: Optional[str] = None,
+                 band: Tuple[float, float] = CASCADE_BAND):
+        self.classifier = load_classifier(classifier_id, cheap_classifier_id, band)
 
     def filter_toxic(self, text: str) -> str:
         return filter_fasttext(text, self.classifier)
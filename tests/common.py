@@ -1,3 +1,16 @@
+import gzip
 import pathlib
+import uuid
 
 FIXTURES_PATH = (pathlib.Path(__file__).resolve().parent) / "fixtures"
+
+
+def write_warc(path, records, warc_type="conversion", content_type="text/plain"):
+    """write (url, body) records as a gzipped WARC file, one gzip member per record like Common Crawl"""
+    with open(path, "wb") as f:
+        for url, body in records:
+            body = body.encode("utf-8")
+            headers = (f"WARC/1.0\r\nWARC-Type: {warc_type}\r\nWARC-Target-URI: {url}\r\n"
+                       f"WARC-Date: 2024-01-01T00:00:00Z\r\nWARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+                       f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n")
+            f.write(gzip.compress(headers.encode("utf-8") + body + b"\r\n\r\n"))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from cs336_data.batch_tokenize import tokenize_file
+from cs336_data.token_shards import get_tokenizer
+
+
+@pytest.fixture(scope="module")
+def gpt2_tokenizer():
+    pytest.importorskip("transformers")
+    try:
+        return get_tokenizer()
+    except Exception:
+        pytest.skip("gpt2 tokenizer is not available")
+
+
+def write_documents(path, docs):
+    with open(path, "w") as f:
+        for doc in docs:
+            f.write(f"{doc}\nsecond line of {doc}<|endoftext|>\n")
+
+
+def test_second_run_only_encodes_changed_documents(gpt2_tokenizer, tmp_path):
+    docs = [f"document number {i}" for i in range(20)]
+    write_documents(tmp_path / "first.txt", docs)
+    changed = docs[:5] + ["a new document", "another new document"] + docs[7:]
+    write_documents(tmp_path / "second.txt", changed)
+    cache_dir = str(tmp_path / "cache")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "uncached").mkdir()
+
+    first = tokenize_file(str(tmp_path / "first.txt"), str(tmp_path / "out"), batch_lines=8, cache_dir=cache_dir)
+    assert first["cached_docs"] == 0
+    assert first["encoded_docs"] == 20
+
+    second = tokenize_file(str(tmp_path / "second.txt"), str(tmp_path / "out"), batch_lines=8, cache_dir=cache_dir)
+    assert second["cached_docs"] == 18
+    assert second["encoded_docs"] == 2
+
+    # cached ids are the same as encoding again
+    uncached = tokenize_file(str(tmp_path / "second.txt"), str(tmp_path / "uncached"), batch_lines=8)
+    assert uncached["encoded_docs"] == 20
+    ids = np.fromfile(tmp_path / "out" / "second.bin", dtype=np.uint16)
+    assert ids.tolist() == np.fromfile(tmp_path / "uncached" / "second.bin", dtype=np.uint16).tolist()
@@ -0,0 +1,26 @@
+import pytest
+
+from cs336_data.bpe import CachedBPE
+from .common import FIXTURES_PATH
+
+
+@pytest.fixture(scope="module")
+def gpt2_tokenizer():
+    transformers = pytest.importorskip("transformers")
+    try:
+        return transformers.AutoTokenizer.from_pretrained("gpt2")
+    except Exception:
+        pytest.skip("gpt2 tokenizer is not available")
+
+
+def test_cached_bpe_matches_gpt2(gpt2_tokenizer):
+    encoder = CachedBPE.from_pretrained(gpt2_tokenizer, cache_size=1024)
+    lines = []
+    for name in ["moby_extracted.txt", "low_quality_cc.txt", "high_quality_wiki_reference.txt"]:
+        with open(FIXTURES_PATH / name) as f:
+            lines.extend(f.readlines())
+    # lines of a filtered shard end with <|endoftext|>, and web text has all kinds of unicode
+    lines += ["last line of a document<|endoftext|>\n", "<|endoftext|><|endoftext|>", "  naïve café 日本語 😀\t\n\n", ""]
+
+    assert encoder(lines)["input_ids"] == gpt2_tokenizer(lines, verbose=False)["input_ids"]
+    assert encoder.cache_info().hits > 0
@@ -0,0 +1,61 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from cs336_data.build_train_bin import EOS_ID, TOKEN_BYTES, build_train_bin, copy_shard, manifest_path
+
+
+def write_shard(path, docs, index=False):
+    """uint16 shard of documents of token ids, each followed by EOS_ID, with a .bin.idx like TokenShardWriter"""
+    ids = np.array([i for doc in docs for i in doc + [EOS_ID]], dtype=np.uint16)
+    ids.tofile(path)
+    if index:
+        np.cumsum([0] + [len(doc) + 1 for doc in docs], dtype=np.int64).tofile(f"{path}.idx")
+    return ids
+
+
+def test_build_train_bin(tmp_path):
+    rng = np.random.default_rng(0)
+    shards = [
+        [rng.integers(0, EOS_ID, 50).tolist(), rng.integers(0, EOS_ID, 7).tolist()],
+        [],
+        [rng.integers(0, EOS_ID, n).tolist() for n in [1, 0, 300]],
+    ]
+    paths, expected = [], []
+    for i, docs in enumerate(shards):
+        path = str(tmp_path / f"shard{i}.bin")
+        expected.append(write_shard(path, docs, index=i == 0))
+        paths.append(path)
+    output_path = str(tmp_path / "train.bin")
+
+    manifest = build_train_bin(paths, output_path, n_procs=2)
+    ids = np.fromfile(output_path, dtype=np.uint16)
+    assert ids.tolist() == np.concatenate(expected).tolist()
+    assert manifest["tokens"] == len(ids)
+    assert manifest["docs"] == 5
+    assert [(shard["start"], shard["tokens"], shard["docs"]) for shard in manifest["shards"]] == \
+        [(0, 59, 2), (59, 0, 0), (59, 304, 3)]
+    with open(manifest_path(output_path)) as f:
+        assert json.load(f) == manifest
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    # done outputs are not built again
+    assert build_train_bin(paths[:1], output_path, n_procs=1) == manifest
+
+
+@pytest.mark.parametrize("fallback", [False, True])
+def test_copy_shard(tmp_path, monkeypatch, fallback):
+    if fallback:
+        # without copy_file_range, e.g. on macOS
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+    ids = write_shard(str(tmp_path / "shard.bin"), [list(range(1000))])
+    output_path = str(tmp_path / "train.bin")
+    with open(output_path, "wb") as f:
+        f.truncate((len(ids) + 20) * TOKEN_BYTES)
+
+    assert copy_shard((str(tmp_path / "shard.bin"), output_path, 10)) == len(ids) * TOKEN_BYTES
+    output = np.fromfile(output_path, dtype=np.uint16)
+    assert output[10:-10].tolist() == ids.tolist()
+    assert not output[:10].any() and not output[-10:].any()
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from cs336_data.checkpoint import RecordCheckpoint
+from cs336_data.first_filter import FilterConfig, iter_wet_records, process_single_wet_file
+from cs336_data.shards import ShardWriter, iter_documents, manifest_path
+from .common import FIXTURES_PATH, write_warc
+
+
+class Crash(Exception):
+    pass
+
+
+def copy_wet_file(input_path, output_path, crash_at=None):
+    """the checkpoint loop of process_single_wet_file, raising at record crash_at like a killed task"""
+    checkpoint = RecordCheckpoint(output_path, every=3)
+    checkpoint.load()
+    writers = {'text': ShardWriter(output_path, compression="gzip", max_docs=4,
+                                   resume_state=checkpoint.writer_state('text'))}
+    for i, text in iter_wet_records(input_path, checkpoint.next_record):
+        if checkpoint.should_save(i):
+            checkpoint.save(writers, i)
+        if i == crash_at:
+            raise Crash()
+        writers['text'].write(text)
+    writers['text'].close()
+    checkpoint.finish()
+
+
+def test_resume_after_crash(tmp_path):
+    texts = [f"document {i}" for i in range(20)]
+    write_warc(tmp_path / "in.warc.wet.gz", [(f"http://example.com/{i}", text) for i, text in enumerate(texts)])
+    input_path = str(tmp_path / "in.warc.wet.gz")
+    output_path = str(tmp_path / "out.txt")
+
+    # records 6 and 7 are written after the checkpoint at 6 and finish the second shard
+    with pytest.raises(Crash):
+        copy_wet_file(input_path, output_path, crash_at=8)
+    assert RecordCheckpoint(output_path, every=3).load()["next_record"] == 6
+    assert os.path.exists(tmp_path / "out_00001.txt.gz")
+    assert not os.path.exists(manifest_path(output_path))
+
+    copy_wet_file(input_path, output_path)
+    assert list(iter_documents(output_path)) == texts
+    assert not os.path.exists(f"{output_path}.ckpt")
+
+
+def filters_available(config):
+    import nltk
+
+    try:
+        nltk.tokenize.word_tokenize("a test")
+    except LookupError:
+        return False
+    return all(os.path.exists(path) for path in [config.language_filter, config.nsfw_filter, config.toxic_filter,
+                                                 config.quality_filter])
+
+
+def test_first_filter_resume_after_crash(tmp_path, monkeypatch):
+    config = FilterConfig(checkpoint_every=2, shard_max_docs=2)
+    if not filters_available(config):
+        pytest.skip("classifiers or nltk data are not available")
+    with open(FIXTURES_PATH / "high_quality_wiki_reference.txt") as f:
+        paragraphs = [paragraph for paragraph in f.read().split("\n\n") if paragraph.strip()]
+    write_warc(tmp_path / "in.warc.wet.gz", [(f"http://example.com/{i}", paragraph * 3)
+                                             for i, paragraph in enumerate(paragraphs[:12])])
+    input_path = str(tmp_path / "in.warc.wet.gz")
+
+    expected_path = str(tmp_path / "expected" / "out.txt")
+    process_single_wet_file(input_path, expected_path, str(tmp_path / "work"), config=config)
+
+    # kill the task at its third checkpoint
+    save = RecordCheckpoint.save
+    saves = []
+    def crashing_save(self, writers, next_record, **extra):
+        saves.append(next_record)
+        if len(saves) == 3:
+            raise Crash()
+        save(self, writers, next_record, **extra)
+    monkeypatch.setattr(RecordCheckpoint, "save", crashing_save)
+    output_path = str(tmp_path / "resumed" / "out.txt")
+    with pytest.raises(Crash):
+        process_single_wet_file(input_path, output_path, str(tmp_path / "work"), config=config)
+    monkeypatch.setattr(RecordCheckpoint, "save", save)
+
+    process_single_wet_file(input_path, output_path, str(tmp_path / "work"), config=config)
+    assert list(iter_documents(output_path)) == list(iter_documents(expected_path))
+    with open(output_path.replace(".txt", "_stats.json")) as f, open(expected_path.replace(".txt", "_stats.json")) as g:
+        assert f.read() == g.read()
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from cs336_data.docstore import STRING, DocStore, DocStoreWriter, docstore_complete
+
+COLUMNS = {"source": STRING, "record": "<i8", "score": "<f4"}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "out.docs")
+    writer = DocStoreWriter(path, columns=COLUMNS)
+    docs = ["first document", "", "naïve café 日本語", "last"]
+    for i, doc in enumerate(docs):
+        writer.write(doc, source=f"file{i % 2}.warc.wet.gz", record=10 * i, score=i / 4)
+    assert not docstore_complete(path)
+    assert writer.close() == path
+    assert docstore_complete(path)
+
+    store = DocStore(path)
+    assert len(store) == 4
+    assert list(store) == docs
+    assert store[-1] == "last"
+    with pytest.raises(IndexError):
+        store[4]
+    assert store.column("record").tolist() == [0, 10, 20, 30]
+    assert np.allclose(store.column("score"), [0, 0.25, 0.5, 0.75])
+    assert store.column("record")[1:3].tolist() == [10, 20]
+    assert [store.string("source", i) for i in range(4)] == ["file0.warc.wet.gz", "file1.warc.wet.gz"] * 2
+    assert store.lengths().tolist() == [len(doc.encode("utf-8")) for doc in docs]
+    with pytest.raises(ValueError):
+        store.column("source")
+    with pytest.raises(ValueError):
+        store.string("record", 0)
+
+
+def test_missing_metadata_and_empty_store(tmp_path):
+    writer = DocStoreWriter(str(tmp_path / "a.docs"), columns=COLUMNS)
+    writer.write("no metadata")
+    store = DocStore(writer.close())
+    assert store.column("record").tolist() == [0]
+    assert store.string("source", 0) == ""
+
+    store = DocStore(DocStoreWriter(str(tmp_path / "b.docs"), columns=COLUMNS).close())
+    assert len(store) == 0
+    assert list(store) == []
+    assert len(store.column("record")) == 0
+    assert len(store.lengths()) == 0
+
+
+def test_resume_state(tmp_path):
+    path = str(tmp_path / "out.docs")
+    writer = DocStoreWriter(path, columns=COLUMNS, tag="ckpt")
+    for i in range(3):
+        writer.write(f"doc {i}", source="a", record=i)
+    state = writer.checkpoint()
+    # written after the checkpoint and lost when the task is killed, which may have flushed them to disk
+    for i in range(3, 6):
+        writer.write(f"lost {i}", source="lost", record=-1)
+    for f in writer._files.values():
+        f.close()
+    assert not os.path.exists(path)
+
+    writer = DocStoreWriter(path, columns=COLUMNS, tag="ckpt", resume_state=state)
+    for i in range(3, 5):
+        writer.write(f"doc {i}", source="b", record=i)
+    store = DocStore(writer.close())
+    assert list(store) == [f"doc {i}" for i in range(5)]
+    assert store.column("record").tolist() == list(range(5))
+    assert [store.string("source", i) for i in range(5)] == ["a"] * 3 + ["b"] * 2
+    assert not os.path.exists(f"{path}.ckpt.tmp")
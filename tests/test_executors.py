@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("fasttext")
+
+from cs336_data import first_filter, second_filter
+from cs336_data.executors import InProcessExecutor
+
+
+@pytest.fixture
+def executor_calls(monkeypatch):
+    calls = []
+
+    def get_executor(backend, n_workers, **kwargs):
+        calls.append((backend, n_workers, kwargs))
+        return InProcessExecutor()
+
+    monkeypatch.setattr(first_filter, "get_executor", get_executor)
+    monkeypatch.setattr(second_filter, "get_executor", get_executor)
+    return calls
+
+
+def test_run_first_filter_passes_slurm_params(executor_calls, tmp_path):
+    first_filter.run_first_filter([], str(tmp_path / "out"), str(tmp_path / "work"), backend="inprocess",
+                                  n_workers=1, mem_gb=16, timeout_min=120)
+    assert executor_calls == [("inprocess", 1, {"cpus_per_task": 1, "mem_gb": 16, "timeout_min": 120})]
+
+
+def test_run_second_filter_passes_slurm_params(executor_calls, tmp_path):
+    config = second_filter.PalomaConfig(paloma_cutoff=0.5)
+    second_filter.run_second_filter([], str(tmp_path / "out"), config=config, backend="inprocess",
+                                    n_workers=1, mem_gb=16)
+    assert executor_calls == [("inprocess", 1, {"mem_gb": 16})]
@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from fastwarc.stream_io import FileStream, GZipStream
+from fastwarc.warc import ArchiveIterator, WarcRecordType
+
+from cs336_data.fetch import fetch_urls
+from cs336_data.url import download_batch
+
+
+class Handler(BaseHTTPRequestHandler):
+    in_flight = 0
+    max_in_flight = 0
+    flaky_calls = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with Handler.lock:
+            Handler.in_flight += 1
+            Handler.max_in_flight = max(Handler.max_in_flight, Handler.in_flight)
+        try:
+            if self.path.startswith("/page/"):
+                time.sleep(0.05)
+                body = f"<html><body><p>page {self.path[6:]}</p></body></html>".encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/flaky":
+                # unavailable the first time
+                Handler.flaky_calls += 1
+                if Handler.flaky_calls == 1:
+                    self.send_error(503)
+                else:
+                    self.send_response(200)
+                    self.send_header("Content-Length", "5")
+                    self.end_headers()
+                    self.wfile.write(b"flaky")
+            elif self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "/page/redirected")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.send_error(404)
+        finally:
+            with Handler.lock:
+                Handler.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Handler.in_flight = Handler.max_in_flight = Handler.flaky_calls = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read_warc(path):
+    records = {}
+    for record in ArchiveIterator(GZipStream(FileStream(str(path), "rb")), record_types=WarcRecordType.response):
+        records[record.headers["WARC-Target-URI"]] = (record.http_headers.status_code, record.reader.read())
+    return records
+
+
+def read_warc_bytes(data, tmp_path):
+    path = tmp_path / "member.warc.gz"
+    path.write_bytes(data)
+    return read_warc(path)
+
+
+def test_fetch_urls_writes_warc(server, tmp_path):
+    urls = [f"{server}/page/{i}" for i in range(10)] + [f"{server}/missing", f"{server}/redirect"]
+    stats = fetch_urls(urls, str(tmp_path / "batch.warc.gz"), log_path=str(tmp_path / "batch.log"), rate=None)
+
+    assert stats["status_codes"] == {200: 11, 404: 1}
+    assert stats["errors"] == 0
+    assert stats["bytes"] > 0 and stats["bytes_per_second"] > 0
+
+    records = read_warc(tmp_path / "batch.warc.gz")
+    assert len(records) == 12
+    assert records[f"{server}/page/3"] == (200, b"<html><body><p>page 3</p></body></html>")
+    # redirects are recorded under the url they ended at
+    assert records[f"{server}/page/redirected"][0] == 200
+    assert records[f"{server}/missing"][0] == 404
+    assert len((tmp_path / "batch.log").read_text().splitlines()) == 12
+
+
+def test_fetch_urls_limits(server, tmp_path):
+    urls = [f"{server}/page/{i}" for i in range(10)]
+    start = time.time()
+    stats = fetch_urls(urls, str(tmp_path / "batch.warc.gz"), per_host=2, rate=20.0)
+    assert stats["status_codes"] == {200: 10}
+    assert Handler.max_in_flight <= 2
+    # 10 request starts spaced 1/20 s apart
+    assert time.time() - start >= 9 / 20
+
+
+def test_fetch_urls_errors(tmp_path):
+    # nothing listens on port 9 of localhost, and the second url has no host
+    stats = fetch_urls(["http://127.0.0.1:9/page", "not a url"], str(tmp_path / "batch.warc.gz"),
+                       tries=2, rate=None)
+    assert stats["errors"] == 2
+    assert stats["responses"] == 0
+    assert read_warc(tmp_path / "batch.warc.gz") == {}
+
+
+def test_download_batch_async(server, tmp_path):
+    batch_file = tmp_path / "batch_0000.txt"
+    batch_file.write_text("".join(f"{server}/page/{i}\n" for i in range(5)))
+    status = download_batch(str(batch_file), str(tmp_path / "scraped"), fetcher="async")
+    assert status.startswith("SUCCESS")
+    assert len(read_warc(tmp_path / "scraped" / "batch_0000.warc.gz")) == 5
+    with open(tmp_path / "scraped" / "batch_0000.json") as f:
+        assert json.load(f)["status_codes"] == {"200": 5}
+
+    batch_file.write_text(f"{server}/page/0\n{server}/missing\n")
+    assert download_batch(str(batch_file), str(tmp_path / "scraped"), fetcher="async").startswith("PARTIAL")
+
+
+def test_download_batch_resume(server, tmp_path):
+    batch_file = tmp_path / "batch_0000.txt"
+    batch_file.write_text(f"{server}/page/0\n{server}/flaky\n{server}/missing\n")
+    output_dir = tmp_path / "scraped"
+    assert download_batch(str(batch_file), str(output_dir), fetcher="async").startswith("PARTIAL")
+    manifest = [json.loads(line) for line in (output_dir / "batch_0000.manifest.jsonl").read_text().splitlines()]
+    assert sorted(entry["status"] for entry in manifest) == [200, 404, 503]
+    entry = next(entry for entry in manifest if entry["url"] == f"{server}/page/0")
+    with open(output_dir / entry["warc"], "rb") as f:
+        f.seek(entry["offset"])
+        member = f.read(entry["length"])
+    assert read_warc_bytes(member, tmp_path) == {f"{server}/page/0": (200, b"<html><body><p>page 0</p></body></html>")}
+
+    # a killed rerun left half a record and half a manifest line
+    with open(output_dir / "batch_0000.warc.gz", "ab") as f:
+        f.write(b"\x1f\x8b\x08garbage")
+    with open(output_dir / "batch_0000.manifest.jsonl", "a") as f:
+        f.write('{"url": "')
+
+    # only the 503 is fetched again, into a new segment
+    assert download_batch(str(batch_file), str(output_dir), fetcher="async").startswith("PARTIAL")
+    assert Handler.flaky_calls == 2
+    assert read_warc(output_dir / "batch_0000.1.warc.gz") == {f"{server}/flaky": (200, b"flaky")}
+    assert len(read_warc(output_dir / "batch_0000.warc.gz")) == 3
+    with open(output_dir / "batch_0000.json") as f:
+        assert json.load(f)["status_codes"] == {"200": 2, "404": 1}
+
+    # nothing left to fetch
+    download_batch(str(batch_file), str(output_dir), fetcher="async")
+    assert Handler.flaky_calls == 2
+    assert not (output_dir / "batch_0000.2.warc.gz").exists()
+
+
+def test_stream_urls_to_fasttext(server, tmp_path):
+    from cs336_data.process import stream_urls_to_fasttext
+
+    batch_files = []
+    for b in range(2):
+        batch_file = tmp_path / f"batch_{b:04d}.txt"
+        batch_file.write_text("".join(f"{server}/page/batch{b}-url{i}\n" for i in range(20)))
+        batch_files.append(str(batch_file))
+    output_file = tmp_path / "positive.txt"
+
+    written = stream_urls_to_fasttext(batch_files, str(tmp_path / "scraped"), str(output_file), ["high-quality"],
+                                      max_lines=5, n_workers=2, filter_content=False, n_batches=1)
+    lines = output_file.read_text().splitlines()
+    assert written == len(lines) == 5
+    assert all(line.startswith("__label__high-quality page batch0-") for line in lines)
+    # the budget was reached in the first batch, the second one was never fetched
+    assert (tmp_path / "scraped" / "batch_0000.manifest.jsonl").exists()
+    assert not (tmp_path / "scraped" / "batch_0001.manifest.jsonl").exists()
+
+
+def test_stream_fetches_batches_concurrently(server, tmp_path):
+    from cs336_data.process import stream_urls_to_fasttext
+
+    # batches grouped by domain, two requests at a time per host
+    port = server.rsplit(":", 1)[1]
+    batch_files = []
+    for i, host in enumerate(["127.0.0.1", "localhost"]):
+        batch_file = tmp_path / f"batch_{i}.txt"
+        batch_file.write_text("".join(f"http://{host}:{port}/page/batch{i}-url{j}\n" for j in range(10)))
+        batch_files.append(str(batch_file))
+    output_file = tmp_path / "stream.txt"
+
+    written = stream_urls_to_fasttext(batch_files, str(tmp_path / "download"), str(output_file), ["high-quality"],
+                                      max_lines=100, n_workers=2, filter_content=False, n_batches=2)
+    lines = output_file.read_text().splitlines()
+    assert written == len(lines) == 20
+    assert sorted(line.split()[-1] for line in lines) == sorted(f"batch{i}-url{j}" for i in range(2) for j in range(10))
+    # both batches were fetched at the same time
+    assert Handler.max_in_flight > 2
@@ -0,0 +1,24 @@
+from cs336_data.gopher import GopherFilter
+
+
+def make_stats(**overrides):
+    stats = {"n_words": 100, "mean_word_length": 5.0, "ellipsis_frac": 0.0, "alpha_count": 100, "alpha_frac": 1.0,
+             "bullet_point_frac": 0.0, "stop_word_count": 10}
+    stats.update(overrides)
+    return stats
+
+
+def test_passes_and_single_rules_share_thresholds(monkeypatch):
+    gopher = GopherFilter()
+    lines = ["a line ..."] * 3 + ["a line"] * 7
+    tokens = ["word"] * 60
+    assert gopher.passes(make_stats(ellipsis_frac=0.3)) and GopherFilter.ellipsis_filter(lines)
+    assert gopher.passes(make_stats(alpha_count=60)) and GopherFilter.word_alphabet_filter(tokens)
+    assert not gopher.passes(make_stats(mean_word_length=2.5))
+    assert not GopherFilter.mean_length_filter(["ab", "abc"])
+
+    monkeypatch.setattr(GopherFilter, "max_ellipsis_frac", 0.2)
+    monkeypatch.setattr(GopherFilter, "min_words", 70)
+    assert not gopher.passes(make_stats(ellipsis_frac=0.3)) and not GopherFilter.ellipsis_filter(lines)
+    assert not gopher.passes(make_stats(alpha_count=60)) and not GopherFilter.word_alphabet_filter(tokens)
+    assert not GopherFilter.length_filter(tokens)
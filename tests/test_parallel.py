@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from cs336_data.parallel import ordered_pool_map
+
+
+def slow_square(x):
+    # uneven latency, so batches finish out of order
+    time.sleep(0.02 * (x % 3 == 0) + 0.001 * (7 - x % 7))
+    return x * x
+
+
+def fail_on_13(x):
+    if x == 13:
+        raise ValueError("bad item 13")
+    return x
+
+
+def test_results_in_input_order():
+    results = list(ordered_pool_map(lambda: ((i, i) for i in range(5, 105)), slow_square, n_procs=3, start=5,
+                                    batch_size=4, queue_size=2))
+    assert results == [(i, i * i) for i in range(5, 105)]
+
+
+def test_worker_error_propagates():
+    with pytest.raises(RuntimeError, match="bad item 13"):
+        list(ordered_pool_map(lambda: ((i, i) for i in range(100)), fail_on_13, n_procs=2, batch_size=4))
+
+
+def test_reader_error_propagates():
+    def produce():
+        yield 0, 0
+        raise OSError("truncated input")
+
+    with pytest.raises(RuntimeError, match="truncated input"):
+        list(ordered_pool_map(produce, slow_square, n_procs=2))
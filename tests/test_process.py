@@ -0,0 +1,49 @@
+import os
+
+from cs336_data.process import WarcToFastTextConverter
+from .common import write_warc
+
+
+def write_html_warcs(tmp_path, n_files=3, n_pages=20):
+    paths = []
+    for i in range(n_files):
+        records = []
+        for j in range(n_pages):
+            html = f"<html><body><p>file{i} page{j} has enough words to keep</p></body></html>"
+            records.append((f"http://example{i}.com/{j}",
+                            f"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n\r\n{html}"))
+        path = tmp_path / f"file{i}.warc.gz"
+        write_warc(path, records, warc_type="response", content_type="application/http; msgtype=response")
+        paths.append(str(path))
+    return paths
+
+
+def convert(warc_files, output_file, max_lines=None, n_procs=2):
+    with WarcToFastTextConverter(output_file, ["hq"], max_lines=max_lines, load_filters=False) as converter:
+        converter.process_warc_files(warc_files, filter_content=False, n_procs=n_procs)
+    with open(output_file) as f:
+        return converter, f.read().splitlines()
+
+
+def test_parallel_merges_every_line_once(tmp_path):
+    warc_files = write_html_warcs(tmp_path)
+    output_file = str(tmp_path / "train.txt")
+    with open(output_file, "w") as f:
+        f.write("__label__hq an earlier line\n")
+
+    converter, lines = convert(warc_files, output_file)
+    assert lines[0] == "__label__hq an earlier line"
+    assert sorted(lines[1:]) == sorted(f"__label__hq file{i} page{j} has enough words to keep"
+                                       for i in range(3) for j in range(20))
+    assert converter.lines_written == 60
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_parallel_stops_at_max_lines(tmp_path):
+    warc_files = write_html_warcs(tmp_path)
+    converter, lines = convert(warc_files, str(tmp_path / "train.txt"), max_lines=25, n_procs=3)
+    assert len(lines) == 25
+    assert len(set(lines)) == 25
+    assert all(line.startswith("__label__hq file") for line in lines)
+    assert converter.lines_written == 25
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
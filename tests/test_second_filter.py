@@ -0,0 +1,118 @@
+import os
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fasttext")
+
+from cs336_data.second_filter import (PALOMA_SCORE_DTYPE, PalomaConfig, global_paloma_cutoff, run_second_filter,
+                                      scores_current, select_documents, sketch_path)
+from cs336_data.shards import iter_documents, list_shards, manifest_path
+from cs336_data.sketch import KLLSketch, merge_sketches
+from cs336_data.utils import classifier_meta
+
+
+def test_scores_current_checks_the_classifier(tmp_path):
+    classifier = tmp_path / "paloma.bin"
+    classifier.write_bytes(b"model")
+    other = tmp_path / "paloma_v2.bin"
+    other.write_bytes(b"model")
+    config = PalomaConfig(paloma_filter=str(classifier))
+    output_path = str(tmp_path / "out_paloma.txt")
+    assert not scores_current(output_path, config)
+
+    sketch = KLLSketch(k=8)
+    sketch.update([0.1, 0.2, 0.3])
+    sketch.meta = classifier_meta(str(classifier))
+    sketch.save(sketch_path(output_path))
+    assert scores_current(output_path, config)
+    assert not scores_current(output_path, PalomaConfig(paloma_filter=str(other)))
+
+    # retrained in place
+    stat = os.stat(classifier)
+    os.utime(classifier, (stat.st_atime, stat.st_mtime + 60))
+    assert not scores_current(output_path, config)
+
+
+def test_select_documents():
+    scores = np.zeros(5, dtype=PALOMA_SCORE_DTYPE)
+    scores["is_paloma"] = [True, False, False, False, False]
+    scores["conf"] = [0.9, 0.1, 0.2, 0.3, 0.4]
+    assert select_documents(scores, PalomaConfig(paloma_cutoff=0.15)).tolist() == [True, True, False, False, False]
+    # without a cutoff, the percentile of the file: the median is 0.3
+    assert select_documents(scores, PalomaConfig(paloma_percentile=50)).tolist() == [True, True, True, False, False]
+    assert len(select_documents(scores[:0], PalomaConfig())) == 0
+
+
+@pytest.fixture
+def paloma_inputs(tmp_path):
+    import fasttext
+
+    rng = np.random.default_rng(0)
+    paloma_words = [f"paloma{i}" for i in range(50)]
+    cc_words = [f"cc{i}" for i in range(50)]
+    train_file = tmp_path / "paloma.train"
+    with open(train_file, "w") as f:
+        for i in range(500):
+            label, words = ("paloma", paloma_words) if i % 2 == 0 else ("cc", cc_words)
+            f.write(f"__label__{label} {' '.join(rng.choice(words, 10))}\n")
+    classifier = str(tmp_path / "paloma.bin")
+    fasttext.train_supervised(input=str(train_file), epoch=5, dim=10, bucket=1000, thread=1, verbose=0).save_model(classifier)
+
+    inputs = []
+    for name in ["a", "b"]:
+        path = tmp_path / f"{name}.txt"
+        with open(path, "w") as f:
+            for i in range(40):
+                # mostly cc words, the share of paloma words spreads the confidences
+                words = list(rng.choice(cc_words, 10)) + list(rng.choice(paloma_words, i % 5))
+                f.write(f"{name}{i} {' '.join(words)}<|endoftext|>\n")
+        inputs.append(str(path))
+    return classifier, inputs
+
+
+def read_output(output_path):
+    return sorted(doc.split()[0] for doc in iter_documents(output_path))
+
+
+def test_rerun_redoes_deleted_and_stale_outputs(paloma_inputs, tmp_path):
+    classifier, inputs = paloma_inputs
+    output_dir = str(tmp_path / "out")
+    config = PalomaConfig(paloma_filter=classifier, paloma_percentile=50.0, output_compression=None)
+    run_second_filter(inputs, output_dir, config=config, backend="inprocess", n_workers=1)
+    output_path = os.path.join(output_dir, "a_paloma.txt")
+    kept = read_output(output_path)
+    assert 0 < len(kept) < 40
+
+    # a deleted output is written again
+    for shard in list_shards(output_path):
+        os.remove(shard)
+    os.remove(manifest_path(output_path))
+    run_second_filter(inputs, output_dir, config=config, backend="inprocess", n_workers=1)
+    assert read_output(output_path) == kept
+
+    # so is one made with another percentile
+    config = replace(config, paloma_percentile=100.0)
+    run_second_filter(inputs, output_dir, config=config, backend="inprocess", n_workers=1)
+    assert len(read_output(output_path)) > len(kept)
+
+
+def test_global_cutoff_without_documents(tmp_path):
+    inputs = []
+    for name in ["a", "b"]:
+        path = tmp_path / f"{name}.txt"
+        path.write_text("")
+        inputs.append(str(path))
+    output_dir = str(tmp_path / "out")
+    # the classifier is never loaded without documents
+    config = PalomaConfig(paloma_filter=str(tmp_path / "paloma.bin"), output_compression=None)
+    run_second_filter(inputs, output_dir, config=config, backend="inprocess", n_workers=1)
+    for name in ["a", "b"]:
+        assert read_output(os.path.join(output_dir, f"{name}_paloma.txt")) == []
+    assert global_paloma_cutoff([sketch_path(os.path.join(output_dir, "a_paloma.txt"))], 50.0) == 0.0
+
+    # nothing to merge without files
+    run_second_filter([], output_dir, config=config, backend="inprocess", n_workers=1)
+    with pytest.raises(ValueError):
+        merge_sketches([])
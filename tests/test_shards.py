@@ -0,0 +1,109 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from cs336_data.shards import (EOT, ZSTD_AVAILABLE, ShardWriter, iter_documents, list_shards, load_index,
+                               manifest_path, open_shard)
+
+COMPRESSIONS = [None, "gzip", pytest.param("zstd", marks=pytest.mark.skipif(not ZSTD_AVAILABLE, reason="no zstandard"))]
+
+
+def read_shard(path):
+    with open_shard(path) as f:
+        return f.read()
+
+
+def test_rollover_by_docs(tmp_path):
+    writer = ShardWriter(str(tmp_path / "out.txt"), max_docs=3)
+    docs = [f"doc {i}" for i in range(7)]
+    for doc in docs:
+        writer.write(doc)
+    with open(writer.close()) as f:
+        manifest = json.load(f)
+    assert [shard["docs"] for shard in manifest["shards"]] == [3, 3, 1]
+    assert manifest["docs"] == 7
+    assert [os.path.basename(path) for path in list_shards(str(tmp_path / "out.txt"))] == \
+        ["out_00000.txt", "out_00001.txt", "out_00002.txt"]
+    assert list(iter_documents(str(tmp_path / "out.txt"))) == docs
+
+
+def test_rollover_by_bytes_drops_empty_last_shard(tmp_path):
+    writer = ShardWriter(str(tmp_path / "out.txt"), compression="gzip", max_bytes=20)
+    # each document is 10 + len(EOT) + 1 bytes, so every one fills a shard
+    docs = [f"document {i}" for i in range(4)]
+    for doc in docs:
+        writer.write(doc)
+    writer.close()
+    shards = list_shards(str(tmp_path / "out.txt"))
+    assert len(shards) == 4
+    assert all(path.endswith(".txt.gz") for path in shards)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    assert list(iter_documents(str(tmp_path / "out.txt"))) == docs
+
+
+def test_index_offsets(tmp_path):
+    writer = ShardWriter(str(tmp_path / "out.txt"), compression="gzip", buffer_size=16)
+    docs = ["a", "naïve café", "", "last"]
+    for doc in docs:
+        writer.write(doc)
+    writer.close()
+    shard_path = str(tmp_path / "out.txt.gz")
+    data = read_shard(shard_path)
+    offsets = load_index(shard_path)
+    assert len(offsets) == len(docs) + 1
+    assert offsets[-1] == len(data)
+    assert [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])] == \
+        [f"{doc}{EOT}\n" for doc in docs]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_streams_end_at_checkpoints(tmp_path, compression):
+    writer = ShardWriter(str(tmp_path / "out.txt"), compression=compression, tag="ckpt")
+    writer.write("first")
+    state = writer.checkpoint()
+    writer.write("second")
+    writer.checkpoint()
+    tmp_shard = writer._tmp_path
+
+    # everything up to a checkpoint decompresses on its own
+    with open(tmp_shard, "rb") as f:
+        committed = f.read(state["offset"])
+    if compression == "gzip":
+        committed = gzip.decompress(committed)
+    elif compression == "zstd":
+        import zstandard
+        committed = zstandard.ZstdDecompressor().decompressobj().decompress(committed)
+    assert committed == f"first{EOT}\n".encode("utf-8")
+    assert state["uncompressed"] == len(committed)
+
+    writer.close()
+    assert list(iter_documents(str(tmp_path / "out.txt"))) == ["first", "second"]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_resume_state(tmp_path, compression):
+    output_path = str(tmp_path / "out.txt")
+    writer = ShardWriter(output_path, compression=compression, max_docs=2)
+    for i in range(3):
+        writer.write(f"doc {i}")
+    state = writer.checkpoint()
+    # lost when the task is killed, including a shard finished after the checkpoint
+    for i in range(3, 6):
+        writer.write(f"lost {i}")
+    writer._end_stream()
+    # a killed task may have flushed them to disk
+    writer._raw.close()
+    writer._idx.close()
+    assert os.path.exists(writer.shard_path(1))
+
+    writer = ShardWriter(output_path, compression=compression, max_docs=2, resume_state=state)
+    for i in range(3, 5):
+        writer.write(f"doc {i}")
+    writer.close()
+    assert list(iter_documents(output_path)) == [f"doc {i}" for i in range(5)]
+    with open(manifest_path(output_path)) as f:
+        assert [shard["docs"] for shard in json.load(f)["shards"]] == [2, 2, 1]
+    for shard_path in list_shards(output_path):
+        assert load_index(shard_path)[-1] == len(read_shard(shard_path))
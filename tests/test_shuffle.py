@@ -0,0 +1,28 @@
+from collections import Counter
+
+from cs336_data.shuffle import shuffle_and_split
+
+
+def test_shuffle_and_split(tmp_path):
+    positive = tmp_path / "positive.txt"
+    negative = tmp_path / "negative.txt"
+    positive.write_text("".join(f"__label__high-quality doc {i}\n" for i in range(100)))
+    negative.write_text("".join(f"__label__low-quality doc {i}\n" for i in range(300)) + "\n")
+    train, valid = tmp_path / "train.txt", tmp_path / "valid.txt"
+
+    # tiny buckets, so lines are scattered over several of them
+    stats = shuffle_and_split([str(positive), str(negative)], str(train), str(valid), valid_fraction=0.2,
+                              max_ratio=1.5, bucket_bytes=1024)
+    assert stats["buckets"]["train"] > 1
+    train_lines, valid_lines = train.read_text().splitlines(), valid.read_text().splitlines()
+    assert Counter(line.split()[0] for line in train_lines) == {"__label__high-quality": 80, "__label__low-quality": 120}
+    assert Counter(line.split()[0] for line in valid_lines) == {"__label__high-quality": 20, "__label__low-quality": 30}
+    # every line once, and not in input order
+    assert len(set(train_lines) | set(valid_lines)) == 250
+    assert train_lines != sorted(train_lines, key=lambda line: (line.split()[0], int(line.split()[-1])))
+    assert not list(tmp_path.glob("shuffle-*"))
+
+    # same seed, same output
+    shuffle_and_split([str(positive), str(negative)], str(tmp_path / "train2.txt"), str(tmp_path / "valid2.txt"),
+                      valid_fraction=0.2, max_ratio=1.5, bucket_bytes=1024)
+    assert (tmp_path / "train2.txt").read_text() == train.read_text()
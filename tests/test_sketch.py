@@ -0,0 +1,41 @@
+import numpy as np
+
+from cs336_data.sketch import KLLSketch, merge_sketches
+
+K = 200
+# rank error of roughly 1.7 / k, with some slack for the randomness of compaction
+RANK_ERROR = 3 / K
+
+
+def test_merged_sketch_percentiles(tmp_path):
+    rng = np.random.default_rng(0)
+    parts = [rng.normal(loc, 1.0, size) for loc, size in [(0.0, 20000), (2.0, 5000), (-1.0, 40000), (5.0, 100)]]
+    paths = []
+    for i, part in enumerate(parts):
+        sketch = KLLSketch(k=K, seed=i)
+        # in chunks, as the second pass updates it
+        for chunk in np.array_split(part, 7):
+            sketch.update(chunk)
+        path = str(tmp_path / f"{i}.sketch.json")
+        sketch.save(path)
+        paths.append(path)
+
+    merged = merge_sketches(paths)
+    values = np.sort(np.concatenate(parts))
+    assert merged.n == len(values)
+    for p in [0.5, 1, 10, 25, 50, 75, 90, 99, 99.5]:
+        estimate = merged.percentile(p)
+        rank = np.searchsorted(values, estimate) / len(values)
+        assert abs(rank - p / 100) <= RANK_ERROR, (p, estimate, np.percentile(values, p))
+
+
+def test_sketch_round_trip(tmp_path):
+    sketch = KLLSketch(k=16, seed=0)
+    sketch.update(np.arange(1000))
+    sketch.meta = {"classifier": "paloma.bin"}
+    path = str(tmp_path / "a.sketch.json")
+    sketch.save(path)
+    loaded = KLLSketch.load(path)
+    assert loaded.n == 1000
+    assert loaded.meta == sketch.meta
+    assert loaded.percentile(50) == sketch.percentile(50)
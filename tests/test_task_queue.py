@@ -0,0 +1,111 @@
+import os
+import time
+
+from cs336_data.task_queue import SQLiteTaskQueue, run_queue_worker
+
+LEASE = 0.05
+
+
+def expire():
+    time.sleep(LEASE * 2)
+
+
+def test_expired_lease_is_handed_out_again(tmp_path):
+    queue = SQLiteTaskQueue(str(tmp_path / "tasks.sqlite"), lease_seconds=LEASE, speculative=False)
+    assert queue.add_tasks([{"i": 0}, {"i": 1}]) == 2
+    assert queue.add_tasks([{"i": 0}]) == 0
+
+    task = queue.acquire("a")
+    assert task.payload == {"i": 0} and not task.speculative
+    other = queue.acquire("b")
+    assert other.payload == {"i": 1}
+    assert queue.acquire("c") is None
+
+    # worker a died while b is alive and renews its lease, a's task goes to the next worker that asks
+    expire()
+    queue.renew(other, "b")
+    retried = queue.acquire("c")
+    assert retried.task_id == task.task_id and not retried.speculative
+    # the dead worker's copy is no longer responsible for the task
+    queue.fail(task, "a")
+    assert queue.counts() == {"leased": 2}
+
+
+def test_retries_are_exhausted(tmp_path):
+    queue = SQLiteTaskQueue(str(tmp_path / "tasks.sqlite"), lease_seconds=LEASE, max_attempts=2)
+    queue.add_tasks([{"i": 0}])
+
+    # two workers in a row die on the task without failing it
+    assert queue.acquire("a") is not None
+    expire()
+    assert queue.acquire("b") is not None
+    expire()
+    # out of attempts: not leased again, not even speculatively
+    assert queue.acquire("c") is None
+    assert queue.counts() == {"failed": 1}
+
+    # a new run retries it with fresh attempts
+    assert queue.add_tasks([{"i": 0}]) == 1
+    assert queue.counts() == {"pending": 1}
+    assert queue.acquire("d").payload == {"i": 0}
+
+
+def test_failed_attempts(tmp_path):
+    queue = SQLiteTaskQueue(str(tmp_path / "tasks.sqlite"), max_attempts=2)
+    queue.add_tasks([{"i": 0}])
+    queue.fail(queue.acquire("a"), "a")
+    assert queue.counts() == {"pending": 1}
+    queue.fail(queue.acquire("a"), "a")
+    assert queue.counts() == {"failed": 1}
+
+
+def test_speculative_completion(tmp_path):
+    queue = SQLiteTaskQueue(str(tmp_path / "tasks.sqlite"))
+    queue.add_tasks([{"i": 0}])
+    original = queue.acquire("a")
+    backup = queue.acquire("b")
+    assert backup.task_id == original.task_id and backup.speculative
+    # only one backup copy per task
+    assert queue.acquire("c") is None
+
+    # a failing backup leaves the task to its lease holder
+    queue.fail(backup, "b")
+    assert queue.counts() == {"leased": 1}
+    # whichever copy finishes first completes the task
+    assert queue.complete(backup)
+    assert not queue.complete(original)
+    assert queue.counts() == {"done": 1}
+
+
+def test_run_queue_worker(tmp_path):
+    db_path = str(tmp_path / "tasks.sqlite")
+    queue = SQLiteTaskQueue(db_path, max_attempts=2)
+    queue.add_tasks([{"i": i} for i in range(4)])
+
+    def process(payload, speculative):
+        if payload["i"] == 3:
+            raise ValueError("bad task")
+        return payload["i"]
+
+    assert sorted(run_queue_worker(db_path, process, worker_id="a", max_attempts=2)) == [0, 1, 2]
+    assert queue.counts() == {"done": 3, "failed": 1}
+
+
+def test_done_tasks_with_missing_outputs_are_queued_again(tmp_path):
+    queue = SQLiteTaskQueue(str(tmp_path / "tasks.sqlite"))
+    outputs = {0: tmp_path / "0.txt", 1: tmp_path / "1.txt"}
+    tasks = [{"i": i, "output_path": str(path)} for i, path in outputs.items()]
+    queue.add_tasks(tasks)
+    while (task := queue.acquire("a")) is not None:
+        outputs[task.payload["i"]].write_text("done")
+        queue.complete(task)
+
+    def is_complete(payload):
+        return os.path.exists(payload["output_path"])
+
+    assert queue.add_tasks(tasks, is_complete=is_complete) == 0
+    outputs[1].unlink()
+    assert queue.add_tasks(tasks, is_complete=is_complete) == 1
+    task = queue.acquire("a")
+    assert task.payload["i"] == 1 and task.payload["output_path"] == str(outputs[1])
+    assert queue.counts() == {"done": 1, "leased": 1}
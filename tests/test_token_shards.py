@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+from cs336_data.bpe import CachedBPE, bytes_to_unicode
+from cs336_data.shards import EOT
+from cs336_data.token_shards import TokenShardWriter, load_token_index
+
+
+def byte_tokenizer():
+    """byte-level BPE without merges, the ids of a text are its utf-8 bytes"""
+    vocab = {char: b for b, char in bytes_to_unicode().items()}
+    return CachedBPE(vocab, [], {EOT: 256})
+
+
+def expected_ids(doc):
+    return list(doc.encode("utf-8")) + [256]
+
+
+def test_index_offsets(tmp_path):
+    docs = ["first document", "", "naïve café", "last"]
+    output_path = str(tmp_path / "out.bin")
+    writer = TokenShardWriter(output_path, tokenizer=byte_tokenizer(), batch_size=3)
+    for doc in docs:
+        writer.write(doc)
+    assert writer.close() == output_path
+
+    ids = np.fromfile(output_path, dtype=np.uint16)
+    offsets = load_token_index(output_path)
+    assert len(offsets) == len(docs) + 1
+    assert offsets[-1] == len(ids)
+    assert [ids[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])] == \
+        [expected_ids(doc) for doc in docs]
+
+
+def test_resume_state(tmp_path):
+    output_path = str(tmp_path / "out.bin")
+    writer = TokenShardWriter(output_path, tokenizer=byte_tokenizer(), batch_size=2, tag="ckpt")
+    for i in range(3):
+        writer.write(f"doc {i}")
+    state = writer.checkpoint()
+    # encoded after the checkpoint and lost when the task is killed
+    for i in range(3, 6):
+        writer.write(f"lost {i}")
+    writer._encode_pending()
+    # a killed task may have flushed them to disk
+    writer._bin.close()
+    writer._idx.close()
+    assert not os.path.exists(output_path)
+
+    writer = TokenShardWriter(output_path, tokenizer=byte_tokenizer(), batch_size=2, tag="ckpt", resume_state=state)
+    for i in range(3, 5):
+        writer.write(f"doc {i}")
+    writer.close()
+    ids = np.fromfile(output_path, dtype=np.uint16).tolist()
+    assert ids == [i for j in range(5) for i in expected_ids(f"doc {j}")]
+    assert load_token_index(output_path).tolist() == [0, 6, 12, 18, 24, 30]
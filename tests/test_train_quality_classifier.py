@@ -0,0 +1,55 @@
+import json
+import os
+import random
+
+import pytest
+
+pytest.importorskip("fasttext")
+
+from cs336_data.train_quality_classifier import train_quality_classifier
+
+# bigrams and a small hash table, quantization needs at least 256 rows but the default bucket makes a ~760MB model
+SWEEP = [
+    {"wordNgrams": 2, "dim": 10, "lr": 0.5, "epoch": 5, "bucket": 5000, "seed": 0},
+    {"wordNgrams": 2, "dim": 10, "lr": 1.0, "epoch": 20, "bucket": 5000, "seed": 1},
+]
+
+
+def write_examples(path, n, rng):
+    high = [f"good{i}" for i in range(300)]
+    low = [f"bad{i}" for i in range(300)]
+    shared = [f"word{i}" for i in range(300)]
+    with open(path, "w") as f:
+        for i in range(n):
+            label, words = ("high-quality", high) if i % 2 == 0 else ("low-quality", low)
+            text = rng.sample(words, 8) + rng.sample(shared, 8)
+            rng.shuffle(text)
+            f.write(f"__label__{label} {' '.join(text)}\n")
+
+
+def test_train_quality_classifier(tmp_path):
+    rng = random.Random(0)
+    train_file, valid_file = str(tmp_path / "quality.train"), str(tmp_path / "quality.valid")
+    write_examples(train_file, 2000, rng)
+    write_examples(valid_file, 200, rng)
+    output_path = str(tmp_path / "models" / "quality.bin")
+
+    report = train_quality_classifier(train_file, valid_file, output_path, sweep=SWEEP, n_procs=2,
+                                      quantize=True, cutoff=1000)
+
+    assert len(report["sweep"]) == len(SWEEP)
+    best = max(report["sweep"], key=lambda result: result["valid_accuracy"])
+    assert report["best"] == best["trained"]
+    assert best["trained"]["bucket"] == 5000
+    bin_model, ftz_model = report["models"]
+    assert bin_model["path"] == output_path
+    assert bin_model["valid_accuracy"] == best["valid_accuracy"]
+    assert bin_model["valid_accuracy"] > 0.9
+    assert ftz_model["path"] == str(tmp_path / "models" / "quality.ftz")
+    assert ftz_model["size_mb"] < bin_model["size_mb"]
+    assert ftz_model["valid_accuracy"] > 0.9
+
+    # only the models and the report are left, the sweep directory is removed
+    assert sorted(os.listdir(tmp_path / "models")) == ["quality.bin", "quality.ftz", "quality.json"]
+    with open(tmp_path / "models" / "quality.json") as f:
+        assert json.load(f) == json.loads(json.dumps(report))
@@ -0,0 +1,28 @@
+from cs336_data.url import group_urls_into_batches, normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url("HTTP://Example.COM:80#top") == "http://example.com/"
+    assert normalize_url("https://example.com:8443/a?utm_source=x&id=1&fbclid=y") == "https://example.com:8443/a?id=1"
+    # the rest of the query is not re-encoded
+    assert normalize_url("http://example.com/search?q") == "http://example.com/search?q"
+    assert normalize_url("http://example.com/?q=a%20b;c=d") == "http://example.com/?q=a%20b;c=d"
+    assert normalize_url("http://example.com/?q=a+b&UTM_Campaign=z&p=%2F") == "http://example.com/?q=a+b&p=%2F"
+    assert normalize_url("ftp://example.com/") is None
+    assert normalize_url("not a url") is None
+
+
+def test_group_urls_into_batches(tmp_path):
+    url_file = tmp_path / "urls.txt"
+    sizes = {"a.com": 7, "b.com": 5, "c.com": 4, "d.com": 3, "e.com": 1}
+    url_file.write_text("".join(f"http://www.{d}/{i}\nhttp://{d}/{i}?utm_source=x\nHTTP://{d}:80/{i}#top\n" for d, n in sizes.items() for i in range(n)))
+
+    batch_files = group_urls_into_batches(str(url_file), 8, str(tmp_path / "batches"))
+    batches = [open(path).read().split() for path in batch_files]
+    expected = [f"http://{host}/{i}" for d, n in sizes.items() for host in (d, f"www.{d}") for i in range(n)]
+    # deduplicated after dropping tracking parameters, and no domain split unless it is larger than a batch
+    assert sorted(url for batch in batches for url in batch) == sorted(expected)
+    assert all(len(batch) <= 8 for batch in batches)
+    for d in sizes:
+        if 2 * sizes[d] <= 8:
+            assert sum(any(d in url for url in batch) for batch in batches) == 1
@@ -0,0 +1,20 @@
+from cs336_data.url_filter import URLFilter, read_domain_list
+
+
+def test_url_filter_domains_and_patterns(tmp_path):
+    blocklist = tmp_path / "blocklist.txt"
+    blocklist.write_text("# ads\nblogspot.com\n0.0.0.0 Spam.Example.org\n*.tracker.net\nhttp://bad.io/path\n")
+    assert read_domain_list(str(blocklist)) == ["blogspot.com", "spam.example.org", "tracker.net", "bad.io"]
+
+    url_filter = URLFilter(read_domain_list(str(blocklist)), ["good.blogspot.com", "example.org"])
+    assert url_filter.reason("http://x.blogspot.com/post") == "blocklist:blogspot.com"
+    assert url_filter.reason("https://cdn.tracker.net/") == "blocklist:tracker.net"
+    # the most specific listed domain decides
+    assert url_filter.allowed("http://a.good.blogspot.com/post")
+    assert url_filter.reason("http://spam.example.org/") == "blocklist:spam.example.org"
+    assert url_filter.allowed("http://www.example.org/page")
+    # default patterns reject files and login pages, on any domain
+    assert url_filter.reason("http://www.example.org/paper.PDF?dl=1") == "pattern"
+    assert url_filter.reason("http://news.com/login") == "pattern"
+    assert url_filter.allowed("http://news.com/logins-explained")
+    assert URLFilter(patterns=[]).allowed("http://news.com/login")